@@ -1,5 +1,4 @@
 import logging
-import os
 
 import synapseclient
 
@@ -15,8 +14,7 @@ class Csv(FileTypeFormat):
 
     _process_kwargs = ["databaseSynId"]
 
-    def _validateFilename(self, filePath):
-        assert os.path.basename(filePath[0]).endswith(".csv")
+    _filename_patterns = ["*.csv"]
 
     def _process(self, df):
         df.columns = [df.upper() for col in df.columns]
@@ -29,9 +27,12 @@ class Csv(FileTypeFormat):
         df.to_csv(newPath, sep="\t", index=False)
         return newPath
 
-    def _validate(self, df):
+    def _validate_chunk(self, chunk, state):
+        state['rows'] = state.get('rows', 0) + len(chunk)
+
+    def _validate_finalize(self, state):
         total_error = ""
         warning = ""
-        if df.empty:
+        if not state.get('rows'):
             total_error += "{}: File must not be empty".format(self._fileType)
         return total_error, warning
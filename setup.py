@@ -22,6 +22,7 @@ setup(name='synapsegenie',
       author_email='thomas.yu@sagebionetworks.org',
       license='MIT',
       packages=find_packages(),
+      package_data={'example_registry': ['format_manifest.json']},
       zip_safe=False,
       python_requires='>=3.6',
       entry_points={'console_scripts': [
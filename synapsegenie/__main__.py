@@ -2,12 +2,14 @@
 # noqa pylint: disable=line-too-long
 """genie cli"""
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
 import logging
+import traceback
 
-import synapseclient
-
-from synapsegenie import (bootstrap, config, input_to_database,
-                          process_functions, validate, write_invalid_reasons)
+# Modules that import pandas or synapseclient are imported by the commands
+# that use them, so the CLI starts fast
+from synapsegenie import run_journal, validation_cache
 
 from .__version__ import __version__
 
@@ -15,13 +17,18 @@ from .__version__ import __version__
 logger = logging.getLogger('genie')
 
 
-def synapse_login(username=None, password=None):
+def synapse_login(username=None, password=None, auth_token=None):
     """
     This function logs into synapse for you if credentials are saved.
     If not saved, then user is prompted username and password.
+    Worker processes log in with the auth token of the main process.
 
     :returns:     Synapseclient object
     """
+    import synapseclient
+
+    if auth_token is not None:
+        return synapseclient.login(authToken=auth_token, silent=True)
     try:
         syn = synapseclient.login(silent=True)
     except Exception:
@@ -37,21 +44,210 @@ def synapse_login(username=None, password=None):
 
 def bootstrap_infra(syn, args):
     """Create GENIE-like infrastructure"""
+    from synapsegenie import bootstrap
+
     bootstrap.main(syn)
 
 
+def validate_cli_wrapper(syn, args):
+    """Validate CLI wrapper"""
+    from synapsegenie import validate
+
+    validate._perform_validate(syn, args)
+
+
 def process_cli_wrapper(syn, args):
     """Process CLI wrapper"""
     process(syn, args.process, args.project_id, center=args.center,
             pemfile=args.pemfile, delete_old=args.delete_old,
             only_validate=args.only_validate, debug=args.debug,
-            format_registry_packages=args.format_registry_packages)
+            format_registry_packages=args.format_registry_packages,
+            dry_run=args.dry_run, rebuild_threshold=args.rebuild_threshold,
+            file_view=args.file_view, threads=args.threads,
+            parallel_centers=args.parallel_centers,
+            validation_cache_path=args.validation_cache,
+            force_reprocess=args.force_reprocess, resume=args.resume,
+            max_table_memory=args.max_table_memory)
 
 
 def process(syn, process, project_id, center=None, pemfile=None,
             delete_old=False, only_validate=False, debug=False,
-            format_registry_packages=None):
+            format_registry_packages=None, dry_run=False,
+            rebuild_threshold=None, file_view=None, threads=1,
+            parallel_centers=1, validation_cache_path=None,
+            force_reprocess=False, resume=None, max_table_memory=None):
     """Process files"""
+    from synapsegenie import process_functions
+
+    if rebuild_threshold is not None and parallel_centers > 1:
+        # Centers share tables, which must not be rebuilt by two
+        # processes at once
+        raise ValueError("--rebuild-threshold can't be used with "
+                         "--parallel-centers")
+    with contextlib.ExitStack() as stack:
+        if dry_run:
+            # Table updates are logged instead of stored, nothing is
+            # emailed or uploaded
+            stack.enter_context(process_functions.dry_run())
+        if rebuild_threshold is not None:
+            project = syn.get(project_id)
+            stack.enter_context(process_functions.table_rebuilds(
+                project.annotations['dbMapping'][0],
+                changed_ratio=rebuild_threshold))
+        if max_table_memory is not None:
+            stack.enter_context(process_functions.out_of_core_updates(
+                max_table_memory * 1024**2))
+        cache = None
+        if validation_cache_path is not None:
+            cache = validation_cache.ValidationCache(validation_cache_path)
+        stack.enter_context(validation_cache.use_validation_cache(cache))
+        # Dry runs don't store anything, so there is nothing to resume
+        journal = None
+        if resume is not None:
+            journal = run_journal.RunJournal.resume(resume)
+            logger.info(f"RESUMING RUN {journal.run_id}")
+        elif not dry_run:
+            journal = run_journal.RunJournal()
+            logger.info(f"RUN ID: {journal.run_id}")
+        stack.enter_context(run_journal.use_run_journal(journal))
+        _process(syn, process, project_id, center=center, pemfile=pemfile,
+                 delete_old=delete_old, only_validate=only_validate,
+                 debug=debug,
+                 format_registry_packages=format_registry_packages,
+                 file_view=file_view, threads=threads,
+                 parallel_centers=parallel_centers, dry_run=dry_run,
+                 cache=cache, force_reprocess=force_reprocess,
+                 run_id=journal.run_id if journal is not None else None,
+                 max_table_memory=max_table_memory)
+
+
+def _open_processed_ledger(syn, database_synid_mappingdf, only_validate,
+                           force_reprocess):
+    """Ledger of processed files, None if files are only validated"""
+    from synapsegenie import processed_ledger
+
+    if only_validate:
+        return None
+    return processed_ledger.ProcessedLedger(
+        syn=syn,
+        table_synid=processed_ledger.get_ledger_table_synid(
+            database_synid_mappingdf
+        ),
+        force=force_reprocess
+    )
+
+
+def _process_center(project_id, center, process, only_validate,
+                    database_to_synid_mappingdf, center_mapping_df,
+                    delete_old=False, format_registry_packages=None,
+                    file_view=None, threads=1, dry_run=False,
+                    cache=None, force_reprocess=False, run_id=None,
+                    max_table_memory=None, auth_token=None):
+    """Process the files of a center in a worker process.  The worker logs
+    into Synapse with the auth token of the main process, or with cached
+    credentials without one, and its center is logged to the center's own
+    log file.
+
+    Returns:
+        str: Traceback if processing the center failed, otherwise None
+    """
+    from synapsegenie import (config, input_to_database, process_functions,
+                              processed_ledger)
+
+    handlers = list(input_to_database.logger.handlers)
+    try:
+        syn = synapse_login(auth_token=auth_token)
+        with contextlib.ExitStack() as stack:
+            if dry_run:
+                stack.enter_context(process_functions.dry_run())
+            if max_table_memory is not None:
+                stack.enter_context(process_functions.out_of_core_updates(
+                    max_table_memory * 1024**2))
+            stack.enter_context(
+                validation_cache.use_validation_cache(cache)
+            )
+            if run_id is not None:
+                stack.enter_context(run_journal.use_run_journal(
+                    run_journal.RunJournal(run_id)
+                ))
+            stack.enter_context(processed_ledger.use_processed_ledger(
+                _open_processed_ledger(syn, database_to_synid_mappingdf,
+                                       only_validate, force_reprocess)
+            ))
+            format_registry = config.collect_format_types(
+                format_registry_packages
+            )
+            inventory = None
+            if file_view is not None:
+                inventory = input_to_database.FileViewInventory(syn,
+                                                                file_view)
+            input_to_database.center_input_to_database(
+                syn, project_id, center, process,
+                only_validate, database_to_synid_mappingdf,
+                center_mapping_df,
+                delete_old=delete_old,
+                format_registry=format_registry,
+                inventory=inventory,
+                threads=threads
+            )
+    except Exception:
+        # Log the failure to the center's log file
+        input_to_database.logger.exception(f"PROCESSING {center} FAILED")
+        return traceback.format_exc()
+    finally:
+        # Worker processes are reused, remove the center's log file handler
+        for handler in list(input_to_database.logger.handlers):
+            if handler not in handlers:
+                input_to_database.logger.removeHandler(handler)
+                handler.close()
+    return None
+
+
+def _process_centers_in_parallel(centers, parallel_centers, **kwargs):
+    """Process centers concurrently in worker processes.  A failed center
+    doesn't stop the other centers from being processed.
+
+    Args:
+        centers: Centers to process
+        parallel_centers: Number of centers to process at once
+        **kwargs: _process_center parameters
+
+    Returns:
+        dict: Traceback of each center that failed
+    """
+    failed_centers = {}
+    workers = min(parallel_centers, len(centers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_process_center, center=process_center,
+                            **kwargs): process_center
+            for process_center in centers
+        }
+        for future in as_completed(futures):
+            process_center = futures[future]
+            try:
+                error = future.result()
+            except Exception:
+                # The worker process itself died
+                error = traceback.format_exc()
+            if error is None:
+                logger.info(f"FINISHED PROCESSING {process_center}")
+            else:
+                logger.error(f"{process_center} FAILED:\n{error}")
+                failed_centers[process_center] = error
+    return failed_centers
+
+
+def _process(syn, process, project_id, center=None, pemfile=None,
+             delete_old=False, only_validate=False, debug=False,
+             format_registry_packages=None, file_view=None, threads=1,
+             parallel_centers=1, dry_run=False, cache=None,
+             force_reprocess=False, run_id=None, max_table_memory=None):
+    """Process files of each center"""
+    from synapsegenie import (config, input_to_database, process_functions,
+                              processed_ledger, validate,
+                              write_invalid_reasons)
+
     # Get the Synapse Project where data is stored
     # Should have annotations to find the table lookup
     project = syn.get(project_id)
@@ -82,16 +278,49 @@ def process(syn, process, project_id, center=None, pemfile=None,
         center_mapping_df = center_mapping_df[center_mapping_df['release']]
         centers = center_mapping_df.center
 
-    format_registry = config.collect_format_types(format_registry_packages)
-
-    for process_center in centers:
-        input_to_database.center_input_to_database(
-            syn, project_id, process_center, process,
-            only_validate, databaseToSynIdMappingDf,
-            center_mapping_df,
+    failed_centers = {}
+    if parallel_centers > 1 and len(centers) > 1:
+        # Workers can't prompt for credentials, they log in as this client
+        auth_token = None
+        if syn.credentials is not None:
+            auth_token = syn.credentials.secret
+        failed_centers = _process_centers_in_parallel(
+            list(centers), parallel_centers,
+            project_id=project_id, process=process,
+            only_validate=only_validate,
+            database_to_synid_mappingdf=databaseToSynIdMappingDf,
+            center_mapping_df=center_mapping_df,
             delete_old=delete_old,
-            format_registry=format_registry
+            format_registry_packages=format_registry_packages,
+            file_view=file_view, threads=threads, dry_run=dry_run,
+            cache=cache, force_reprocess=force_reprocess, run_id=run_id,
+            max_table_memory=max_table_memory, auth_token=auth_token
         )
+    else:
+        format_registry = config.collect_format_types(
+            format_registry_packages
+        )
+        # One file view query lists the input files of all the centers
+        inventory = None
+        if file_view is not None:
+            inventory = input_to_database.FileViewInventory(syn, file_view)
+
+        ledger = _open_processed_ledger(syn, databaseToSynIdMappingDf,
+                                        only_validate, force_reprocess)
+        # The centers share the project, validators and reference data
+        session = validate.ValidationSession(syn, project_id, format_registry)
+        with processed_ledger.use_processed_ledger(ledger):
+            for process_center in centers:
+                input_to_database.center_input_to_database(
+                    syn, project_id, process_center, process,
+                    only_validate, databaseToSynIdMappingDf,
+                    center_mapping_df,
+                    delete_old=delete_old,
+                    format_registry=format_registry,
+                    inventory=inventory,
+                    threads=threads,
+                    validation_session=session
+                )
 
     error_tracker_synid = process_functions.getDatabaseSynId(
         syn, "errorTracker", databaseToSynIdMappingDf=databaseToSynIdMappingDf
@@ -103,6 +332,9 @@ def process(syn, process, project_id, center=None, pemfile=None,
         write_invalid_reasons.write_invalid_reasons(
             syn, center_mapping_df, error_tracker_synid
         )
+    if failed_centers:
+        raise RuntimeError("Processing failed for centers: {}".format(
+            ", ".join(failed_centers)))
 
 def build_parser():
     """Build CLI parsers"""
@@ -158,7 +390,16 @@ def build_parser():
     parser_validate.add_argument("--nosymbol-check", action='store_true',
                                  help='Do not check hugo symbols of fusion and cna file')
 
-    parser_validate.set_defaults(func=validate._perform_validate)
+    parser_validate.add_argument(
+        "--validation-cache", type=str, nargs="?",
+        const=validation_cache.VALIDATION_CACHE_PATH,
+        help="Cache validation results locally, files with the same "
+             "content are only validated once.  Delete the cache when "
+             "reference data such as the oncotree changes "
+             "(default path: %(const)s)"
+    )
+
+    parser_validate.set_defaults(func=validate_cli_wrapper)
 
     parser_bootstrap = subparsers.add_parser('bootstrap-infra',
                                             help='Create GENIE-like infra')
@@ -201,6 +442,56 @@ def build_parser():
         "--debug", action='store_true',
         help="Add debug mode to synapse"
     )
+    parser_process.add_argument(
+        "--file-view", type=str,
+        help="Synapse id of a file view of the center input files and "
+             "folders.  If specified, input files are listed with one "
+             "query instead of walking the input folders"
+    )
+    parser_process.add_argument(
+        "--rebuild-threshold", type=float,
+        help="Rebuild a table as a new table when more than this fraction "
+             "of its rows change, instead of updating it row by row"
+    )
+    parser_process.add_argument(
+        "--max-table-memory", type=int, metavar="MB",
+        help="Diff the center partitions of tables on disk within this "
+             "many megabytes of memory instead of loading them whole"
+    )
+    parser_process.add_argument(
+        "--threads", type=int, default=1,
+        help="Number of processes to validate a center's files with "
+             "(default: %(default)s)"
+    )
+    parser_process.add_argument(
+        "--parallel-centers", type=int, default=1,
+        help="Number of centers to process at once, each in its own "
+             "process (default: %(default)s)"
+    )
+    parser_process.add_argument(
+        "--validation-cache", type=str, nargs="?",
+        const=validation_cache.VALIDATION_CACHE_PATH,
+        help="Cache validation results locally, files with the same "
+             "content are only validated once.  Delete the cache when "
+             "reference data such as the oncotree changes "
+             "(default path: %(const)s)"
+    )
+    parser_process.add_argument(
+        "--force-reprocess", action='store_true',
+        help="Process valid files even if they haven't changed since they "
+             "were last processed"
+    )
+    parser_process.add_argument(
+        "--resume", type=str, metavar="RUN_ID",
+        help="Resume a run that died from the stages it completed.  The "
+             "run id is logged at the start of each run"
+    )
+    parser_process.add_argument(
+        "--dry-run", action='store_true',
+        help="Log the rows each table update would append, update and "
+             "delete without storing them.  No file is uploaded and no "
+             "email is sent"
+    )
     # DEFAULT PARAMS
     parser_process.add_argument(
         "--format_registry_packages", type=str, nargs="+",
@@ -66,6 +66,30 @@ def create_status_table(syn, parent):
                          parent=parent)
 
 
+def create_processed_ledger_table(syn, parent):
+    """Set up the table that records the files that were processed, so
+    unchanged files are not processed again.
+    """
+    ledger_table_col_defs = [
+        {'name': 'id',
+         'columnType': 'ENTITYID'},
+        {'name': 'md5',
+         'columnType': 'STRING',
+         'maximumSize': 1000},
+        {'name': 'fileType',
+         'columnType': 'STRING',
+         'maximumSize': 50},
+        {'name': 'databaseSynId',
+         'columnType': 'ENTITYID'},
+        {'name': 'processorVersion',
+         'columnType': 'STRING',
+         'maximumSize': 64}
+    ]
+    return _create_table(syn, name="Processed Ledger Table",
+                         col_config=ledger_table_col_defs,
+                         parent=parent)
+
+
 def main(syn):
 
     # Basic setup of the project
@@ -114,6 +138,9 @@ def main(syn):
     # Set up the table that holds the validation status of all submitted files.
     status_schema = create_status_table(syn, project)
 
+    # Set up the table that records the files that were processed.
+    ledger_schema = create_processed_ledger_table(syn, project)
+
     # Set up the table that maps the center abbreviation to the folder where
     # their data is uploaded. This is used by the GENIE framework to find the
     # files to validate for a center.
@@ -207,9 +234,9 @@ def main(syn):
     # Add the tables we already created to the mapping table.
     dbmap_df = pandas.DataFrame(
         dict(Database=['centerMapping', 'validationStatus', 'errorTracker',
-                       'dbMapping', 'logs'], 
+                       'dbMapping', 'logs', 'processedLedger'], 
              Id=[center_schema.id, status_schema.id, error_schema.id,
-                 db_map_schema.id, logs_folder.id])
+                 db_map_schema.id, logs_folder.id, ledger_schema.id])
     )
 
     db_map_tbl = synapseclient.Table(schema=db_map_schema, values=dbmap_df)
@@ -1,6 +1,30 @@
-"""Configuration to obtain registry classes"""
+"""Configuration to obtain registry classes
+
+The formats of a registry package are found, in order of preference, from:
+
+- A manifest, format_manifest.json at the root of the package, that maps
+  each file type to its class and filename patterns.  It is generated with
+  write_format_manifest.
+- Entry points of the synapsegenie.formats group named after the file types,
+  such as ``csv = example_registry.csv:Csv``.
+- The subclasses of FileTypeFormat in the package, after importing it.
+
+Formats from a manifest are only imported when they are used.  Entry
+points don't carry the filename patterns of their formats, so formats from
+entry points are all imported the first time a file type is determined.
+Packages that want their formats imported on demand ship a manifest, which
+is preferred over their entry points.
+
+A format module that defines formats its manifest doesn't list is logged
+when it is imported, the manifest has to be written again.
+"""
+from collections import namedtuple
 import importlib
+import importlib.util
+import json
 import logging
+import os
+import re
 
 from . import example_filetype_format
 
@@ -10,6 +34,16 @@ logger.setLevel(logging.INFO)
 
 # BASE_CLASS = example_filetype_format.FileTypeFormat
 
+FORMAT_ENTRY_POINT_GROUP = "synapsegenie.formats"
+FORMAT_MANIFEST = "format_manifest.json"
+
+# Format class that is imported the first time it is used.  target is a
+# module:Class reference, filename_patterns is None when the patterns are
+# only known once the class is imported
+FormatReference = namedtuple("FormatReference",
+                             ["target", "filename_patterns"])
+
+
 def make_format_registry_dict(cls_list):
     """Use an object's _fileType attribute to make a class lookup dictionary.
 
@@ -23,6 +57,174 @@ def make_format_registry_dict(cls_list):
     return {cls._fileType: cls for cls in cls_list}
 
 
+def load_format_class(target):
+    """Import a format class
+
+    Args:
+        target: module:Class reference of the class
+
+    Returns:
+        The format class
+    """
+    module_name, _, class_name = target.partition(":")
+    format_cls = importlib.import_module(module_name)
+    for attribute in class_name.split("."):
+        format_cls = getattr(format_cls, attribute)
+    return format_cls
+
+
+class FormatRegistry(dict):
+    """Format classes by file type, with a dispatch index compiled from the
+    filename patterns the classes declare.  The index is compiled once per
+    center and resolves the file type of a single file in one match.
+
+    Formats can be added as references, which are imported the first time
+    the registry returns them."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indexes = {}
+        self._references = {}
+        self._checked_modules = set()
+
+    def add_reference(self, file_type, target, filename_patterns=None):
+        """Add a format that is imported the first time it is used
+
+        Args:
+            file_type: File type
+            target: module:Class reference of the format class
+            filename_patterns: Filename patterns of the format class.
+                               None if they are only known once the class
+                               is imported
+        """
+        super().__setitem__(file_type, None)
+        self._references[file_type] = FormatReference(target,
+                                                      filename_patterns)
+        self._indexes = {}
+
+    def __getitem__(self, file_type):
+        format_cls = super().__getitem__(file_type)
+        if format_cls is None and file_type in self._references:
+            reference = self._references[file_type]
+            logger.debug(f"importing {reference.target}.")
+            format_cls = load_format_class(reference.target)
+            super().__setitem__(file_type, format_cls)
+            del self._references[file_type]
+            self._warn_unlisted_formats(reference.target.partition(":")[0])
+        return format_cls
+
+    def _warn_unlisted_formats(self, module_name):
+        """Warns about the formats of an imported module that the registry
+        doesn't have, such as formats added after the manifest was written"""
+        if module_name in self._checked_modules:
+            return
+        self._checked_modules.add(module_name)
+        module = importlib.import_module(module_name)
+        unlisted = sorted(
+            cls._fileType for cls in vars(module).values()
+            if isinstance(cls, type) and
+            issubclass(cls, example_filetype_format.FileTypeFormat) and
+            cls.__module__ == module_name and cls._fileType not in self
+        )
+        if unlisted:
+            logger.warning(f"{module_name} DEFINES FORMATS THAT AREN'T "
+                           f"REGISTERED: {', '.join(unlisted)}.  THE FORMAT "
+                           "MANIFEST MAY HAVE TO BE WRITTEN AGAIN")
+
+    def get(self, file_type, default=None):
+        return self[file_type] if file_type in self else default
+
+    def values(self):
+        return [self[file_type] for file_type in self]
+
+    def items(self):
+        return [(file_type, self[file_type]) for file_type in self]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._references.pop(key, None)
+        self._indexes = {}
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._references.pop(key, None)
+        self._indexes = {}
+
+    def update(self, *args, **kwargs):
+        for file_type, format_cls in dict(*args, **kwargs).items():
+            self[file_type] = format_cls
+
+    def __reduce__(self):
+        # Formats that aren't imported yet are sent to other processes as
+        # references
+        return (self.__class__, (dict(dict.items(self)),), self.__dict__)
+
+    def _get_filename_patterns(self, file_type):
+        """Filename patterns of a file type, without importing its class.
+        None if they are only known once the class is imported."""
+        if file_type in self._references:
+            return self._references[file_type].filename_patterns
+        return super().__getitem__(file_type)._filename_patterns
+
+    def _get_index(self, center):
+        """Dispatch index of a center
+
+        Returns:
+            tuple: Compiled regex of the single file patterns, file type of
+                   each of its groups and (file type, regexes) of the
+                   patterns of several files
+        """
+        if center not in self._indexes:
+            alternatives = []
+            group_filetypes = {}
+            multi_file_patterns = []
+            for file_type in self:
+                patterns = self._get_filename_patterns(file_type)
+                if not patterns:
+                    continue
+                for regexes in example_filetype_format.\
+                        compile_filename_patterns(patterns, center):
+                    if len(regexes) == 1:
+                        group = f"f{len(group_filetypes)}"
+                        group_filetypes[group] = file_type
+                        alternatives.append(f"(?P<{group}>{regexes[0]})")
+                    else:
+                        multi_file_patterns.append((file_type, regexes))
+            single_file_regex = (re.compile("|".join(alternatives))
+                                 if alternatives else None)
+            self._indexes[center] = (single_file_regex, group_filetypes,
+                                     multi_file_patterns)
+        return self._indexes[center]
+
+    def match_filetype(self, filenames, center):
+        """File type of a file group from the filename patterns
+
+        Args:
+            filenames: Filenames or paths of the files of the group
+            center: Center name
+
+        Returns:
+            str: File type.  None if no pattern matches
+        """
+        filenames = [os.path.basename(filename) for filename in filenames]
+        single_file_regex, group_filetypes, multi_file_patterns = \
+            self._get_index(center)
+        if len(filenames) == 1 and single_file_regex is not None:
+            match = single_file_regex.fullmatch(filenames[0])
+            if match is not None:
+                return group_filetypes[match.lastgroup]
+        for file_type, regexes in multi_file_patterns:
+            if example_filetype_format.filenames_match(regexes, filenames):
+                return file_type
+        return None
+
+    def legacy_filetypes(self):
+        """File types without filename patterns, which are determined by
+        _validateFilename"""
+        return [file_type for file_type in self
+                if not self._get_filename_patterns(file_type)]
+
+
 def get_subclasses(cls):
     """Gets subclasses of modules and classes"""
     for subclass in cls.__subclasses__():
@@ -55,22 +257,122 @@ def find_subclasses(package_names, base_class):
     return matching_classes
 
 
+def _read_format_manifest(package_name):
+    """Reads the format manifest of a package without importing it
+
+    Args:
+        package_name: Python package name
+
+    Returns:
+        dict: {file type: {'class': 'module:Class',
+                           'filename_patterns': [...]}}.
+              None if the package doesn't have a manifest
+    """
+    spec = importlib.util.find_spec(package_name)
+    if spec is None or spec.submodule_search_locations is None:
+        return None
+    for location in spec.submodule_search_locations:
+        manifest_path = os.path.join(location, FORMAT_MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                return json.load(manifest_file)
+    return None
+
+
+def _get_format_entry_points():
+    """Entry points of the synapsegenie.formats group"""
+    try:
+        from importlib import metadata
+    except ImportError:
+        # Python < 3.8
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            return []
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=FORMAT_ENTRY_POINT_GROUP))
+    return list(entry_points.get(FORMAT_ENTRY_POINT_GROUP, []))
+
+
 def collect_format_types(package_names):
     """Finds subclasses of the example_filetype_format.FileTypeFormat from a
-    list of package names.
+    list of package names.  Packages with a format manifest or entry points
+    are not imported, their formats are imported when they are used.
 
     Args:
         package_names: A list of Python package names as strings.
 
     Returns:
-        A list of classes that are in the named packages and subclasses of
+        FormatRegistry mapping the file types to the classes that are in the
+        named packages and subclasses of
         example_filetype_format.FileTypeFormat.
 
     """
-    file_format_list = find_subclasses(package_names,
-                                       example_filetype_format.FileTypeFormat)
-    file_format_dict = make_format_registry_dict(file_format_list)
-    return file_format_dict
+    format_registry = FormatRegistry()
+    entry_points = None
+    scanned_packages = []
+    for package_name in package_names:
+        manifest = _read_format_manifest(package_name)
+        if manifest is not None:
+            for file_type, format_spec in manifest.items():
+                format_registry.add_reference(
+                    file_type, format_spec['class'],
+                    format_spec.get('filename_patterns')
+                )
+            continue
+        if entry_points is None:
+            entry_points = _get_format_entry_points()
+        package_entry_points = [
+            entry_point for entry_point in entry_points
+            if re.split(r"[.:]", entry_point.value)[0] == package_name
+        ]
+        if package_entry_points:
+            for entry_point in package_entry_points:
+                format_registry.add_reference(entry_point.name,
+                                              entry_point.value)
+            continue
+        scanned_packages.append(package_name)
+
+    if scanned_packages:
+        file_format_list = find_subclasses(
+            scanned_packages, example_filetype_format.FileTypeFormat
+        )
+        format_registry.update(make_format_registry_dict(file_format_list))
+    return format_registry
+
+
+def write_format_manifest(package_name, path=None):
+    """Writes the format manifest of a registry package, so that its formats
+    are only imported when they are used.  The manifest has to be written
+    again when formats are added or their filename patterns change.
+
+    Args:
+        package_name: Python package name
+        path: Path of the manifest.  Defaults to format_manifest.json at the
+              root of the package
+
+    Returns:
+        str: Path of the manifest
+    """
+    file_format_list = find_subclasses(
+        [package_name], example_filetype_format.FileTypeFormat
+    )
+    manifest = {
+        cls._fileType: {
+            'class': f"{cls.__module__}:{cls.__qualname__}",
+            'filename_patterns': cls._filename_patterns
+        }
+        for cls in file_format_list
+    }
+    if path is None:
+        package = importlib.import_module(package_name)
+        path = os.path.join(os.path.dirname(package.__file__),
+                            FORMAT_MANIFEST)
+    with open(path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.write("\n")
+    return path
 
 # PROCESS_FILES_LIST = [x for x in get_subclasses(BASE_CLASS)]
 # PROCESS_FILES = make_format_registry_dict(cls_list=PROCESS_FILES_LIST)
@@ -1,10 +1,87 @@
+import itertools
 import logging
 import os
+import re
 
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+CENTER_PLACEHOLDER = "{center}"
+
+
+def _glob_to_regex(glob):
+    """Regex of a glob that supports * and ?"""
+    return "".join(".*" if char == "*" else "." if char == "?"
+                   else re.escape(char) for char in glob)
+
+
+def compile_filename_pattern(pattern, center):
+    """Regex of a filename pattern.  Patterns that start with ^ are regexes,
+    other patterns are globs.  {center} is replaced by the center name.
+
+    Args:
+        pattern: Filename pattern
+        center: Center name
+
+    Returns:
+        str: Regex that matches the whole filename
+    """
+    if pattern.startswith("^"):
+        return pattern.replace(CENTER_PLACEHOLDER, re.escape(center))
+    return re.escape(center).join(
+        _glob_to_regex(part) for part in pattern.split(CENTER_PLACEHOLDER)
+    )
+
+
+def compile_filename_patterns(patterns, center):
+    """Regexes of the filename patterns of a file type
+
+    Args:
+        patterns: Filename patterns.  A pattern is a filename pattern or a
+                  list of filename patterns, one per file
+        center: Center name
+
+    Returns:
+        list: Tuple of regexes per pattern, one regex per file
+    """
+    return [
+        tuple(compile_filename_pattern(file_pattern, center)
+              for file_pattern in ([pattern] if isinstance(pattern, str)
+                                   else pattern))
+        for pattern in patterns
+    ]
+
+
+def filenames_match(regexes, filenames):
+    """Whether every file of a group matches one of the regexes of a file
+    type, in any order
+
+    Args:
+        regexes: Regexes of the files of a file type
+        filenames: Basenames of the files of a group
+
+    Returns:
+        bool
+    """
+    if len(regexes) != len(filenames):
+        return False
+    return any(
+        all(re.fullmatch(regex, filename)
+            for regex, filename in zip(regexes, ordered))
+        for ordered in itertools.permutations(filenames)
+    )
+
+
+class _FileReadError(Exception):
+    """A file that is validated in chunks can't be read"""
+
+
+def _read_error(filePathList, exception):
+    """Error of files that can't be read"""
+    return "The file(s) ({filePathList}) cannot be read. Original error: {exception}".format(filePathList=filePathList,
+                                                                                            exception=str(exception))
+
 
 class FileTypeFormat(object):
 
@@ -14,6 +91,19 @@ class FileTypeFormat(object):
 
     _validation_kwargs = []
 
+    # Rows per chunk of the files of formats that validate in chunks
+    _validation_chunksize = 100000
+
+    # Filename patterns of the file type, compiled into the dispatch index of
+    # the format registry.  A pattern is a glob or a regex starting with ^,
+    # or a list of patterns for file types made of several files.
+    # {center} is replaced by the center name.  File types without patterns
+    # are determined by _validateFilename
+    _filename_patterns = []
+
+    # ValidationSession of the validator, set when the session creates it
+    session = None
+
     def __init__(self, syn, center, poolSize=1):
         self.syn = syn
         self.center = center
@@ -36,6 +126,23 @@ class FileTypeFormat(object):
         df = pd.read_csv(filePath, sep="\t", comment="#")
         return(df)
 
+    def _get_dataframe_chunks(self, filePathList, chunksize):
+        '''
+        Reads the file in chunks for formats that validate in chunks.
+        Formats that change _get_dataframe have to change this too.
+
+        Args:
+            filePathList:  A list of file paths (Max is 2 for the two
+                           clinical files)
+            chunksize: Number of rows per chunk
+
+        Returns:
+            Iterator of pandas dataframes of chunksize rows of the file
+        '''
+        filePath = filePathList[0]
+        return pd.read_csv(filePath, sep="\t", comment="#",
+                           chunksize=chunksize)
+
     def read_file(self, filePathList):
         '''
         Each file is to be read in for validation and processing.
@@ -51,16 +158,34 @@ class FileTypeFormat(object):
         df = self._get_dataframe(filePathList)
         return(df)
 
+    @classmethod
+    def get_filename_regexes(cls, center):
+        '''
+        Regexes of the filename patterns of the file type
+
+        Args:
+            center: Center name
+
+        Returns:
+            list: Tuple of regexes per pattern, one regex per file
+        '''
+        return compile_filename_patterns(cls._filename_patterns, center)
+
     def _validateFilename(self, filePath):
         '''
         Function that changes per file type for validating its filename
-        Expects an assertion error.
+        Expects an assertion error.  By default the filenames must match
+        one of self._filename_patterns
 
         Args:
             filePath: Path to file
         '''
-        # assert True
-        raise NotImplementedError
+        if not self._filename_patterns:
+            raise NotImplementedError
+        filenames = [os.path.basename(path) for path in filePath]
+        assert any(filenames_match(regexes, filenames)
+                   for regexes in self.get_filename_regexes(self.center)), \
+            "Filenames don't match the %s filename patterns" % self._fileType
 
     def validateFilename(self, filePath):
         '''
@@ -76,6 +201,22 @@ class FileTypeFormat(object):
         self._validateFilename(filePath)
         return(self._fileType)
 
+    def get_reference_data(self, key, load):
+        '''
+        Reference data needed to validate files, such as a code list.
+        The data is loaded once per validation session.
+
+        Args:
+            key: Name of the reference data
+            load: Function that loads the reference data
+
+        Returns:
+            The reference data
+        '''
+        if self.session is None:
+            return load()
+        return self.session.get_reference_data(key, load)
+
     def process_steps(self, df, **kwargs):
         '''
         This function is modified for every single file.
@@ -142,6 +283,63 @@ class FileTypeFormat(object):
         logger.info("NO VALIDATION for %s files" % self._fileType)
         return(errors, warnings)
 
+    def _validate_chunk(self, chunk, state, **kwargs):
+        '''
+        Validation of a chunk of the file.  Formats that implement it are
+        validated in chunks of self._validation_chunksize rows instead of
+        reading the whole file, and must implement _validate_finalize.
+
+        Args:
+            chunk: A dataframe of rows of the file
+            state: dict shared by the chunks of the file, in which the
+                   chunk records what _validate_finalize needs
+            kwargs: The kwargs are determined by self._validation_kwargs
+        '''
+        raise NotImplementedError
+
+    def _validate_finalize(self, state, **kwargs):
+        '''
+        Validation of a file once every chunk is validated
+
+        Args:
+            state: dict the chunks of the file recorded into
+            kwargs: The kwargs are determined by self._validation_kwargs
+
+        Returns:
+            tuple: The errors and warnings as a file from validation.
+        '''
+        raise NotImplementedError
+
+    def _validates_in_chunks(self):
+        '''Whether the format implements _validate_chunk'''
+        return (type(self)._validate_chunk is not
+                FileTypeFormat._validate_chunk)
+
+    def _validate_in_chunks(self, chunks, **kwargs):
+        '''
+        Feeds the chunks of a file to _validate_chunk, then finalizes
+
+        Args:
+            chunks: Iterator of dataframes of the file
+            kwargs: The kwargs are determined by self._validation_kwargs
+
+        Returns:
+            tuple: The errors and warnings as a file from validation.
+
+        Raises:
+            _FileReadError: A chunk can't be read
+        '''
+        state = {}
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            except Exception as e:
+                raise _FileReadError(e) from e
+            self._validate_chunk(chunk, state, **kwargs)
+        return self._validate_finalize(state, **kwargs)
+
     def validate(self, filePathList, **kwargs):
         '''
         This is the main validation function.
@@ -160,17 +358,30 @@ class FileTypeFormat(object):
             mykwargs[required_parameter] = kwargs[required_parameter]
 
         errors = ""
+        in_chunks = self._validates_in_chunks()
 
         try:
-            df = self.read_file(filePathList)
+            if in_chunks:
+                chunks = iter(self._get_dataframe_chunks(
+                    filePathList, self._validation_chunksize
+                ))
+            else:
+                df = self.read_file(filePathList)
         except Exception as e:
-            errors = "The file(s) ({filePathList}) cannot be read. Original error: {exception}".format(filePathList=filePathList,
-                                                                                                       exception=str(e))
+            errors = _read_error(filePathList, e)
             warnings = ""
 
         if not errors:
             logger.info("VALIDATING %s" % os.path.basename(",".join(filePathList)))
-            errors, warnings = self._validate(df, **mykwargs)
+            if in_chunks:
+                try:
+                    errors, warnings = self._validate_in_chunks(chunks,
+                                                                **mykwargs)
+                except _FileReadError as e:
+                    errors = _read_error(filePathList, e.__cause__)
+                    warnings = ""
+            else:
+                errors, warnings = self._validate(df, **mykwargs)
         
         valid = (errors == '')
         
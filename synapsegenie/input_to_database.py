@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
-from collections import defaultdict
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import datetime
+import functools
 import logging
+import multiprocessing
 import os
 import time
 from typing import List
 
+import requests
 import synapseclient
 from synapseclient.core.utils import to_unix_epoch_time
 import synapseutils
 import pandas as pd
 
-from . import process_functions, validate
+from . import (process_functions, processed_ledger, run_journal, validate,
+               validation_cache)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,12 +27,6 @@ DUPLICATED_FILE_ERROR = (
     "and the entire dataset should be uploaded."
 )
 
-'''
-TODO:
-Could potentially get all the inforamation of the file entity right here
-To avoid the syn.get rest call later which doesn't actually download the file
-'''
-
 # def rename_file(ent):
 #     '''
 #     Gets file from synapse and renames the file if necessary.
@@ -56,7 +55,235 @@ def entity_date_to_timestamp(entity_date_time):
     return to_unix_epoch_time(date_time_obj)
 
 
-def get_center_input_files(syn, synid, center, process="main", downloadFile=True):
+# Number of entities fetched at once, times a failed fetch is retried and
+# seconds to wait in between
+ENTITY_FETCH_THREADS = 8
+ENTITY_FETCH_RETRIES = 3
+ENTITY_FETCH_RETRY_WAIT = 2
+
+
+def _get_entity(syn, ent_synid, downloadFile=True,
+                retries=ENTITY_FETCH_RETRIES, **kwargs):
+    """
+    Get an entity, retrying failed requests
+
+    Args:
+        syn: Synapse object
+        ent_synid: Synapse id of entity
+        downloadFile: Download the file. Defaults to True
+        retries: Number of times to retry. Defaults to ENTITY_FETCH_RETRIES
+        kwargs: Other arguments of syn.get, such as version
+
+    Returns:
+        tuple: entity, dict of synid, attempts and seconds taken
+    """
+    start = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            ent = syn.get(ent_synid, downloadFile=downloadFile, **kwargs)
+            break
+        except requests.exceptions.RequestException as error:
+            # Only connection errors, throttling and server errors are retried
+            response = error.response
+            retry = response is None or response.status_code == 429 or \
+                response.status_code >= 500
+            if not retry or attempts > retries:
+                raise
+            logger.warning("Retrying {}".format(ent_synid))
+            time.sleep(ENTITY_FETCH_RETRY_WAIT * attempts)
+    stats = {'synid': ent_synid, 'attempts': attempts,
+             'seconds': time.time() - start}
+    return ent, stats
+
+
+def _download_entities(syn, entities, threads=ENTITY_FETCH_THREADS):
+    """
+    Download the files of entities that were fetched without their files
+
+    Args:
+        syn: Synapse object
+        entities: List of file entities
+        threads: Number of files downloaded at once.
+                 Defaults to ENTITY_FETCH_THREADS
+
+    Returns:
+        list: Entities with their files downloaded, in the same order
+    """
+    def download(ent):
+        if getattr(ent, 'path', None) is not None:
+            return ent
+        downloaded, _ = _get_entity(syn, ent.id, version=ent.versionNumber)
+        return downloaded
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(download, entities))
+
+
+def _download_valid_files(syn, validfiles):
+    """
+    Download the valid files that were not downloaded for validation
+
+    Args:
+        syn: Synapse object
+        validfiles: Valid files dataframe with 'id' and 'path' columns
+
+    Returns:
+        Dataframe: validfiles with every path filled in
+    """
+    missing = validfiles['path'].isnull()
+    if missing.any():
+        logger.info("DOWNLOADING {} VALID FILES".format(missing.sum()))
+        validfiles = validfiles.copy()
+        with ThreadPoolExecutor(max_workers=ENTITY_FETCH_THREADS) as executor:
+            entities = executor.map(lambda synid: _get_entity(syn, synid)[0],
+                                    validfiles['id'][missing])
+            validfiles.loc[missing, 'path'] = [ent.path for ent in entities]
+    return validfiles
+
+
+class FileInventory(object):
+    """
+    Lists the files of center input folders.  Files are listed by name and
+    synid first, so files can be skipped before their entities are fetched.
+    """
+
+    def __init__(self, syn, threads=ENTITY_FETCH_THREADS):
+        self.syn = syn
+        self.threads = threads
+
+    def list_files(self, synid):
+        """
+        List the files in a folder and its subfolders
+
+        Args:
+            synid: Folder synid
+
+        Returns:
+            list: (name, synid) of each file
+        """
+        raise NotImplementedError
+
+    def get_entities(self, synids, downloadFile=True):
+        """
+        Get the entities of files
+
+        Args:
+            synids: Synapse ids of files
+            downloadFile: Download the files. Defaults to True
+
+        Returns:
+            list: (entity, fetch stats) of each file, in the same order
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return list(executor.map(
+                lambda synid: _get_entity(self.syn, synid,
+                                          downloadFile=downloadFile),
+                synids))
+
+
+class WalkInventory(FileInventory):
+    """
+    Lists files by walking the folders, one request per folder, and gets
+    each entity with its own request
+    """
+
+    def list_files(self, synid):
+        input_files = []
+        for _, _, entities in synapseutils.walk(self.syn, synid):
+            input_files.extend(entities)
+        return input_files
+
+
+class FileViewInventory(FileInventory):
+    """
+    Lists files and their metadata from one query of a file view that
+    includes the files and folders of the center input folders.  The query
+    is shared by all the folders listed, and entities are only requested
+    when their files are downloaded.
+    """
+
+    _view_columns = ["id", "name", "type", "parentId", "currentVersion",
+                     "dataFileMD5Hex", "modifiedOn", "modifiedBy",
+                     "createdBy"]
+
+    def __init__(self, syn, view_synid, threads=ENTITY_FETCH_THREADS):
+        super(FileViewInventory, self).__init__(syn, threads=threads)
+        self.view_synid = view_synid
+        self._children = None
+        self._entities = {}
+
+    def _query_view(self):
+        """Query the view and index the files and folders by parent"""
+        viewdf = self.syn.tableQuery("SELECT {} FROM {}".format(
+            ",".join(self._view_columns), self.view_synid)).asDataFrame()
+        self._children = {
+            parentid: children.sort_values("name")
+            for parentid, children in viewdf.groupby("parentId")}
+        for row in viewdf[viewdf['type'] == "file"].itertuples():
+            modified_on = datetime.datetime.utcfromtimestamp(
+                row.modifiedOn / 1000.0)
+            self._entities[row.id] = synapseclient.File(
+                id=row.id, name=row.name, parentId=row.parentId,
+                versionNumber=int(row.currentVersion),
+                md5=row.dataFileMD5Hex,
+                modifiedOn=modified_on.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                modifiedBy=str(row.modifiedBy),
+                createdBy=str(row.createdBy))
+
+    def list_files(self, synid):
+        if self._children is None:
+            self._query_view()
+        # Same order as a walk: the files of a folder, then its subfolders
+        input_files = []
+        children = self._children.get(synid)
+        if children is None:
+            return input_files
+        for row in children.itertuples():
+            if row.type == "file":
+                input_files.append((row.name, row.id))
+        for row in children.itertuples():
+            if row.type == "folder":
+                input_files.extend(self.list_files(row.id))
+        return input_files
+
+    def get_entities(self, synids, downloadFile=True):
+        entities = [self._entities[synid] for synid in synids]
+        if downloadFile:
+            entities = _download_entities(self.syn, entities,
+                                          threads=self.threads)
+        return [(ent, {'synid': ent.id, 'attempts': 0, 'seconds': 0})
+                for ent in entities]
+
+
+class LocalInventory(FileInventory):
+    """
+    Lists entities that are already in memory, a stand-in for Synapse
+
+    Args:
+        folders: dict of folder synid to the list of its file entities
+    """
+
+    def __init__(self, folders):
+        super(LocalInventory, self).__init__(syn=None)
+        self.folders = folders
+        self._entities = {ent.id: ent
+                          for entities in folders.values()
+                          for ent in entities}
+
+    def list_files(self, synid):
+        return [(ent.name, ent.id) for ent in self.folders.get(synid, [])]
+
+    def get_entities(self, synids, downloadFile=True):
+        return [(self._entities[synid],
+                 {'synid': synid, 'attempts': 0, 'seconds': 0})
+                for synid in synids]
+
+
+def get_center_input_files(syn, synid, center, process="main",
+                           downloadFile=True, threads=ENTITY_FETCH_THREADS,
+                           fetch_stats=None, inventory=None):
     '''
     This function walks through each center's input directory
     to get a list of tuples of center files
@@ -67,6 +294,13 @@ def get_center_input_files(syn, synid, center, process="main", downloadFile=True
         center: Center name
         process: Process type includes, main, vcf, maf and mafSP.
                  Defaults to main such that the vcf
+        downloadFile: Download the files. Defaults to True
+        threads: Number of entities fetched at once.
+                 Defaults to ENTITY_FETCH_THREADS
+        fetch_stats: If a list is passed in, the synid, attempts and seconds
+                     taken to fetch each entity are appended to it
+        inventory: FileInventory to list the files with.
+                   Defaults to walking the folder
 
     Returns:
         List of entities with the correct format to pass into validation
@@ -76,45 +310,175 @@ def get_center_input_files(syn, synid, center, process="main", downloadFile=True
         "data_clinical_supp_sample_{center}.txt".format(center=center),
         "data_clinical_supp_patient_{center}.txt".format(center=center)]
 
-    center_files = synapseutils.walk(syn, synid)
+    if inventory is None:
+        inventory = WalkInventory(syn, threads=threads)
+    input_files = []
+    for name, ent_synid in inventory.list_files(synid):
+        # This is to remove vcfs from being validated during main
+        # processing. Often there are too many vcf files, and it is
+        # not necessary for them to be run everytime.
+        if name.endswith(".vcf") and process != "mutation":
+            continue
+        input_files.append((name, ent_synid))
+
+    # Entities are returned in the order they are listed
+    fetched = inventory.get_entities(
+        [ent_synid for _, ent_synid in input_files],
+        downloadFile=downloadFile)
+
     clinicalpair_entities = []
     prepared_center_file_list = []
+    for (name, _), (ent, stats) in zip(input_files, fetched):
+        if fetch_stats is not None:
+            fetch_stats.append(stats)
+        # Clinical file can come as two files.
+        # The two files need to be merged together which is
+        # why there is this format
+        if name in clinical_pair_name:
+            clinicalpair_entities.append(ent)
+            continue
+
+        prepared_center_file_list.append([ent])
 
-    for _, _, entities in center_files:
-        for name, ent_synid in entities:
-            # This is to remove vcfs from being validated during main
-            # processing. Often there are too many vcf files, and it is
-            # not necessary for them to be run everytime.
-            if name.endswith(".vcf") and process != "mutation":
-                continue
+    if clinicalpair_entities:
+        # clinicalpair_entities = [x for x in clinicalpair]
+        prepared_center_file_list.append(clinicalpair_entities)
 
-            ent = syn.get(ent_synid, downloadFile=downloadFile)
+    return prepared_center_file_list
 
-            # Clinical file can come as two files.
-            # The two files need to be merged together which is
-            # why there is this format
 
-            if name in clinical_pair_name:
-                clinicalpair_entities.append(ent)
-                continue
+FileStatus = namedtuple("FileStatus", ["status", "md5", "name", "errors"])
 
-            prepared_center_file_list.append([ent])
 
-    if clinicalpair_entities:
-        # clinicalpair_entities = [x for x in clinicalpair]
-        prepared_center_file_list.append(clinicalpair_entities)
+class FileStatusStore(object):
+    """Validation status and errors of a center's files keyed by entity id.
 
-    return prepared_center_file_list
+    The validation status and error tracker tables are read once per center
+    run so that checking a file is a dictionary lookup rather than a scan of
+    both tables.  The low cardinality columns are kept as categoricals.
 
+    Args:
+        validation_statusdf: Validation status dataframe
+        error_trackerdf: Error tracking dataframe.  Defaults to no errors
+    """
+    CATEGORICAL_COLUMNS = ["status", "center", "fileType"]
+
+    def __init__(self, validation_statusdf, error_trackerdf=None):
+        if error_trackerdf is None:
+            error_trackerdf = pd.DataFrame(columns=['id', 'errors'])
+        self.validation_statusdf = self._compact(validation_statusdf)
+        self.error_trackerdf = self._compact(error_trackerdf)
+        # Keep the first record of an id, like the previous table scans
+        errors = {}
+        for synid, error in zip(self.error_trackerdf['id'],
+                                self.error_trackerdf.get('errors', [])):
+            errors.setdefault(synid, error)
+        statusdf = self.validation_statusdf.reindex(
+            columns=['id', 'status', 'md5', 'name']
+        )
+        self._records = {}
+        for synid, status, md5, name in statusdf.itertuples(index=False):
+            if synid not in self._records:
+                self._records[synid] = FileStatus(status=status, md5=md5,
+                                                  name=name,
+                                                  errors=errors.get(synid))
+
+    @classmethod
+    def from_tables(cls, validation_status_table, error_tracker_table):
+        """Build the store from the Synapse table query results
+
+        Args:
+            validation_status_table: Validation status Synapse Table query
+            error_tracker_table: Error tracking Synapse Table query
+
+        Returns:
+            FileStatusStore
+        """
+        return cls(validation_status_table.asDataFrame(),
+                   error_tracker_table.asDataFrame())
+
+    def _compact(self, df):
+        """Store low cardinality columns as categoricals"""
+        df = df.copy()
+        for col in self.CATEGORICAL_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype("category")
+        return df
+
+    def get(self, synid):
+        """Get the stored status of a file
+
+        Args:
+            synid: Synapse id of the file
+
+        Returns:
+            FileStatus or None if the file has never been validated
+        """
+        return self._records.get(synid)
+
+    def records(self, synids):
+        """Get the stored statuses of some files
+
+        Args:
+            synids: Synapse ids of the files
+
+        Returns:
+            dict: FileStatus of the files that have been validated before
+        """
+        return {synid: self._records[synid] for synid in synids
+                if synid in self._records}
+
+    def duplicated_ids(self):
+        """Get the files that can't be told apart: files with the same
+        name, several cbs/seg files or more than two clinical files
+
+        Returns:
+            set: Synapse ids of the duplicated files
+        """
+        names = {synid: record.name
+                 for synid, record in self._records.items()}
+        name_counts = Counter(names.values())
+        duplicated_ids = {synid for synid, name in names.items()
+                          if name_counts[name] > 1}
+        # cbs/seg files should not be duplicated.
+        cbs_seg_ids = {synid for synid, name in names.items()
+                       if name.endswith(("cbs", "seg"))}
+        if len(cbs_seg_ids) > 1:
+            duplicated_ids.update(cbs_seg_ids)
+        # clinical files should not be duplicated.
+        clinical_ids = {synid for synid, name in names.items()
+                        if name.startswith("data_clinical_supp")}
+        if len(clinical_ids) > 2:
+            duplicated_ids.update(clinical_ids)
+        return duplicated_ids
+
+    def get_dataframes(self):
+        """Get the stored tables with plain columns, to update the tables
+
+        Returns:
+            tuple: Validation status and error tracking dataframes
+        """
+        return tuple(
+            df.astype({col: object for col in self.CATEGORICAL_COLUMNS
+                       if col in df.columns})
+            for df in (self.validation_statusdf, self.error_trackerdf)
+        )
+
+    def __contains__(self, synid):
+        return synid in self._records
 
-def check_existing_file_status(validation_status_table, error_tracker_table, entities):
+    def __len__(self):
+        return len(self._records)
+
+
+def check_existing_file_status(status_store, entities):
     '''
     This function checks input files against the existing validation and error
-    tracking dataframe
+    tracking status
 
     Args:
-        validation_status_table: Validation status Synapse Table query result
-        error_tracker_table: Error tracking Synapse Table query result
+        status_store: FileStatusStore of the center or a dict of its
+                      FileStatus records
         entities: list of center input entites
 
     Returns:
@@ -131,35 +495,31 @@ def check_existing_file_status(validation_status_table, error_tracker_table, ent
     statuses = []
     errors = []
 
-    validation_statusdf = validation_status_table.asDataFrame()
-    error_trackerdf = error_tracker_table.asDataFrame()
     # This should be outside fo the forloop so that it doesn't
     # get reset
     to_validate = False
     for ent in entities:
-        # Get the current status and errors from the tables.
-        current_status = validation_statusdf[validation_statusdf['id'] == ent.id]
-        current_error = error_trackerdf[error_trackerdf['id'] == ent.id]
+        # Get the current status and errors from the store.
+        current_status = status_store.get(ent.id)
 
-        if current_status.empty:
+        if current_status is None:
             to_validate = True
         else:
             # This to_validate is here, because the following is a
             # sequential check of whether files need to be validated
-            statuses.append(current_status['status'].values[0])
-            if current_error.empty:
-                to_validate = \
-                    current_status['status'].values[0] == "INVALID"
+            statuses.append(current_status.status)
+            if current_status.errors is None:
+                to_validate = current_status.status == "INVALID"
             else:
-                errors.append(current_error['errors'].values[0])
+                errors.append(current_status.errors)
             # Add Name check here (must add name of the entity as a column)
-            if current_status['md5'].values[0] != ent.md5 or \
-               current_status['name'].values[0] != ent.name:
+            if current_status.md5 != ent.md5 or \
+               current_status.name != ent.name:
                 to_validate = True
             else:
                 status_str = "{filename} ({id}) FILE STATUS IS: {filestatus}"
                 logger.info(status_str.format(filename=ent.name, id=ent.id,
-                                              filestatus=current_status['status'].values[0]))
+                                              filestatus=current_status.status))
 
     return({'status_list': statuses,
             'error_list': errors,
@@ -176,6 +536,9 @@ def _send_validation_error_email(syn, user, message_objs):
         message_objs: list of dicts with 'filenames' and 'messages' to send
     '''
 
+    if process_functions.is_dry_run():
+        logger.info(f"DRY RUN: not emailing user {user}")
+        return
     username = syn.getUserProfile(user)['userName']
 
     errors = ""
@@ -195,6 +558,23 @@ def _send_validation_error_email(syn, user, message_objs):
                     messageBody=email_message)
 
 
+def _store_log_file(syn, log_path, log_folder_synid):
+    """
+    Stores the log of a center in Synapse and removes it.  The log is kept
+    locally in a dry run.
+
+    Args:
+        syn: Synapse object
+        log_path: Path to the log
+        log_folder_synid: Synapse id of the logs folder
+    """
+    if process_functions.is_dry_run():
+        logger.info(f"DRY RUN: log kept at {log_path}")
+        return
+    syn.store(synapseclient.File(log_path, parentId=log_folder_synid))
+    os.remove(log_path)
+
+
 def _get_status_and_error_list(valid, message, entities):
     '''
     Helper function to return the status and error list of the
@@ -221,9 +601,9 @@ def _get_status_and_error_list(valid, message, entities):
     return input_status_list, invalid_errors_list
 
 
-def validatefile(syn, project_id, entities, validation_status_table, error_tracker_table,
+def validatefile(syn, project_id, entities, status_store,
                  center, threads, oncotree_link,
-                 format_registry=None):
+                 format_registry=None, session=None):
     '''Validate a list of entities.
 
     If a file has not changed, then it doesn't need to be validated.
@@ -231,10 +611,11 @@ def validatefile(syn, project_id, entities, validation_status_table, error_track
     Args:
         syn: Synapse object
         entities: A list of entities for a single file 'type' (usually a single file, but clinical can have two)
-        validation_statusdf: Validation status dataframe
-        error_trackerdf: Invalid files error tracking dataframe
+        status_store: FileStatusStore of the center
         center: Center of interest
         oncotree_link: Oncotree url
+        session: ValidationSession of the run.  Defaults to a session of
+                 these entities only
 
     Returns:
         tuple: input_status_list - status of input files,
@@ -243,15 +624,13 @@ def validatefile(syn, project_id, entities, validation_status_table, error_track
 
     '''
 
-    filepaths = [entity.path for entity in entities]
     filenames = [entity.name for entity in entities]
 
     logger.info("VALIDATING {filenames}".format(filenames=", ".join(filenames)))
 
     file_users = [entities[0].modifiedBy, entities[0].createdBy]
 
-    check_file_status = check_existing_file_status(
-        validation_status_table, error_tracker_table, entities)
+    check_file_status = check_existing_file_status(status_store, entities)
 
     status_list = check_file_status['status_list']
     error_list = check_file_status['error_list']
@@ -261,15 +640,23 @@ def validatefile(syn, project_id, entities, validation_status_table, error_track
     # Need to figure out to how to remove this
     # This must pass in filenames, because filetype is determined by entity
     # name Not by actual path of file
-    validator = validate.GenieValidationHelper(syn=syn, project_id=project_id,
-                                               center=center,
-                                               entitylist=entities,
-                                               format_registry=format_registry)
+    if session is None:
+        session = validate.ValidationSession(syn, project_id, format_registry)
+    validator = session.helper(center, entities)
     filetype = validator.file_type
     if check_file_status['to_validate']:
-        valid, message = validator.validate_single_file(
+        result = validator.get_cached_result(
             oncotree_link=oncotree_link, nosymbol_check=False
         )
+        if result is None:
+            # Entities may be fetched without their files, only the files
+            # that have to be validated are downloaded
+            entities = _download_entities(syn, entities)
+            validator = session.helper(center, entities, file_type=filetype)
+            result = validator.validate_single_file(
+                oncotree_link=oncotree_link, nosymbol_check=False
+            )
+        valid, message = result
         logger.info("VALIDATION COMPLETE")
         input_status_list, invalid_errors_list = _get_status_and_error_list(
             valid, message, entities)
@@ -301,7 +688,10 @@ def processfiles(syn, validfiles, center, path_to_genie,
     Args:
         syn: Synapse object
         validfiles: pandas dataframe containing validated files
-                    has 'id', 'path', and 'fileType' column
+                    has 'id', 'path', and 'fileType' column.  Files
+                    without a path are downloaded.  Files are only
+                    compared to the processed ledger if there is also an
+                    'md5' column
         center: GENIE center name
         path_to_genie: Path to GENIE workdir
         center_mapping_df: Center mapping dataframe
@@ -333,13 +723,47 @@ def processfiles(syn, validfiles, center, path_to_genie,
                 tableid = tableid[0]
 
             if filetype is not None:
-                processor = format_registry[filetype](syn, center)
+                processor_cls = format_registry[filetype]
+                # Files that haven't changed since they were processed
+                # would not change the database
+                ledger = processed_ledger.get_processed_ledger()
+                ledger_entry = None
+                if ledger is not None:
+                    ledger_entry = ledger.get_entry(
+                        row['id'], row.get('md5'), filetype, tableid,
+                        processor_cls
+                    )
+                if ledger_entry is not None and \
+                        ledger.is_processed(ledger_entry):
+                    logger.info("{} ({}) IS ALREADY PROCESSED".format(
+                        row['name'], row['id']))
+                    continue
+                # Files processed earlier in a resumed run
+                journal = run_journal.get_run_journal()
+                if journal is not None:
+                    record = journal.get(center, run_journal.PROCESSED,
+                                         row['id'])
+                    if record is not None and \
+                            record['md5'] == row.get('md5'):
+                        logger.info("{} ({}) WAS PROCESSED IN RUN {}".format(
+                            row['name'], row['id'], journal.run_id))
+                        continue
+                if pd.isnull(row['path']):
+                    # Files are only downloaded once it is known that they
+                    # are processed
+                    row = _download_valid_files(syn, row.to_frame().T).iloc[0]
+                processor = processor_cls(syn, center)
                 processor.process(
                     filePath=row['path'], newPath=newpath,
                     parentId=center_staging_synid, databaseSynId=tableid,
                     oncotree_link=oncotree_link, fileSynId=row['id'],
                     databaseToSynIdMappingDf=databaseToSynIdMappingDf
                 )
+                if ledger_entry is not None:
+                    ledger.record(ledger_entry)
+                if journal is not None:
+                    journal.record(center, run_journal.PROCESSED, row['id'],
+                                   md5=row.get('md5'))
     else:
         pass
         # process_mutation.process_mutation_workflow(
@@ -385,29 +809,19 @@ def create_and_archive_maf_database(syn, database_synid_mappingdf):
     maf_database_synid = process_functions.getDatabaseSynId(
         syn, "vcf2maf", project_id=None, databaseToSynIdMappingDf=database_synid_mappingdf)
     maf_database_ent = syn.get(maf_database_synid)
-    maf_columns = list(syn.getTableColumns(maf_database_synid))
-    schema = synapseclient.Schema(
+    new_maf_database = process_functions.create_new_table(
+        syn, maf_database_ent,
         name='Narrow MAF {current_time} Database'.format(
             current_time=time.time()),
-        columns=maf_columns,
-        parent=process_functions.getDatabaseSynId(
+        parentid=process_functions.getDatabaseSynId(
             syn, "main", databaseToSynIdMappingDf=database_synid_mappingdf))
-    schema.primaryKey = maf_database_ent.primaryKey
-    new_maf_database = syn.store(schema)
     # Store in the new database synid
-    database_synid_mappingdf['Id'][
-        database_synid_mappingdf[
-            'Database'] == 'vcf2maf'] = new_maf_database.id
-
-    vcf2maf_mappingdf = database_synid_mappingdf[
-        database_synid_mappingdf['Database'] == 'vcf2maf']
-    # vcf2maf_mappingdf['Id'][0] = newMafDb.id
-    syn.store(synapseclient.Table("syn10967259", vcf2maf_mappingdf))
+    database_synid_mappingdf = process_functions.swap_database_mapping(
+        syn, "syn10967259", database_synid_mappingdf, 'vcf2maf',
+        new_maf_database.id)
     # Move and archive old mafdatabase (This is the staging synid)
-    maf_database_ent.parentId = "syn7208886"
-    maf_database_ent.name = "ARCHIVED " + maf_database_ent.name
-    syn.store(maf_database_ent)
-    # maf_database_synid = new_maf_database.id
+    process_functions.archive_table(syn, maf_database_ent,
+                                    parentid="syn7208886")
     # Remove can download permissions from project GENIE team
     syn.setPermissions(new_maf_database.id, 3326313, [])
     return(database_synid_mappingdf)
@@ -464,21 +878,13 @@ def get_duplicated_files(validation_statusdf):
     '''
     # This is special
     logger.info("CHECK FOR DUPLICATED FILES")
+    duplicated_ids = FileStatusStore(
+        validation_statusdf[['id', 'name']]
+    ).duplicated_ids()
     duplicated_filesdf = validation_statusdf[
-        validation_statusdf['name'].duplicated(keep=False)]
-    # Define filename str vector
-    filename_str = validation_statusdf.name.str
-    # cbs/seg files should not be duplicated.
-    cbs_seg_index = filename_str.endswith(("cbs", "seg"))
-    cbs_seg_files = validation_statusdf[cbs_seg_index]
-    if len(cbs_seg_files) > 1:
-        duplicated_filesdf = duplicated_filesdf.append(cbs_seg_files)
-    # clinical files should not be duplicated.
-    clinical_index = filename_str.startswith("data_clinical_supp")
-    clinical_files = validation_statusdf[clinical_index]
-    if len(clinical_files) > 2:
-        duplicated_filesdf = duplicated_filesdf.append(clinical_files)
-    duplicated_filesdf.drop_duplicates("id", inplace=True)
+        validation_statusdf['id'].isin(duplicated_ids)
+    ]
+    duplicated_filesdf = duplicated_filesdf.drop_duplicates("id")
     logger.info("THERE ARE {} DUPLICATED FILES".format(
         len(duplicated_filesdf)))
     duplicated_filesdf['errors'] = DUPLICATED_FILE_ERROR
@@ -553,7 +959,8 @@ def update_status_and_error_tables(syn,
                                    input_valid_statusdf,
                                    invalid_errorsdf,
                                    validation_status_table,
-                                   error_tracker_table):
+                                   error_tracker_table,
+                                   status_store=None):
     '''
     Update validation status and error tracking table
 
@@ -564,16 +971,23 @@ def update_status_and_error_tables(syn,
         invalid_errors: List of lists of invalid errors
         validation_status_table: Synapse table query of validation status
         error_tracker_table: Synapse table query of error tracker
+        status_store: FileStatusStore of the table queries, so that they
+                      aren't read again.  Defaults to reading the queries
 
     '''
     logger.info("UPDATE VALIDATION STATUS DATABASE")
-    process_functions.updateDatabase(syn, error_tracker_table.asDataFrame(),
+    if status_store is not None:
+        validation_statusdf, error_trackerdf = status_store.get_dataframes()
+    else:
+        validation_statusdf = validation_status_table.asDataFrame()
+        error_trackerdf = error_tracker_table.asDataFrame()
+    process_functions.updateDatabase(syn, error_trackerdf,
                                      invalid_errorsdf,
                                      error_tracker_table.tableId,
                                      ["id"], to_delete=True)
 
     process_functions.updateDatabase(syn,
-                                     validation_status_table.asDataFrame(),
+                                     validation_statusdf,
                                      input_valid_statusdf,
                                      validation_status_table.tableId,
                                      ["id"],
@@ -597,19 +1011,20 @@ def _update_tables_content(validation_statusdf, error_trackingdf):
     """
     # Get duplicated files
     duplicated_filesdf = get_duplicated_files(validation_statusdf)
+    duplicated_ids = set(duplicated_filesdf['id'])
     # index of all duplicated files
-    duplicated_idx = validation_statusdf['id'].isin(duplicated_filesdf['id'])
-    validation_statusdf['status'][duplicated_idx] = "INVALID"
-    duplicated_idx = error_trackingdf['id'].isin(duplicated_filesdf['id'])
-    error_trackingdf['errors'][duplicated_idx] = DUPLICATED_FILE_ERROR
+    duplicated_idx = validation_statusdf['id'].isin(duplicated_ids)
+    validation_statusdf.loc[duplicated_idx, 'status'] = "INVALID"
+    duplicated_idx = error_trackingdf['id'].isin(duplicated_ids)
+    error_trackingdf.loc[duplicated_idx, 'errors'] = DUPLICATED_FILE_ERROR
 
     # Old errors are pulled down in validation, so obtain list of
     # files with duplicated file errors
-    dup_ids = error_trackingdf['id'][
+    dup_ids = set(error_trackingdf['id'][
         error_trackingdf['errors'] == DUPLICATED_FILE_ERROR
-    ]
+    ])
     # Checks to see if the old duplicated files are still duplicated
-    remove_ids = dup_ids[~dup_ids.isin(duplicated_filesdf['id'])]
+    remove_ids = dup_ids - duplicated_ids
 
     # Remove fixed duplicated files
     error_trackingdf = error_trackingdf[
@@ -620,7 +1035,6 @@ def _update_tables_content(validation_statusdf, error_trackingdf):
     ]
 
     # Append duplicated file errors
-    duplicated_filesdf['id'].isin(error_trackingdf['id'][duplicated_idx])
     error_trackingdf = error_trackingdf.append(
         duplicated_filesdf[error_trackingdf.columns]
     )
@@ -629,9 +1043,9 @@ def _update_tables_content(validation_statusdf, error_trackingdf):
 
     # Since old errors are retained, make sure to only update
     # files that are actually invalid
-    invalid_ids = validation_statusdf['id'][
+    invalid_ids = set(validation_statusdf['id'][
         validation_statusdf['status'] == "INVALID"
-    ]
+    ])
     error_trackingdf = error_trackingdf[
         error_trackingdf['id'].isin(invalid_ids)
     ]
@@ -644,9 +1058,365 @@ def _update_tables_content(validation_statusdf, error_trackingdf):
             'duplicated_filesdf': duplicated_filesdf}
 
 
+# Synapse session of a validation worker process
+_WORKER_SYN = None
+
+
+def _get_worker_syn():
+    """Log into Synapse once per validation worker process. Credentials
+    must be cached or configured, workers can't prompt for them."""
+    global _WORKER_SYN
+    if _WORKER_SYN is None:
+        _WORKER_SYN = synapseclient.login(silent=True)
+    return _WORKER_SYN
+
+
+# Validation session shared by the files a worker process validates
+_WORKER_SESSION = None
+
+
+def _get_worker_session(project_id, format_registry):
+    """Validation session of a validation worker process"""
+    global _WORKER_SESSION
+    if _WORKER_SESSION is None or \
+            _WORKER_SESSION.project_id != project_id or \
+            set(_WORKER_SESSION.format_registry) != set(format_registry):
+        _WORKER_SESSION = validate.ValidationSession(
+            _get_worker_syn(), project_id, format_registry
+        )
+    return _WORKER_SESSION
+
+
+def _validate_in_worker(project_id, entities, file_statuses, center,
+                        oncotree_link, format_registry, cache=None):
+    """Validate a list of entities in a worker process"""
+    session = _get_worker_session(project_id, format_registry)
+    with validation_cache.use_validation_cache(cache):
+        return validatefile(session.syn, project_id, entities,
+                            file_statuses, center=center, threads=1,
+                            oncotree_link=oncotree_link,
+                            format_registry=format_registry,
+                            session=session)
+
+
+# ----------------------------------------
+# CENTER PIPELINE
+# ----------------------------------------
+# Files are fetched, validated and processed in stages that overlap.
+# Each stage only runs this many files ahead of the next one, which bounds
+# how many downloaded files wait on disk to be validated or processed
+PIPELINE_WINDOW = 4
+
+
+def _bounded_map(submit, items, window=PIPELINE_WINDOW):
+    """
+    Submit each item and yield the results in the order of the items, with
+    at most window items submitted ahead of the consumer
+
+    Args:
+        submit: Function that submits an item and returns a future
+        items: Items to submit
+        window: Number of items submitted and not yet consumed
+
+    Yields:
+        Result of each item
+    """
+    pending = deque()
+    for item in items:
+        pending.append(submit(item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _journal_group_id(entities):
+    """Run journal id of a list of entities validated together"""
+    return ",".join(ent.id for ent in entities)
+
+
+def _get_journaled_validation(center, entities):
+    """
+    validatefile result of entities that were validated earlier in the run
+
+    Args:
+        center: Center name
+        entities: List of file entities
+
+    Returns:
+        tuple: validatefile result.  None if the entities weren't validated
+               in the run or have changed since
+    """
+    journal = run_journal.get_run_journal()
+    if journal is None:
+        return None
+    record = journal.get(center, run_journal.VALIDATED,
+                         _journal_group_id(entities))
+    if record is None or record['md5s'] != [ent.md5 for ent in entities]:
+        return None
+    input_status_list = [{'entity': ent, 'status': status,
+                          'fileType': record['fileType'], 'center': center}
+                         for ent, status in zip(entities, record['statuses'])]
+    invalid_errors_list = [{'entity': ent, 'errors': record['errors'][ent.id],
+                            'fileType': record['fileType'], 'center': center}
+                           for ent in entities if ent.id in record['errors']]
+    messages_to_send = [tuple(message) for message in record['messages']]
+    return input_status_list, invalid_errors_list, messages_to_send
+
+
+def _journal_validation(center, result):
+    """Record a validatefile result in the run journal
+
+    Args:
+        center: Center name
+        result: validatefile result
+    """
+    journal = run_journal.get_run_journal()
+    if journal is None:
+        return
+    input_status_list, invalid_errors_list, messages_to_send = result
+    entities = [input_status['entity'] for input_status in input_status_list]
+    journal.record(
+        center, run_journal.VALIDATED, _journal_group_id(entities),
+        md5s=[ent.md5 for ent in entities],
+        statuses=[input_status['status'] for input_status in input_status_list],
+        fileType=input_status_list[0]['fileType'],
+        errors={invalid_errors['entity'].id: invalid_errors['errors']
+                for invalid_errors in invalid_errors_list},
+        messages=[list(message) for message in messages_to_send]
+    )
+
+
+def _prefetch_entities(syn, status_store, entities, center=None,
+                       is_cached=None):
+    """
+    Download the files of entities that are new or changed since they were
+    last validated, so they are on disk when they are validated
+
+    Args:
+        syn: Synapse object
+        status_store: FileStatusStore of the center
+        entities: List of file entities
+        center: Center name, to use and record the files fetched earlier in
+                the run
+        is_cached: Function of the entities, True if their validation
+                   result is cached so they don't have to be downloaded
+
+    Returns:
+        list: Entities, with the files that will be validated downloaded
+    """
+    if _get_journaled_validation(center, entities) is not None:
+        return entities
+    journal = run_journal.get_run_journal()
+    if journal is not None:
+        for ent in entities:
+            record = journal.get(center, run_journal.FETCHED, ent.id)
+            if record is not None and record['md5'] == ent.md5 and \
+                    os.path.exists(record['path']):
+                ent.path = record['path']
+    for ent in entities:
+        status = status_store.get(ent.id)
+        if status is None or status.md5 != ent.md5 or status.name != ent.name:
+            if is_cached is not None and is_cached(entities):
+                break
+            entities = _download_entities(syn, entities)
+            if journal is not None:
+                for ent in entities:
+                    journal.record(center, run_journal.FETCHED, ent.id,
+                                   md5=ent.md5, path=ent.path)
+            break
+    return entities
+
+
+def validate_center_files(syn, project_id, center, center_files,
+                          status_store, oncotree_link, format_registry,
+                          threads=1, window=PIPELINE_WINDOW, session=None):
+    """Validate each list of entities of a center
+
+    The files of the next lists of entities are downloaded while a list is
+    validated.  With more than one thread, the entities are validated in a
+    pool of processes.  Each worker process has its own Synapse and
+    validation sessions and is only sent the stored statuses of the files
+    it validates.  Entities
+    that were validated earlier in a resumed run are not validated again.
+
+    Args:
+        syn: Synapse object
+        project_id: Synapse Project ID where data is stored
+        center: Center name
+        center_files: List of lists of entities to validate
+        status_store: FileStatusStore of the center
+        oncotree_link: Link to oncotree
+        format_registry: File format classes
+        threads: Number of processes to validate with
+        window: Number of lists of entities downloaded ahead of validation.
+                Defaults to PIPELINE_WINDOW
+        session: ValidationSession of the run.  Defaults to a new session
+
+    Yields:
+        validatefile result of each list of entities, in the order
+        of center_files
+    """
+    if session is None:
+        session = validate.ValidationSession(syn, project_id, format_registry)
+
+    is_cached = None
+    if validation_cache.get_validation_cache() is not None:
+        def is_cached(ents):
+            return session.helper(center, ents).get_cached_result(
+                oncotree_link=oncotree_link, nosymbol_check=False
+            ) is not None
+
+    with ThreadPoolExecutor(max_workers=window) as fetch_executor:
+        fetched = _bounded_map(
+            lambda ents: fetch_executor.submit(_prefetch_entities, syn,
+                                               status_store, ents, center,
+                                               is_cached=is_cached),
+            center_files, window
+        )
+        if threads <= 1 or len(center_files) <= 1:
+            for ents in fetched:
+                result = _get_journaled_validation(center, ents)
+                if result is None:
+                    result = validatefile(syn, project_id, ents,
+                                          status_store,
+                                          center=center, threads=1,
+                                          oncotree_link=oncotree_link,
+                                          format_registry=format_registry,
+                                          session=session)
+                    _journal_validation(center, result)
+                yield result
+            return
+
+        def submit(ents):
+            result = _get_journaled_validation(center, ents)
+            if result is not None:
+                future = Future()
+                future.set_result(result)
+                return future
+            return executor.submit(
+                _validate_in_worker, project_id, ents,
+                status_store.records([ent.id for ent in ents]),
+                center, oncotree_link, format_registry,
+                validation_cache.get_validation_cache()
+            )
+
+        logger.info(f"VALIDATING WITH {threads} PROCESSES")
+        workers = min(threads, len(center_files))
+        # Threads of the run (processing, journal) are alive by now, forked
+        # workers would inherit their locks in whatever state they are in
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")) as executor:
+            # Keep every worker busy
+            for result in _bounded_map(submit, fetched, 2 * workers):
+                _journal_validation(center, result)
+                yield result
+
+
+def _clone_syn(syn):
+    """Synapse client logged in with the credentials of syn.  Clients
+    aren't thread safe, a thread needs its own client."""
+    clone = synapseclient.Synapse(repoEndpoint=syn.repoEndpoint,
+                                  authEndpoint=syn.authEndpoint,
+                                  fileHandleEndpoint=syn.fileHandleEndpoint,
+                                  portalEndpoint=syn.portalEndpoint,
+                                  skip_checks=True, silent=True,
+                                  cache_client=False)
+    clone.credentials = syn.credentials
+    return clone
+
+
+class _ProcessingStage(object):
+    """
+    Processes valid files in a background thread while the next files are
+    validated.  Files are processed one at a time in the order they are
+    submitted, and submitting waits when window files are already waiting.
+    A file that fails to be processed is logged and doesn't stop the
+    others, the first failure is raised once they are all processed.
+
+    Files are processed before the validation status and error tables are
+    updated, which only happens once every file is validated.  If the run
+    dies in between, the processed data has no new status rows until the
+    next run validates the files again and updates the tables.  The
+    processed ledger then skips processing them again.
+
+    Args:
+        syn: Synapse object.  The thread processes with its own client
+             logged in with the same credentials
+        process_file: Function that processes a valid file, called with
+                      the thread's Synapse object and the valid file
+        window: Number of valid files waiting to be processed.
+                Defaults to PIPELINE_WINDOW
+    """
+    def __init__(self, syn, process_file, window=PIPELINE_WINDOW):
+        self._syn = _clone_syn(syn)
+        self._process_file = process_file
+        self._window = window
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = deque()
+        self._failures = []
+
+    def _wait(self):
+        """Wait for the oldest queued file to be processed"""
+        valid_file, future = self._pending.popleft()
+        try:
+            future.result()
+        except Exception as ex:
+            logger.exception("PROCESSING {} FAILED".format(valid_file['id']))
+            self._failures.append(ex)
+
+    def submit(self, valid_file):
+        """Queue a valid file to be processed
+
+        Args:
+            valid_file: dict with 'id', 'path', 'md5', 'fileType' and 'name'
+        """
+        if len(self._pending) >= self._window:
+            self._wait()
+        self._pending.append(
+            (valid_file, self._executor.submit(self._process_file,
+                                               self._syn, valid_file))
+        )
+
+    def close(self):
+        """Wait for the queued files to be processed
+
+        Raises:
+            Exception: The first file that failed to be processed
+        """
+        try:
+            while self._pending:
+                self._wait()
+        finally:
+            self._executor.shutdown()
+        if self._failures:
+            raise self._failures[0]
+
+
+def _process_valid_file(syn, valid_file, center, path_to_genie,
+                        center_mapping_df, oncotree_link,
+                        database_to_synid_mappingdf, processing="main",
+                        genome_nexus_pkg=None, format_registry=None):
+    """Process a valid file
+
+    Args:
+        syn: Synapse object
+        valid_file: dict with 'id', 'path', 'md5', 'fileType' and 'name'
+        See processfiles for the other parameters
+    """
+    processfiles(syn, pd.DataFrame([valid_file]), center, path_to_genie,
+                 center_mapping_df, oncotree_link,
+                 database_to_synid_mappingdf,
+                 processing=processing,
+                 genome_nexus_pkg=genome_nexus_pkg,
+                 format_registry=format_registry)
+
+
 def validation(syn, project_id, center, process,
                center_files, database_synid_mappingdf,
-               oncotree_link, format_registry):
+               oncotree_link, format_registry, threads=1,
+               process_file=None, session=None):
     '''
     Validation of all center files
 
@@ -655,8 +1425,12 @@ def validation(syn, project_id, center, process,
         center: Center name
         process: main, vcf, maf
         center_mapping_df: center mapping dataframe
-        thread: Unused parameter for now
         oncotree_link: Link to oncotree
+        threads: Number of processes to validate with
+        process_file: Function called with each valid file as soon as it
+                      is validated, unless the file is duplicated.  It is
+                      called before the status tables are updated
+        session: ValidationSession of the run.  Defaults to a new session
 
     Returns:
         dataframe: Valid files
@@ -683,6 +1457,8 @@ def validation(syn, project_id, center, process,
         f"SELECT * FROM {error_tracker_synid} where "
         f"center = '{center}' and fileType <> '{exclude_type}'"
     )
+    status_store = FileStatusStore.from_tables(validation_status_table,
+                                               error_tracker_table)
 
     input_valid_statuses = []
     invalid_errors = []
@@ -691,16 +1467,35 @@ def validation(syn, project_id, center, process,
     # particular users
     user_message_dict = defaultdict(list)
 
-    for ents in center_files:
-        status, errors, messages_to_send = validatefile(
-            syn, project_id, ents,
-            validation_status_table,
-            error_tracker_table,
-            center=center, threads=1,
-            oncotree_link=oncotree_link,
-            format_registry=format_registry)
-
+    # Duplicated files are invalid whatever their content, they are
+    # known from the file names before any file is validated
+    duplicated_ids = set()
+    if process_file is not None:
+        center_filesdf = pd.DataFrame(
+            [{'id': ent.id, 'name': ent.name}
+             for ents in center_files for ent in ents],
+            columns=['id', 'name']
+        )
+        duplicated_ids = set(get_duplicated_files(center_filesdf)['id'])
+
+    if session is None:
+        session = validate.ValidationSession(syn, project_id, format_registry)
+    validate_results = validate_center_files(
+        syn, project_id, center, center_files, status_store,
+        oncotree_link=oncotree_link, format_registry=format_registry,
+        threads=threads, session=session
+    )
+    for status, errors, messages_to_send in validate_results:
         input_valid_statuses.extend(status)
+        if process_file is not None:
+            for input_status in status:
+                entity = input_status['entity']
+                if (input_status['status'] == "VALIDATED" and
+                        entity.id not in duplicated_ids):
+                    process_file({'id': entity.id, 'path': entity.path,
+                                  'md5': entity.md5,
+                                  'fileType': input_status['fileType'],
+                                  'name': entity.name})
         if errors is not None:
             invalid_errors.extend(errors)
 
@@ -728,19 +1523,37 @@ def validation(syn, project_id, center, process,
     user_message_dict = append_duplication_errors(duplicated_filesdf,
                                                   user_message_dict)
 
+    journal = run_journal.get_run_journal()
     for user, message_objs in user_message_dict.items():
+        # Users were already sent these errors by the run being resumed
+        if journal is not None and \
+                journal.get(center, run_journal.EMAILED,
+                            str(user)) is not None:
+            logger.info("User {} was emailed in run {}".format(
+                user, journal.run_id))
+            continue
         logger.debug("Sending messages to user {user}.".format(user=user))
 
         _send_validation_error_email(syn=syn, user=user,
                                      message_objs=message_objs)
+        if journal is not None:
+            journal.record(center, run_journal.EMAILED, str(user))
 
-    update_status_and_error_tables(
-        syn=syn,
-        input_valid_statusdf=validation_statusdf,
-        invalid_errorsdf=error_trackingdf,
-        validation_status_table=validation_status_table,
-        error_tracker_table=error_tracker_table
-    )
+    if journal is not None and \
+            journal.get(center, run_journal.STATUS_COMMITTED) is not None:
+        logger.info("STATUS TABLES WERE UPDATED IN RUN {}".format(
+            journal.run_id))
+    else:
+        update_status_and_error_tables(
+            syn=syn,
+            input_valid_statusdf=validation_statusdf,
+            invalid_errorsdf=error_trackingdf,
+            validation_status_table=validation_status_table,
+            error_tracker_table=error_tracker_table,
+            status_store=status_store
+        )
+        if journal is not None:
+            journal.record(center, run_journal.STATUS_COMMITTED)
 
     valid_filesdf = validation_statusdf.query('status == "VALIDATED"')
     return(valid_filesdf[['id', 'path', 'fileType', 'name']])
@@ -750,7 +1563,15 @@ def center_input_to_database(syn, project_id, center, process,
                              only_validate, database_to_synid_mappingdf,
                              center_mapping_df, delete_old=False,
                              oncotree_link=None, genie_annotation_pkg=None,
-                             format_registry=None):
+                             format_registry=None, inventory=None,
+                             threads=1, validation_session=None):
+    journal = run_journal.get_run_journal()
+    if journal is not None and \
+            journal.get(center, run_journal.CENTER_DONE) is not None:
+        logger.info("{} WAS COMPLETED IN RUN {}".format(center,
+                                                        journal.run_id))
+        return
+
     if only_validate:
         log_path = os.path.join(
             process_functions.SCRIPT_DIR,
@@ -789,14 +1610,38 @@ def center_input_to_database(syn, project_id, center, process,
     center_input_synid = center_mapping_df['inputSynId'][
         center_mapping_df['center'] == center][0]
     logger.info("Center: " + center)
+    # Files are only downloaded when they are validated or processed
     center_files = get_center_input_files(syn, center_input_synid, center,
-                                          process)
+                                          process, downloadFile=False,
+                                          inventory=inventory)
 
     # only validate if there are center files
     if center_files:
-        validFiles = validation(syn, project_id, center, process, center_files,
-                                database_to_synid_mappingdf,
-                                oncotree_link, format_registry)
+        # Valid files are processed while the next files are validated
+        processing = None
+        if not only_validate:
+            processing = _ProcessingStage(syn, functools.partial(
+                _process_valid_file, center=center,
+                path_to_genie=path_to_genie,
+                center_mapping_df=center_mapping_df,
+                oncotree_link=oncotree_link,
+                database_to_synid_mappingdf=database_to_synid_mappingdf,
+                processing=process,
+                genome_nexus_pkg=genie_annotation_pkg,
+                format_registry=format_registry
+            ))
+        try:
+            validFiles = validation(
+                syn, project_id, center, process, center_files,
+                database_to_synid_mappingdf,
+                oncotree_link, format_registry,
+                threads=threads,
+                process_file=processing.submit if processing else None,
+                session=validation_session
+            )
+        finally:
+            if processing is not None:
+                processing.close()
     else:
         logger.info("{} has not uploaded any files".format(center))
         return
@@ -842,12 +1687,8 @@ def center_input_to_database(syn, project_id, center, process,
         #     syn.store(synapseclient.Table(
         #         processTrackerSynId, processTrackerDf))
 
-        processfiles(syn, validFiles, center, path_to_genie,
-                     center_mapping_df, oncotree_link,
-                     database_to_synid_mappingdf,
-                     processing=process,
-                     genome_nexus_pkg=genie_annotation_pkg,
-                     format_registry=format_registry)
+        # The valid files were processed as they were validated
+        logger.info("PROCESSED {} VALID FILES".format(len(validFiles)))
 
         # Should add in this process end tracking
         # before the deletion of samples
@@ -873,6 +1714,7 @@ def center_input_to_database(syn, project_id, center, process,
     # Store log file
     log_folder_synid = process_functions.getDatabaseSynId(
         syn, "logs", databaseToSynIdMappingDf=database_to_synid_mappingdf)
-    syn.store(synapseclient.File(log_path, parentId=log_folder_synid))
-    os.remove(log_path)
+    _store_log_file(syn, log_path, log_folder_synid)
+    if journal is not None:
+        journal.record(center, run_journal.CENTER_DONE)
     logger.info("ALL PROCESSES COMPLETE")
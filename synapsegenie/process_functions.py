@@ -1,16 +1,25 @@
 import ast
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from Crypto.PublicKey import RSA
 import datetime
+import io
 import json
 import logging
+import math
 import os
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 import tempfile
+import time
 
+import numpy as np
 import pandas as pd
 import synapseclient
+from synapseclient.core.exceptions import (SynapseHTTPError,
+                                           SynapseTimeoutError)
 
 # try:
 #   from urllib.request import urlopen
@@ -285,7 +294,7 @@ def getDatabaseSynId(syn, tableName, project_id=None, databaseToSynIdMappingDf=N
 
     synId = lookup_dataframe_value(databaseToSynIdMappingDf, "Id",
                                    'Database == "{}"'.format(tableName))
-    return(synId)
+    return(get_current_table_id(synId))
 
 
 def rmFiles(folderPath, recursive=True):
@@ -318,6 +327,109 @@ def removeStringFloat(string):
     return(string)
 
 
+# Synapse column types that hold integers
+INTEGER_COLUMN_TYPES = ["INTEGER", "DATE", "FILEHANDLEID", "USERID"]
+# Number of rows rendered at a time when writing a dataframe
+CSV_WRITE_CHUNKSIZE = 100000
+
+
+def get_integer_columns(table_columns):
+    '''
+    Get the names of the integer columns of a Synapse table
+
+    Args:
+        table_columns: Synapse table columns (syn.getTableColumns)
+
+    Return:
+        list: column names
+    '''
+    return([column.name for column in table_columns
+            if column.columnType in INTEGER_COLUMN_TYPES])
+
+
+def _is_whole_number(value):
+    return(isinstance(value, float) and value.is_integer())
+
+
+def _infer_integer_columns(df):
+    '''
+    Infer integer columns from the dtypes.  This is done because of pandas
+    typing.  An integer column with one NA/blank value will be cast as a
+    double, so float columns that only hold whole numbers are integers.
+
+    Args:
+        df:  Pandas dataframe
+
+    Return:
+        list: column names
+    '''
+    integer_cols = []
+    for col in df.columns:
+        values = df[col].dropna()
+        if df[col].dtype.kind == 'f':
+            if (values % 1 == 0).all():
+                integer_cols.append(col)
+        elif df[col].dtype == object:
+            floats = values[values.map(type) == float]
+            if not floats.empty and floats.map(_is_whole_number).all():
+                integer_cols.append(col)
+    return(integer_cols)
+
+
+def _format_integer_columns(df, integer_cols):
+    '''
+    Turn whole number floats of integer columns into integers
+
+    Args:
+        df:  Pandas dataframe
+        integer_cols: Integer columns
+
+    Return:
+        Dataframe: copy of df if any column was changed
+    '''
+    formatted = {}
+    for col in integer_cols:
+        if df[col].dtype.kind == 'f':
+            if (df[col].dropna() % 1 == 0).all():
+                formatted[col] = df[col].astype("Int64")
+        elif df[col].dtype == object:
+            # Built as an object series so pandas doesn't cast back to float
+            formatted[col] = pd.Series(
+                [int(value) if _is_whole_number(value) else value
+                 for value in df[col]],
+                index=df.index, dtype=object)
+    if formatted:
+        df = df.assign(**formatted)
+    return(df)
+
+
+def write_df_csv(df, file_handle, sep=",", header=True, integer_cols=None,
+                 chunksize=CSV_WRITE_CHUNKSIZE):
+    '''
+    Write a dataframe to an open file in chunks.  Integer columns are written
+    without a decimal even when pandas holds them as floats.
+
+    Args:
+        df:  Pandas dataframe
+        file_handle: Open file to write to
+        sep: Delimiter. Defaults to ","
+        header: Write the column names. Defaults to True
+        integer_cols: Columns that hold integers, for example from
+                      get_integer_columns.  Inferred from the dtypes if None
+        chunksize: Number of rows to render at a time.
+                   Defaults to CSV_WRITE_CHUNKSIZE
+    '''
+    if integer_cols is None:
+        integer_cols = _infer_integer_columns(df)
+    integer_cols = [col for col in integer_cols if col in df.columns]
+    if header:
+        df.iloc[:0].to_csv(file_handle, sep=sep, index=False)
+    for start in range(0, len(df), chunksize):
+        chunk = _format_integer_columns(df.iloc[start:start + chunksize],
+                                        integer_cols)
+        chunk.to_csv(file_handle, sep=sep, index=False, header=False)
+
+
 def removePandasDfFloat(df, header=True):
     '''
     Remove decimal for integers due to pandas
@@ -328,13 +440,9 @@ def removePandasDfFloat(df, header=True):
     Return:
         str: tsv in text
     '''
-    if header:
-        text = df.to_csv(sep="\t", index=False)
-    else:
-        text = df.to_csv(sep="\t", index=False, header=None)
-
-    text = removeStringFloat(text)
-    return(text)
+    text = io.StringIO()
+    write_df_csv(df, text, sep="\t", header=header)
+    return(text.getvalue())
 
 
 def removeFloat(df):
@@ -394,6 +502,9 @@ def storeFile(
         fileEnt.platform = platform
     if cBioFileFormat is not None:
         fileEnt.cBioFileFormat = cBioFileFormat
+    if is_dry_run():
+        logger.info("DRY RUN: not storing {}".format(fileName))
+        return(fileEnt)
     ent = syn.store(fileEnt, used=used)
     return(ent)
 
@@ -464,17 +575,15 @@ def addClinicalHeaders(
         patientFile.write("#%s\n" % "\t".join(patientDesc))
         patientFile.write("#%s\n" % "\t".join(patientType))
         patientFile.write("#%s\n" % "\t".join(['1']*len(patientLabels)))
-        text = removeFloat(
-            clinicalDf[patientCols].drop_duplicates('PATIENT_ID'))
-        patientFile.write(text)
+        write_df_csv(clinicalDf[patientCols].drop_duplicates('PATIENT_ID'),
+                     patientFile, sep="\t")
     with open(samplePath, "w+") as sampleFile:
         sampleFile.write("#%s\n" % "\t".join(sampleLabels))
         sampleFile.write("#%s\n" % "\t".join(sampleDesc))
         sampleFile.write("#%s\n" % "\t".join(sampleType))
         sampleFile.write("#%s\n" % "\t".join(['1']*len(sampleLabels)))
-        text = removeFloat(
-            clinicalDf[sampleCols].drop_duplicates("SAMPLE_ID"))
-        sampleFile.write(text)
+        write_df_csv(clinicalDf[sampleCols].drop_duplicates("SAMPLE_ID"),
+                     sampleFile, sep="\t")
 
 ########################################################################
 # CENTER ANONYMIZING
@@ -568,30 +677,228 @@ def _get_left_union_df(left, right, checkby):
     return(uniondf)
 
 
-def _append_rows(new_datasetdf, databasedf, checkby):
+def _create_primary_key(df, primary_key_cols, hash_key=False):
     '''
-    Compares the dataset from the database and determines which rows to
-    append from the dataset
+    Build the composite primary key of a dataframe column-wise instead of
+    joining each row in Python.
+
+    Args:
+        df: Dataframe
+        primary_key_cols: Column(s) that make up the primary key
+        hash_key: Return a fixed width 64-bit hash of the key columns
+                  instead of the space separated string. Defaults to False
+
+    Returns:
+        Series: Primary key of each row (str or uint64)
+    '''
+    if isinstance(primary_key_cols, str):
+        primary_key_cols = [primary_key_cols]
+    keydf = df[primary_key_cols].astype(str)
+    if hash_key:
+        return pd.util.hash_pandas_object(keydf, index=False)
+    primary_key = keydf[primary_key_cols[0]]
+    for col in primary_key_cols[1:]:
+        primary_key = primary_key + ' ' + keydf[col]
+    return primary_key
+
+
+def _hash_numbers(values):
+    """
+    Hash numbers by value so that int, float and bool values that compare
+    equal get the same hash.
+
+    Args:
+        values: numpy array of numbers
+
+    Returns:
+        numpy array: uint64 hash of each value
+    """
+    if values.dtype.kind in 'iu' and len(values) > 0 and \
+       np.abs(values).max() >= 2**53:
+        # Too large to be represented exactly as a float
+        return pd.util.hash_array(values.astype('int64'))
+    # Adding 0.0 turns -0.0 into 0.0
+    return pd.util.hash_array(values.astype('float64') + 0.0)
+
+
+def _hash_values(values):
+    """
+    Hash each value of a column.  Values that compare equal get the same
+    hash no matter the column dtype, i.e. 1, 1.0 and True hash the same
+    while the string '1' does not.
+
+    Args:
+        values: Pandas series
+
+    Returns:
+        numpy array: uint64 hash of each value
+    """
+    if pd.api.types.is_bool_dtype(values) or \
+       pd.api.types.is_numeric_dtype(values):
+        return _hash_numbers(values.to_numpy())
+    values = values.to_numpy(dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        return pd.util.hash_array(values)
+    hashes = np.zeros(len(values), dtype='uint64')
+    is_str = np.array([isinstance(value, str) for value in values],
+                      dtype=bool)
+    hashes[is_str] = pd.util.hash_array(values[is_str])
+    others = pd.Series(values[~is_str], dtype=object)
+    numbers = pd.to_numeric(others, errors='coerce')
+    is_number = numbers.notnull().to_numpy()
+    other_hashes = np.zeros(len(others), dtype='uint64')
+    other_hashes[is_number] = _hash_numbers(numbers[is_number].to_numpy())
+    # Hash anything else by its string with a different key so it never
+    # matches an actual string
+    other_hashes[~is_number] = pd.util.hash_array(
+        others[~is_number].astype(str).to_numpy(dtype=object),
+        hash_key="synapsegenie0obj"
+    )
+    hashes[~is_str] = other_hashes
+    return hashes
+
+
+def _get_row_fingerprint(df):
+    """
+    Hash the values of each row into one 64-bit fingerprint.  Two rows
+    have the same fingerprint when all of their values compare equal.
+
+    Args:
+        df: Dataframe
+
+    Returns:
+        Series: uint64 fingerprint of each row
+    """
+    if df.shape[1] == 0:
+        return pd.Series(0, index=df.index, dtype='uint64')
+    hashdf = pd.DataFrame(
+        {idx: _hash_values(df.iloc[:, idx]) for idx in range(df.shape[1])},
+        index=df.index
+    )
+    return pd.util.hash_pandas_object(hashdf, index=False)
+
+
+def _get_rowid_version_df(rowids):
+    """
+    Split Synapse table row ids into ROW_ID and ROW_VERSION
+
+    Args:
+        rowids: List of {ROW_ID}_{ROW_VERSION} strings
+
+    Returns:
+        Dataframe: ROW_ID in column 0 and ROW_VERSION in column 1
+    """
+    rowids = pd.Series(rowids, dtype=object)
+    if rowids.empty:
+        return pd.DataFrame(columns=[0, 1], dtype=object)
+    rowid_version = rowids.str.split("_", expand=True)
+    return rowid_version[[0, 1]]
+
+
+def _diff_rows(new_datasetdf, databasedf, checkby):
+    """
+    Compares the dataset with the database and classifies each row as an
+    append, update or delete in one pass. Each row is reduced to a
+    fingerprint of its non key columns, the fingerprints are then joined on
+    the key column and rows with differing fingerprints are updated.
 
     Args:
         new_datasetdf: Input data dataframe
         databasedf: Existing data dataframe
         checkby: Column of values to compare
 
-    Return:
-        Dataframe: Dataframe of rows to append
-    '''
+    Returns:
+        dict: append: Dataframe of rows to append
+              update: Dataframe of rows to update
+              delete: Dataframe of rows to delete
+              changed_cells: Dataframe of booleans, True for the cells
+                             that changed in each row to update
+    """
+    _check_valid_df(new_datasetdf, checkby)
+    _check_valid_df(databasedf, checkby)
     databasedf.fillna('', inplace=True)
     new_datasetdf.fillna('', inplace=True)
-
-    appenddf = _get_left_diff_df(new_datasetdf, databasedf, checkby)
+    compare_cols = [col for col in databasedf.columns if col != checkby]
+
+    database_keys = pd.DataFrame({
+        'key': databasedf[checkby].values,
+        'database_fingerprint': _get_row_fingerprint(
+            databasedf[compare_cols]).values,
+        'database_pos': np.arange(len(databasedf))
+    })
+    dataset_keys = pd.DataFrame({
+        'key': new_datasetdf[checkby].values,
+        'dataset_fingerprint': _get_row_fingerprint(
+            new_datasetdf[compare_cols]).values,
+        'dataset_pos': np.arange(len(new_datasetdf))
+    })
+    # Only the first occurrence of a duplicated key is used for updates
+    keys = database_keys.merge(
+        dataset_keys.drop_duplicates('key'), on='key',
+        how='outer', indicator=True
+    )
+
+    # Append every dataset row whose key isn't in the database
+    append_keys = keys['key'][keys['_merge'] == 'right_only']
+    appenddf = new_datasetdf[new_datasetdf[checkby].isin(append_keys)]
     if not appenddf.empty:
         logger.info("Adding Rows")
     else:
         logger.info("No new rows")
     del appenddf[checkby]
     appenddf.reset_index(drop=True, inplace=True)
-    return(appenddf)
+
+    changed = keys[
+        (keys['_merge'] == 'both') &
+        (keys['database_fingerprint'] != keys['dataset_fingerprint'])
+    ].sort_values('database_pos')
+    updating_databasedf = databasedf.iloc[
+        changed['database_pos'].astype(int)]
+    updatesetdf = new_datasetdf.iloc[changed['dataset_pos'].astype(int)]
+    rowids = updating_databasedf.index.values
+    key_index = pd.Index(changed['key'], name=checkby)
+    updating_databasedf.index = key_index
+    updatesetdf.index = key_index
+    del updating_databasedf[checkby]
+    del updatesetdf[checkby]
+    updatesetdf = updatesetdf[updating_databasedf.columns]
+    # Cells that differ within the updated rows
+    changed_cells = pd.DataFrame({
+        col: _hash_values(updating_databasedf[col]) !=
+        _hash_values(updatesetdf[col])
+        for col in updating_databasedf.columns
+    }, columns=updating_databasedf.columns)
+    updatedf = _create_update_rowsdf(
+        updating_databasedf, updatesetdf, rowids, [True] * len(changed))
+
+    # If the new dataset is empty, delete everything in the database
+    delete_pos = keys['database_pos'][keys['_merge'] == 'left_only']
+    delete_rowids = databasedf.index[np.sort(delete_pos.astype(int))]
+    if len(delete_rowids) > 0:
+        logger.info("Deleting Rows")
+        deletedf = _get_rowid_version_df(delete_rowids)
+    else:
+        deletedf = pd.DataFrame()
+        logger.info("No deleted rows")
+
+    return {'append': appenddf, 'update': updatedf, 'delete': deletedf,
+            'changed_cells': changed_cells}
+
+
+def _append_rows(new_datasetdf, databasedf, checkby):
+    '''
+    Compares the dataset from the database and determines which rows to
+    append from the dataset
+
+    Args:
+        new_datasetdf: Input data dataframe
+        databasedf: Existing data dataframe
+        checkby: Column of values to compare
+
+    Return:
+        Dataframe: Dataframe of rows to append
+    '''
+    return _diff_rows(new_datasetdf, databasedf, checkby)['append']
 
 
 def _delete_rows(new_datasetdf, databasedf, checkby):
@@ -607,23 +914,7 @@ def _delete_rows(new_datasetdf, databasedf, checkby):
     Return:
         Dataframe: Dataframe of rows to delete
     '''
-
-    databasedf.fillna('', inplace=True)
-    new_datasetdf.fillna('', inplace=True)
-    # If the new dataset is empty, delete everything in the database
-    deletedf = _get_left_diff_df(databasedf, new_datasetdf, checkby)
-    if not deletedf.empty:
-        logger.info("Deleting Rows")
-        delete_rowid_version = pd.DataFrame([[
-            rowid.split("_")[0], rowid.split("_")[1]]
-            for rowid in deletedf.index])
-        delete_rowid_version.reset_index(drop=True, inplace=True)
-    else:
-        delete_rowid_version = pd.DataFrame()
-        logger.info("No deleted rows")
-
-    # del deletedf[checkby]
-    return(delete_rowid_version)
+    return _diff_rows(new_datasetdf, databasedf, checkby)['delete']
 
 
 def _create_update_rowsdf(
@@ -670,60 +961,517 @@ def _update_rows(new_datasetdf, databasedf, checkby):
     Return:
         Dataframe: Dataframe of rows to update
     '''
-    # initial_database = databasedf.copy()
-    databasedf.fillna('', inplace=True)
-    new_datasetdf.fillna('', inplace=True)
-    updatesetdf = _get_left_union_df(new_datasetdf, databasedf, checkby)
-    updating_databasedf = _get_left_union_df(
-        databasedf, new_datasetdf, checkby)
+    return _diff_rows(new_datasetdf, databasedf, checkby)['update']
 
-    # If you input the exact same dataframe theres nothing to update
-    # must save row version and ids for later
-    rowids = updating_databasedf.index.values
-    # Set index values to be 'checkby' values
-    updatesetdf.index = updatesetdf[checkby]
-    updating_databasedf.index = updating_databasedf[checkby]
-    del updatesetdf[checkby]
-    del updating_databasedf[checkby]
 
-    # Remove duplicated index values
-    updatesetdf = updatesetdf[~updatesetdf.index.duplicated()]
-    # Reorder dataset index
-    updatesetdf = updatesetdf.loc[updating_databasedf.index]
-    # Index comparison
-    differences = updatesetdf != updating_databasedf
-    differentrows = differences.apply(sum, axis=1) > 0
+def _check_row_hash_columns(col, table_cols):
+    """
+    The row hash is computed over all the columns of a row, so a table
+    with a row hash can't be updated on a subset of its columns
 
-    toupdatedf = _create_update_rowsdf(
-        updating_databasedf, updatesetdf, rowids, differentrows)
+    Args:
+        col: Columns to update.  None for all columns
+        table_cols: Column names of the table
 
-    return(toupdatedf)
+    Raises:
+        ValueError: Only some columns of a table with a row hash are updated
+    """
+    if col is not None and ROW_HASH_COL in table_cols:
+        raise ValueError("Tables with a {} column must be updated on all "
+                         "their columns".format(ROW_HASH_COL))
 
 
 def updateData(
         syn, databaseSynId, newData,
         filterBy, filterByColumn="CENTER",
-        col=None, toDelete=False):
+        col=None, toDelete=False, max_memory=None, partial_update=False):
+    '''
+    Updates the rows of a synapse table partition with a new dataset
+
+    Args:
+        syn: Synapse object
+        databaseSynId: Synapse Id of the database table
+        newData: New dataset (pandas dataframe)
+        filterBy: Value of the partition to update
+        filterByColumn: Column to partition the table by. Defaults to CENTER
+        col: Columns to update. Defaults to all columns of the table
+        toDelete: Delete rows, Defaults to False
+        max_memory: Memory budget in bytes.  If specified, the partition is
+                    diffed out-of-core so the table doesn't have to fit in
+                    memory. Defaults to the budget of out_of_core_updates()
+        partial_update: Only send the changed cells of updated rows.
+                        Defaults to False
+
+    Raises:
+        ValueError: col is given for a table with a ROW_HASH_COL column
+
+    If no rows are deleted and the new dataset has at most
+    KEY_FETCH_MAX_KEYS keys, only the rows with those keys are downloaded.
+    Otherwise, if the table has a ROW_HASH_COL column and all columns are
+    updated, only the keys and row hashes of the partition are downloaded
+    and full rows are fetched for the keys whose hash changed.
+    '''
+    databaseSynId = get_current_table_id(databaseSynId)
+    if max_memory is None:
+        max_memory = _OUT_OF_CORE['max_memory']
+    if max_memory is not None:
+        update_data_out_of_core(
+            syn, databaseSynId, newData, filterBy,
+            filterByColumn=filterByColumn, col=col, toDelete=toDelete,
+            max_memory=max_memory, partial_update=partial_update)
+        return
     databaseEnt = syn.get(databaseSynId)
-    database = syn.tableQuery(
-        "SELECT * FROM {} where {} ='{}'".format(
-            databaseSynId, filterByColumn, filterBy))
-    database = database.asDataFrame()
+    where = "{} ='{}'".format(filterByColumn, filterBy)
+    table_cols = [column.name for column
+                  in syn.getTableColumns(databaseSynId)]
+    _check_row_hash_columns(col, table_cols)
+    keydf = newData[databaseEnt.primaryKey]
+    nkeys = len(keydf.drop_duplicates())
+    if (not toDelete and 0 < nkeys <= KEY_FETCH_MAX_KEYS and
+            keydf.notnull().values.all()):
+        database = _get_database_by_keys(
+            syn, databaseSynId, newData, databaseEnt.primaryKey,
+            table_cols, where)
+    elif col is None and ROW_HASH_COL in table_cols:
+        database = _get_database_by_row_hash(
+            syn, databaseSynId, newData, databaseEnt.primaryKey,
+            table_cols, where)
+    else:
+        database = syn.tableQuery(
+            "SELECT * FROM {} where {}".format(databaseSynId, where))
+        database = database.asDataFrame()
     if col is not None:
         database = database[col]
     else:
-        newData = newData[database.columns]
+        # The row hash is filled in by updateDatabase
+        newData = newData[[column for column in database.columns
+                           if column != ROW_HASH_COL]]
     updateDatabase(
         syn, database, newData, databaseSynId,
-        databaseEnt.primaryKey, toDelete)
+        databaseEnt.primaryKey, toDelete, partial_update=partial_update)
+
+
+def _format_new_dataset(new_dataset, columns):
+    """
+    Fill in blank values and the row hash of a new dataset and put its
+    columns in the order of the table
+
+    Args:
+        new_dataset: New dataset (pandas dataframe)
+        columns: Columns of the table
+
+    Returns:
+        Dataframe: formatted copy of new_dataset
+    """
+    new_dataset = new_dataset.fillna("")
+    if ROW_HASH_COL in columns:
+        new_dataset = _add_row_hash(new_dataset[
+            [col for col in columns if col != ROW_HASH_COL]])
+    # Columns must be in the same order
+    return new_dataset[columns]
+
+
+def _get_database_changes(database, new_dataset, primary_key_cols,
+                          to_delete=False, hash_primary_key=False):
+    """
+    Compares a dataset with the synapse table it updates
+
+    Args:
+        database: The synapse table (pandas dataframe)
+        new_dataset: New dataset (pandas dataframe)
+        primary_key_cols: Column(s) that make up the unique key
+        to_delete: Delete rows, Defaults to False
+        hash_primary_key: Compare rows by a 64-bit hash of the primary key
+                          instead of the joined string. Defaults to False
+
+    Returns:
+        dict: col_order: Columns of the table update
+              append: Dataframe of rows to append
+              update: Dataframe of rows to update
+              changed_cells: Dataframe of booleans, True for the cells
+                             that changed in each row to update
+              delete: Dataframe of ROW_ID and ROW_VERSION to delete
+    """
+    primary_key = 'UNIQUE_KEY'
+    database = database.fillna("")
+    orig_database_cols = database.columns
+    col_order = ['ROW_ID', 'ROW_VERSION']
+    col_order.extend(orig_database_cols.tolist())
+    new_dataset = _format_new_dataset(new_dataset, orig_database_cols)
+    database[primary_key_cols] = database[primary_key_cols].astype(str)
+    database[primary_key] = _create_primary_key(
+        database, primary_key_cols, hash_key=hash_primary_key)
+
+    new_dataset[primary_key_cols] = new_dataset[primary_key_cols].astype(str)
+    new_dataset[primary_key] = _create_primary_key(
+        new_dataset, primary_key_cols, hash_key=hash_primary_key)
+
+    row_changes = _diff_rows(new_dataset, database, primary_key)
+    if not to_delete:
+        row_changes['delete'] = pd.DataFrame()
+    row_changes['col_order'] = col_order
+    return row_changes
+
+
+def _write_database_changes(updatefile, changes, integer_cols=None):
+    """
+    Writes the rows of a table update to an open csv file
+
+    Args:
+        updatefile: File handle of the update csv
+        changes: Table changes from _get_database_changes
+        integer_cols: Integer columns of the table.  Inferred from the
+                      dtypes if None
+
+    Returns:
+        bool: True if any rows were written
+    """
+    written = False
+    allupdates = pd.DataFrame(columns=changes['col_order'])
+    allupdates = allupdates.append(changes['append'], sort=False)
+    allupdates = allupdates.append(changes['update'], sort=False)
+    if not allupdates.empty:
+        write_df_csv(allupdates[changes['col_order']], updatefile,
+                     header=False, integer_cols=integer_cols)
+        written = True
+    if not changes['delete'].empty:
+        write_df_csv(changes['delete'], updatefile, header=False,
+                     integer_cols=[])
+        written = True
+    return written
+
+
+# Updated rows with a larger fraction of changed cells are sent as full rows
+PARTIAL_UPDATE_MAX_CHANGED = 0.5
+
+
+def _to_cell_value(value):
+    """
+    Convert a dataframe value to the value of a partial row cell
+
+    Args:
+        value: Dataframe value
+
+    Returns:
+        Cell value, None for blank values
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, str) and value == '':
+        return None
+    # This is done because of pandas typing.  An integer column with one
+    # NA/blank value will be cast as a double.
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _get_partial_rows(updatedf, changed_cells, name_to_column_id):
+    """
+    Create partial rows that only contain the changed cells of each row
+
+    Args:
+        updatedf: Dataframe of rows to update with a ROW_ID column
+        changed_cells: Dataframe of booleans, True for changed cells
+        name_to_column_id: Mapping of column names to Synapse column ids
+
+    Returns:
+        list: synapseclient.table.PartialRow
+    """
+    columns = changed_cells.columns
+    values = updatedf[columns].values
+    partial_rows = []
+    for rowid, row_values, changed in zip(updatedf['ROW_ID'], values,
+                                          changed_cells.values):
+        cells = {column: _to_cell_value(value)
+                 for column, value, is_changed
+                 in zip(columns, row_values, changed) if is_changed}
+        partial_rows.append(
+            synapseclient.table.PartialRow(
+                cells, rowid, nameToColumnId=name_to_column_id))
+    return partial_rows
+
+
+def _split_partial_updates(changes, max_changed=PARTIAL_UPDATE_MAX_CHANGED):
+    """
+    Split the updated rows into rows where only a few cells changed, which
+    are stored as partial rows, and rows that are stored as full rows.
+
+    Args:
+        changes: Table changes from _get_database_changes
+        max_changed: Largest fraction of changed cells of a row to store as
+                     a partial row. Defaults to PARTIAL_UPDATE_MAX_CHANGED
+
+    Returns:
+        dict: Table changes with the partial updates moved to partial and
+              partial_cells
+    """
+    updatedf = changes['update']
+    changed_cells = changes['changed_cells']
+    if updatedf.empty:
+        partial = np.zeros(0, dtype=bool)
+    else:
+        partial = (changed_cells.mean(axis=1) <= max_changed).values
+    changes['partial'] = updatedf[partial].reset_index(drop=True)
+    changes['partial_cells'] = changed_cells[partial].reset_index(drop=True)
+    changes['update'] = updatedf[~partial].reset_index(drop=True)
+    changes['changed_cells'] = changed_cells[~partial].reset_index(drop=True)
+    return changes
+
+
+def _get_partial_rowset(database_synid, changes, table_columns):
+    """
+    Get the partial row set of the changed cells of the partial updates
+
+    Args:
+        database_synid: Synapse Id of the database table
+        changes: Table changes from _split_partial_updates
+        table_columns: Synapse table columns (syn.getTableColumns)
+
+    Returns:
+        synapseclient.table.PartialRowset, None if there are no partial
+        updates
+    """
+    if changes['partial'].empty:
+        return None
+    name_to_column_id = {column.name: column.id for column
+                         in table_columns}
+    partial_rows = _get_partial_rows(changes['partial'],
+                                     changes['partial_cells'],
+                                     name_to_column_id)
+    return synapseclient.table.PartialRowset(database_synid, partial_rows)
+
+
+def _store_partial_updates(syn, database_synid, changes, table_columns):
+    """
+    Stores only the changed cells of the partial updates as a partial
+    row set.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        changes: Table changes from _split_partial_updates
+        table_columns: Synapse table columns (syn.getTableColumns)
+    """
+    rowset = _get_partial_rowset(database_synid, changes, table_columns)
+    if rowset is None:
+        return
+    logger.info("Updating {} cells in {} rows".format(
+        int(changes['partial_cells'].values.sum()), len(rowset.rows)))
+    syn.store(rowset)
+
+
+# Set by dry_run() so that table updates are planned but nothing is stored
+_DRY_RUN = False
+
+
+@contextlib.contextmanager
+def dry_run():
+    """
+    Context in which table updates are computed and logged, but not
+    stored in Synapse.  Files and logs aren't stored and validation
+    errors aren't emailed either.
+    """
+    global _DRY_RUN
+    previous = _DRY_RUN
+    _DRY_RUN = True
+    try:
+        yield
+    finally:
+        _DRY_RUN = previous
+
+
+def is_dry_run():
+    """Whether table updates are only planned"""
+    return _DRY_RUN
+
+
+class _ByteCounter(io.TextIOBase):
+    """Text sink that only counts the bytes written to it"""
+    def __init__(self):
+        self.nbytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.nbytes += len(text.encode("utf-8"))
+        return len(text)
+
+
+class TableChangeSet:
+    """
+    Planned changes to a Synapse table.  Nothing is stored until apply()
+    is called.
+
+    Attributes:
+        database_synid: Synapse Id of the database table
+        append: Dataframe of rows to append
+        update: Dataframe of full rows to update
+        partial: Dataframe of rows to update cell by cell
+        partial_cells: Dataframe of booleans, True for the changed cells
+                       of the partial updates
+        delete: Dataframe of ROW_ID and ROW_VERSION to delete
+        col_order: Columns of the table update
+        primary_key_cols: Column(s) that make up the unique key
+    """
+    def __init__(self, syn, database_synid, changes, table_columns,
+                 partial_update=False, primary_key_cols=None):
+        self.syn = syn
+        self.database_synid = database_synid
+        self.table_columns = table_columns
+        self.primary_key_cols = primary_key_cols
+        if partial_update:
+            changes = _split_partial_updates(changes)
+        else:
+            changes['partial'] = changes['update'].iloc[:0]
+            changes['partial_cells'] = changes['changed_cells'].iloc[:0]
+        self.append = changes['append']
+        self.update = changes['update']
+        self.changed_cells = changes['changed_cells']
+        self.partial = changes['partial']
+        self.partial_cells = changes['partial_cells']
+        self.delete = changes['delete']
+        self.col_order = changes['col_order']
+        self._estimated_bytes = None
+
+    @property
+    def changes(self):
+        """dict: Table changes in the form of _get_database_changes"""
+        return {'append': self.append, 'update': self.update,
+                'changed_cells': self.changed_cells,
+                'partial': self.partial, 'partial_cells': self.partial_cells,
+                'delete': self.delete, 'col_order': self.col_order}
+
+    @property
+    def integer_cols(self):
+        return get_integer_columns(self.table_columns)
+
+    @property
+    def empty(self):
+        """bool: True if the table doesn't change"""
+        return (self.append.empty and self.update.empty and
+                self.partial.empty and self.delete.empty)
+
+    @property
+    def replaced_rowids(self):
+        """list: ROW_IDs of the rows that are updated or deleted"""
+        rowids = []
+        for updatedf in (self.update, self.partial):
+            if not updatedf.empty:
+                rowids.extend(updatedf['ROW_ID'].astype(str))
+        if not self.delete.empty:
+            rowids.extend(self.delete.iloc[:, 0].astype(str))
+        return rowids
+
+    @property
+    def new_rows(self):
+        """Dataframe: Full rows that are appended or updated"""
+        new_rows = [
+            changedf.drop(columns=['ROW_ID', 'ROW_VERSION'], errors='ignore')
+            for changedf in (self.append, self.update, self.partial)
+            if not changedf.empty
+        ]
+        if not new_rows:
+            return pd.DataFrame(columns=self.col_order[2:])
+        return pd.concat(new_rows, sort=False, ignore_index=True)
+
+    @property
+    def counts(self):
+        """dict: Number of rows appended, updated and deleted"""
+        return {'append': len(self.append),
+                'update': len(self.update) + len(self.partial),
+                'delete': len(self.delete)}
+
+    @property
+    def estimated_bytes(self):
+        """int: Size of the table update csv and of the partial row set
+        in bytes"""
+        if self._estimated_bytes is None:
+            counter = _ByteCounter()
+            counter.write(",".join(self.col_order) + "\n")
+            _write_database_changes(counter, self.changes,
+                                    integer_cols=self.integer_cols)
+            rowset = _get_partial_rowset(self.database_synid, self.changes,
+                                         self.table_columns)
+            if rowset is not None:
+                counter.write(json.dumps(rowset))
+            self._estimated_bytes = counter.nbytes
+        return self._estimated_bytes
+
+    def summary(self):
+        """str: One line description of the changes"""
+        counts = self.counts
+        return ("{}: {} rows to append, {} rows to update "
+                "({} cell by cell), {} rows to delete, ~{} bytes".format(
+                    self.database_synid, counts['append'], counts['update'],
+                    len(self.partial), counts['delete'],
+                    self.estimated_bytes))
+
+    def apply(self):
+        """Stores the changes in the Synapse table"""
+        _store_partial_updates(self.syn, self.database_synid, self.changes,
+                               self.table_columns)
+        update_all_file = tempfile.NamedTemporaryFile(dir=SCRIPT_DIR,
+                                                      delete=False)
+
+        with open(update_all_file.name, "w") as updatefile:
+            # Must write out the headers in case there are no appends
+            # or updates
+            updatefile.write(",".join(self.col_order) + "\n")
+            storedatabase = _write_database_changes(
+                updatefile, self.changes, integer_cols=self.integer_cols)
+        if storedatabase:
+            store_table_update(self.syn, self.database_synid,
+                               update_all_file.name,
+                               primary_key_cols=self.primary_key_cols)
+        # Delete the update file
+        os.unlink(update_all_file.name)
+
+
+def plan_database_update(
+        syn, database, new_dataset, database_synid,
+        primary_key_cols, to_delete=False, hash_primary_key=False,
+        partial_update=False):
+    """
+    Computes the changes that updateDatabase would store without
+    storing them
+
+    Args:
+        syn: Synapse object
+        database: The synapse table (pandas dataframe)
+        new_dataset: New dataset (pandas dataframe)
+        database_synid: Synapse Id of the database table
+        primary_key_cols: Column(s) that make up the unique key
+        to_delete: Delete rows, Defaults to False
+        hash_primary_key: Compare rows by a 64-bit hash of the primary key
+                          instead of the joined string. Defaults to False
+        partial_update: Only send the changed cells of updated rows.
+                        Defaults to False
+
+    Returns:
+        TableChangeSet
+    """
+    changes = _get_database_changes(
+        database, new_dataset, primary_key_cols, to_delete=to_delete,
+        hash_primary_key=hash_primary_key)
+    table_columns = list(syn.getTableColumns(database_synid))
+    return TableChangeSet(syn, database_synid, changes, table_columns,
+                          partial_update=partial_update,
+                          primary_key_cols=primary_key_cols)
 
 
 def updateDatabase(
         syn, database, new_dataset, database_synid,
-        primary_key_cols, to_delete=False):
+        primary_key_cols, to_delete=False, hash_primary_key=False,
+        partial_update=False):
     """
     Updates synapse tables by a row identifier with another
-    dataset that has the same number and order of columns
+    dataset that has the same number and order of columns.
+    The changes are only logged in a dry_run() context.  In a
+    table_rebuilds() context, a new table is built instead when most rows
+    change, and later updates of the table go to the new table.  The
+    database rows must then be queried from get_current_table_id().
 
     Args:
         syn: Synapse object
@@ -732,66 +1480,1040 @@ def updateDatabase(
         databaseSynId: Synapse Id of the database table
         uniqueKeyCols: Column(s) that make up the unique key
         toDelete: Delete rows, Defaults to False
+        hash_primary_key: Compare rows by a 64-bit hash of the primary key
+                          instead of the joined string. Defaults to False
+        partial_update: Only send the changed cells of updated rows.
+                        Defaults to False
 
     Returns:
-        Nothing
+        TableChangeSet
+
+    Raises:
+        ValueError: The database rows are from a table that was rebuilt
     """
-    primary_key = 'UNIQUE_KEY'
-    database = database.fillna("")
-    orig_database_cols = database.columns
-    col_order = ['ROW_ID', 'ROW_VERSION']
-    col_order.extend(orig_database_cols.tolist())
-    new_dataset = new_dataset.fillna("")
-    # Columns must be in the same order
-    new_dataset = new_dataset[orig_database_cols]
-    database[primary_key_cols] = database[primary_key_cols].applymap(str)
-    database[primary_key] = database[
-        primary_key_cols].apply(lambda x: ' '.join(x), axis=1)
-
-    new_dataset[primary_key_cols] = new_dataset[primary_key_cols].applymap(str)
-    new_dataset[primary_key] = new_dataset[
-        primary_key_cols].apply(lambda x: ' '.join(x), axis=1)
-
-    allupdates = pd.DataFrame(columns=col_order)
-    to_append_rows = _append_rows(new_dataset, database, primary_key)
-    to_update_rows = _update_rows(new_dataset, database, primary_key)
-    if to_delete:
-        to_delete_rows = _delete_rows(new_dataset, database, primary_key)
+    current_synid = get_current_table_id(database_synid)
+    if current_synid != database_synid:
+        if not database.empty:
+            raise ValueError(
+                "{} was rebuilt as {}, its rows must be queried from "
+                "the new table".format(database_synid, current_synid))
+        database_synid = current_synid
+    change_set = plan_database_update(
+        syn, database, new_dataset, database_synid, primary_key_cols,
+        to_delete=to_delete, hash_primary_key=hash_primary_key,
+        partial_update=partial_update)
+    if is_dry_run():
+        logger.info("DRY RUN {}".format(change_set.summary()))
+    elif _should_rebuild(syn, change_set, database, to_delete):
+        logger.info("REBUILDING {}".format(change_set.summary()))
+        rebuild_table(syn, database_synid, change_set.new_rows,
+                      change_set.replaced_rowids,
+                      _REBUILD['database_mapping_synid'],
+                      primary_key_cols=primary_key_cols)
     else:
-        to_delete_rows = pd.DataFrame()
-    allupdates = allupdates.append(to_append_rows, sort=False)
-    allupdates = allupdates.append(to_update_rows, sort=False)
-
-    storedatabase = False
-    update_all_file = tempfile.NamedTemporaryFile(dir=SCRIPT_DIR,
-                                                  delete=False)
-
-    with open(update_all_file.name, "w") as updatefile:
-        # Must write out the headers in case there are no appends or updates
-        updatefile.write(",".join(col_order) + "\n")
-        if not allupdates.empty:
-            '''
-            This is done because of pandas typing.
-            An integer column with one NA/blank value
-            will be cast as a double.
-            '''
-            updatefile.write(
-                allupdates[col_order]
-                .to_csv(index=False, header=None)
-                .replace(".0,", ",")
-                .replace(".0\n", "\n"))
-            storedatabase = True
-        if not to_delete_rows.empty:
-            updatefile.write(
-                to_delete_rows
-                .to_csv(index=False, header=None)
-                .replace(".0,", ",")
-                .replace(".0\n", "\n"))
-            storedatabase = True
-    if storedatabase:
-        syn.store(synapseclient.Table(database_synid, update_all_file.name))
-    # Delete the update file
-    os.unlink(update_all_file.name)
+        change_set.apply()
+    return change_set
+
+
+##############################################################################
+# ROW HASHES
+##############################################################################
+
+# Optional table column holding the fingerprint of the rest of the row.
+# It is filled in by updateDatabase, so rows changed outside of it must
+# have this column cleared to be picked up by the next update.
+ROW_HASH_COL = "_ROW_HASH"
+# Number of row ids fetched per query
+ROW_ID_QUERY_BATCH_SIZE = 1000
+
+
+def add_row_hash_column(syn, database_synid):
+    """
+    Add the managed row hash column to a Synapse table.  Existing rows
+    get their hash on the next update.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+
+    Returns:
+        synapseclient.Schema
+    """
+    schema = syn.get(database_synid)
+    schema.addColumn(synapseclient.Column(name=ROW_HASH_COL,
+                                          columnType="STRING",
+                                          maxSize=16))
+    return syn.store(schema)
+
+
+def _get_row_hash(df):
+    """
+    Get the row hash of each row as a hex string
+
+    Args:
+        df: Dataframe with blank values filled in
+
+    Returns:
+        Series: 16 character hex string of each row
+    """
+    fingerprint = _get_row_fingerprint(df)
+    return fingerprint.map("{:016x}".format)
+
+
+def _add_row_hash(df):
+    """
+    Set the row hash column to the hash of the other columns
+
+    Args:
+        df: Dataframe with blank values filled in
+
+    Returns:
+        Dataframe: copy of df with ROW_HASH_COL
+    """
+    data_cols = [col for col in df.columns if col != ROW_HASH_COL]
+    return df.assign(**{ROW_HASH_COL: _get_row_hash(df[data_cols])})
+
+
+def _fetch_rows_by_id(syn, database_synid, rowids,
+                      batch_size=ROW_ID_QUERY_BATCH_SIZE):
+    """
+    Fetch full rows of a Synapse table by their row ids
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        rowids: ROW_IDs to fetch
+        batch_size: Number of row ids per query.
+                    Defaults to ROW_ID_QUERY_BATCH_SIZE
+
+    Returns:
+        Dataframe: rows indexed by {ROW_ID}_{ROW_VERSION}
+    """
+    rowids = list(rowids)
+    queries = [
+        "SELECT * FROM {} WHERE ROW_ID IN ({})".format(
+            database_synid, ",".join(rowids[start:start + batch_size]))
+        for start in range(0, len(rowids), batch_size)]
+    return _query_table_batches(syn, queries)
+
+
+def _get_database_by_row_hash(syn, database_synid, new_dataset,
+                              primary_key_cols, table_cols, where):
+    """
+    Get the rows of a table partition for updateDatabase by downloading
+    only the keys and row hashes.  Full rows are fetched for the keys
+    whose hash differs from the new dataset.  Rows with the same hash are
+    taken from the new dataset and rows to delete only have their keys.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        new_dataset: New dataset (pandas dataframe)
+        primary_key_cols: Column(s) that make up the unique key
+        table_cols: Column names of the table
+        where: Condition of the table partition
+
+    Returns:
+        Dataframe: table partition indexed by {ROW_ID}_{ROW_VERSION}
+    """
+    primary_key_cols = list(primary_key_cols)
+    key_cols = ",".join('"{}"'.format(col)
+                        for col in primary_key_cols + [ROW_HASH_COL])
+    hashdf = syn.tableQuery("SELECT {} FROM {} where {}".format(
+        key_cols, database_synid, where)).asDataFrame()
+    hashdf = hashdf.fillna("")
+    hashdf[primary_key_cols] = hashdf[primary_key_cols].astype(str)
+
+    data_cols = [col for col in table_cols if col != ROW_HASH_COL]
+    new_dataset = _add_row_hash(new_dataset[data_cols].fillna(""))
+    new_keydf = new_dataset[primary_key_cols].astype(str)
+    new_hashdf = pd.DataFrame({
+        'key': _create_primary_key(new_keydf, primary_key_cols).values,
+        'new_hash': new_dataset[ROW_HASH_COL].values,
+        'new_pos': np.arange(len(new_dataset))
+    }).drop_duplicates('key')
+    merged = pd.DataFrame({
+        'key': _create_primary_key(hashdf, primary_key_cols).values,
+        'hash': hashdf[ROW_HASH_COL].values,
+        'rowid': hashdf.index.values
+    }).merge(new_hashdf, on='key', how='left')
+
+    unchanged = (merged['hash'] == merged['new_hash']).values
+    deleted = merged['new_hash'].isnull().values
+    changed = ~unchanged & ~deleted
+
+    unchangeddf = new_dataset.iloc[merged['new_pos'][unchanged].astype(int)]
+    unchangeddf.index = merged['rowid'][unchanged].values
+    deleteddf = hashdf[deleted]
+    changed_rowids = _get_rowid_version_df(merged['rowid'][changed])[0]
+    logger.info("Fetching {} of {} rows with a changed row hash".format(
+        len(changed_rowids), len(merged)))
+    changeddf = _fetch_rows_by_id(syn, database_synid, changed_rowids)
+    database = pd.concat([changeddf, unchangeddf, deleteddf], sort=False)
+    return database.reindex(columns=table_cols)
+
+
+##############################################################################
+# KEY-TARGETED FETCH
+##############################################################################
+
+# Largest number of new dataset keys to fetch by key instead of downloading
+# the whole table partition
+KEY_FETCH_MAX_KEYS = 5000
+# Number of keys per query and queries run at once
+KEY_QUERY_BATCH_SIZE = 200
+TABLE_QUERY_THREADS = 4
+
+
+def _query_table_batches(syn, queries, threads=TABLE_QUERY_THREADS):
+    """
+    Run table queries concurrently and combine their results
+
+    Args:
+        syn: Synapse object
+        queries: Table queries
+        threads: Number of queries run at once.
+                 Defaults to TABLE_QUERY_THREADS
+
+    Returns:
+        Dataframe: rows indexed by {ROW_ID}_{ROW_VERSION}
+    """
+    if not queries:
+        return pd.DataFrame()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        fetched = list(executor.map(
+            lambda query: syn.tableQuery(query).asDataFrame(), queries))
+    return pd.concat(fetched, sort=False)
+
+
+def _sql_value(value):
+    """Format a value for a table query"""
+    if isinstance(value, (bool, np.bool_)):
+        return str(value).lower()
+    if isinstance(value, (float, np.floating)) and value.is_integer():
+        return "{}".format(int(value))
+    if isinstance(value, (int, float, np.number)):
+        return "{}".format(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def _get_key_queries(database_synid, keydf, where=None,
+                     batch_size=KEY_QUERY_BATCH_SIZE):
+    """
+    Create the queries that fetch the rows of the given keys.  With more
+    than one key column, each batch fetches the rows matching any
+    combination of its values, which is filtered afterwards.
+
+    Args:
+        database_synid: Synapse Id of the database table
+        keydf: Dataframe of unique primary keys
+        where: Condition of the table partition.  Defaults to the whole
+               table
+        batch_size: Number of keys per query.
+                    Defaults to KEY_QUERY_BATCH_SIZE
+
+    Returns:
+        list: table queries
+    """
+    queries = []
+    for start in range(0, len(keydf), batch_size):
+        batch = keydf.iloc[start:start + batch_size]
+        conditions = [
+            '"{}" IN ({})'.format(
+                col, ",".join(_sql_value(value)
+                              for value in batch[col].dropna().unique()))
+            for col in keydf.columns]
+        if where is not None:
+            conditions.insert(0, where)
+        queries.append("SELECT * FROM {} where {}".format(
+            database_synid, " AND ".join(conditions)))
+    return queries
+
+
+def _get_database_by_keys(syn, database_synid, new_dataset,
+                          primary_key_cols, table_cols, where):
+    """
+    Get the rows of a table partition that have the primary keys of a new
+    dataset.  Rows that aren't in the new dataset are not fetched, so this
+    can't be used to delete rows.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        new_dataset: New dataset (pandas dataframe)
+        primary_key_cols: Column(s) that make up the unique key
+        table_cols: Column names of the table
+        where: Condition of the table partition
+
+    Returns:
+        Dataframe: matching rows indexed by {ROW_ID}_{ROW_VERSION}
+    """
+    primary_key_cols = list(primary_key_cols)
+    keydf = new_dataset[primary_key_cols].drop_duplicates()
+    queries = _get_key_queries(database_synid, keydf, where)
+    logger.info("Fetching {} keys of {} in {} queries".format(
+        len(keydf), database_synid, len(queries)))
+    database = _query_table_batches(syn, queries).reindex(columns=table_cols)
+    if len(primary_key_cols) > 1 and not database.empty:
+        database_key = _create_primary_key(
+            database[primary_key_cols].fillna("").astype(str),
+            primary_key_cols)
+        new_key = _create_primary_key(
+            keydf.fillna("").astype(str), primary_key_cols)
+        database = database[database_key.isin(new_key).values]
+    return database
+
+
+##############################################################################
+# TABLE REBUILDS
+##############################################################################
+
+# Rebuild a table instead of updating it when the changed rows are more than
+# this fraction of the rows
+REBUILD_CHANGED_RATIO = 0.5
+# Number of rows per csv partition and partitions loaded at once
+REBUILD_PARTITION_ROWS = 100000
+REBUILD_THREADS = 4
+
+# Set by table_rebuilds()
+_REBUILD = {'database_mapping_synid': None,
+            'changed_ratio': REBUILD_CHANGED_RATIO}
+# Synapse ids of rebuilt tables to the ids of the tables that replaced them
+_REBUILT_TABLES = {}
+
+
+@contextlib.contextmanager
+def table_rebuilds(database_mapping_synid,
+                   changed_ratio=REBUILD_CHANGED_RATIO):
+    """
+    Context in which updateDatabase rebuilds a table instead of updating
+    it when more than changed_ratio of the rows change
+
+    Args:
+        database_mapping_synid: Synapse id of the database to synapse id
+                                mapping table
+        changed_ratio: Fraction of changed rows above which tables are
+                       rebuilt. Defaults to REBUILD_CHANGED_RATIO
+    """
+    previous = dict(_REBUILD)
+    _REBUILD.update(database_mapping_synid=database_mapping_synid,
+                    changed_ratio=changed_ratio)
+    try:
+        yield
+    finally:
+        _REBUILD.update(previous)
+
+
+def get_current_table_id(database_synid):
+    """
+    Get the Synapse id of the table that replaced a rebuilt table
+
+    Args:
+        database_synid: Synapse id of a table
+
+    Returns:
+        str: Synapse id of the current table
+    """
+    while database_synid in _REBUILT_TABLES:
+        database_synid = _REBUILT_TABLES[database_synid]
+    return database_synid
+
+
+def _should_rebuild(syn, change_set, database, to_delete):
+    """
+    Whether a table update changes enough of the rows of the whole table
+    to rebuild it.  Only updates of whole rows that delete the rows
+    missing from the new dataset can be rebuilt, and the rows of an empty
+    partition are always appended.
+    """
+    if _REBUILD['database_mapping_synid'] is None:
+        return False
+    table_cols = [column.name for column in change_set.table_columns]
+    if (not to_delete or database.empty or
+            sorted(database.columns) != sorted(table_cols)):
+        return False
+    counts = change_set.counts
+    changed = counts['append'] + counts['update'] + counts['delete']
+    # The table has at least the rows of the partition, so the table
+    # isn't counted when the changes are few next to the partition alone
+    if changed / len(database) <= _REBUILD['changed_ratio']:
+        return False
+    nrows = syn.tableQuery("SELECT COUNT(*) FROM {}".format(
+        change_set.database_synid)).asDataFrame().iloc[0, 0]
+    return changed / max(int(nrows), 1) > _REBUILD['changed_ratio']
+
+
+def create_new_table(syn, table_ent, name, parentid=None):
+    """
+    Create an empty table with the columns and primary key of a table
+
+    Args:
+        syn: Synapse object
+        table_ent: Table schema to copy
+        name: Name of the new table
+        parentid: Synapse id of the project of the new table.
+                  Defaults to the project of table_ent
+
+    Returns:
+        synapseclient.Schema: new table
+    """
+    columns = list(syn.getTableColumns(table_ent.id))
+    schema = synapseclient.Schema(
+        name=name, columns=columns,
+        parent=table_ent.parentId if parentid is None else parentid)
+    schema.primaryKey = table_ent.primaryKey
+    return syn.store(schema)
+
+
+def swap_database_mapping(syn, database_mapping_synid,
+                          database_synid_mappingdf, database, new_synid):
+    """
+    Point a database of the database to synapse id mapping table to a new
+    table.  Only the row of the database is stored, in one transaction.
+
+    Args:
+        syn: Synapse object
+        database_mapping_synid: Synapse id of the mapping table
+        database_synid_mappingdf: Database to synapse id mapping dataframe
+        database: Name of the database
+        new_synid: Synapse id of the new table
+
+    Returns:
+        Dataframe: database to synapse id mapping with the new id
+    """
+    database_synid_mappingdf = database_synid_mappingdf.copy()
+    is_database = database_synid_mappingdf['Database'] == database
+    database_synid_mappingdf.loc[is_database, 'Id'] = new_synid
+    syn.store(synapseclient.Table(database_mapping_synid,
+                                  database_synid_mappingdf[is_database]))
+    return database_synid_mappingdf
+
+
+def archive_table(syn, table_ent, parentid=None):
+    """
+    Rename a replaced table as archived
+
+    Args:
+        syn: Synapse object
+        table_ent: Table schema
+        parentid: Synapse id of the project to move the table to.
+                  Defaults to leaving it in its project
+    """
+    if parentid is not None:
+        table_ent.parentId = parentid
+    table_ent.name = "ARCHIVED " + table_ent.name
+    syn.store(table_ent)
+
+
+def _write_rebuild_partitions(syn, database_synid, new_dataset,
+                              replaced_rowids, columns, workdir):
+    """
+    Write the rows of a rebuilt table to csv partitions: the rows of the
+    old table that are not replaced, followed by the new rows
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse id of the old table
+        new_dataset: Rows appended or updated (pandas dataframe)
+        replaced_rowids: ROW_IDs of the old table that are updated or
+                         deleted
+        columns: Columns of the table
+        workdir: Directory to write partitions to
+
+    Returns:
+        list: Paths to the csv partitions
+    """
+    partition_paths = []
+
+    def write_partition(df, integer_cols):
+        partition_path = os.path.join(
+            workdir, "rebuild_{}.csv".format(len(partition_paths)))
+        with open(partition_path, "w") as partition_file:
+            write_df_csv(df, partition_file, integer_cols=integer_cols)
+        partition_paths.append(partition_path)
+
+    query_result = syn.tableQuery("SELECT * FROM {}".format(database_synid),
+                                  resultsAs="csv", downloadLocation=workdir)
+    replaced_rowids = set(replaced_rowids)
+    chunks = pd.read_csv(
+        query_result.filepath, dtype=str, keep_default_na=False,
+        chunksize=REBUILD_PARTITION_ROWS, sep=query_result.separator,
+        quotechar=query_result.quoteCharacter,
+        escapechar=query_result.escapeCharacter)
+    for chunk in chunks:
+        chunk = chunk[~chunk['ROW_ID'].isin(replaced_rowids)]
+        if not chunk.empty:
+            write_partition(chunk[columns], [])
+    os.unlink(query_result.filepath)
+
+    new_dataset = _format_new_dataset(new_dataset, columns)
+    integer_cols = get_integer_columns(query_result.headers)
+    for start in range(0, len(new_dataset), REBUILD_PARTITION_ROWS):
+        write_partition(
+            new_dataset.iloc[start:start + REBUILD_PARTITION_ROWS],
+            integer_cols)
+    return partition_paths
+
+
+def rebuild_table(syn, database_synid, new_dataset, replaced_rowids,
+                  database_mapping_synid, threads=REBUILD_THREADS,
+                  primary_key_cols=None):
+    """
+    Replace a table of the database mapping with a new table holding its
+    rows with replaced_rowids swapped for new_dataset.  The new table is
+    loaded in parallel csv partitions, then the mapping is pointed to it
+    and the old table is archived.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse id of the table
+        new_dataset: Rows appended or updated (pandas dataframe)
+        replaced_rowids: ROW_IDs of the table that are updated or deleted
+        database_mapping_synid: Synapse id of the database to synapse id
+                                mapping table
+        threads: Number of partitions loaded at once.
+                 Defaults to REBUILD_THREADS
+        primary_key_cols: Column(s) that make up the unique key, to check
+                          whether a failed partition upload was stored
+
+    Returns:
+        str: Synapse id of the new table
+    """
+    database_synid_mappingdf = syn.tableQuery(
+        "SELECT * FROM {}".format(database_mapping_synid)).asDataFrame()
+    database = lookup_dataframe_value(database_synid_mappingdf, "Database",
+                                      'Id == "{}"'.format(database_synid))
+    table_ent = syn.get(database_synid)
+    new_table = create_new_table(
+        syn, table_ent, "{} {}".format(table_ent.name, int(time.time())))
+    columns = [column.name for column in syn.getTableColumns(new_table.id)]
+
+    with tempfile.TemporaryDirectory(dir=SCRIPT_DIR) as workdir:
+        partition_paths = _write_rebuild_partitions(
+            syn, database_synid, new_dataset, replaced_rowids, columns,
+            workdir)
+        logger.info("LOADING {} IN {} PARTITIONS".format(
+            new_table.id, len(partition_paths)))
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # list() raises the errors of the partition uploads
+            list(executor.map(
+                lambda path: store_table_update(
+                    syn, new_table.id, path,
+                    primary_key_cols=primary_key_cols),
+                partition_paths))
+
+    swap_database_mapping(syn, database_mapping_synid,
+                          database_synid_mappingdf, database, new_table.id)
+    archive_table(syn, table_ent)
+    _REBUILT_TABLES[database_synid] = new_table.id
+    return new_table.id
+
+
+##############################################################################
+# BATCHED TABLE UPLOADS
+##############################################################################
+
+# Largest size in bytes of one table update upload
+TABLE_BATCH_MAX_BYTES = 50 * 1024 * 1024
+# Number of rows in the first table update upload and the smallest batch
+TABLE_BATCH_START_ROWS = 10000
+TABLE_BATCH_MIN_ROWS = 100
+# Upload time in seconds that the batch size is adjusted towards
+TABLE_BATCH_TARGET_SECONDS = 60
+# Number of times a failed batch is retried and seconds to wait in between
+TABLE_BATCH_MAX_RETRIES = 3
+TABLE_BATCH_RETRY_WAIT = 10
+
+
+class _AdaptiveBatchSize:
+    """
+    Number of rows to send in one table update upload.  The batch grows
+    while uploads are fast and shrinks when they are slow or fail.
+    """
+    def __init__(self, rows=TABLE_BATCH_START_ROWS,
+                 min_rows=TABLE_BATCH_MIN_ROWS,
+                 target_seconds=TABLE_BATCH_TARGET_SECONDS):
+        self.rows = rows
+        self.min_rows = min_rows
+        self.target_seconds = target_seconds
+
+    def success(self, seconds):
+        """Adjust the batch size to the time an upload took"""
+        if seconds < self.target_seconds / 2:
+            self.rows *= 2
+        elif seconds > self.target_seconds:
+            self.shrink()
+
+    def shrink(self):
+        """Halve the batch size"""
+        self.rows = max(self.min_rows, self.rows // 2)
+
+
+def _read_csv_record(update_file):
+    """
+    Read one csv record, which spans several lines when a quoted field
+    has line breaks
+
+    Args:
+        update_file: File handle of a csv opened with newline=""
+
+    Returns:
+        str: csv record.  An empty string at the end of the file
+    """
+    record = update_file.readline()
+    # Quotes within quoted fields are doubled, so the quotes of a complete
+    # record are balanced
+    while record.count('"') % 2:
+        line = update_file.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def _read_table_batch(update_file, retry_lines, rows, max_bytes):
+    """
+    Read the csv records of the next table update batch.  Records of a
+    failed batch are read before new records from the file.
+
+    Args:
+        update_file: File handle of the update csv, past the header
+        retry_lines: deque of csv records that still need to be stored
+        rows: Largest number of records in the batch
+        max_bytes: Largest size of the batch in bytes
+
+    Returns:
+        list: csv records
+    """
+    lines = []
+    nbytes = 0
+    while len(lines) < rows and nbytes < max_bytes:
+        if retry_lines:
+            line = retry_lines.popleft()
+        else:
+            line = _read_csv_record(update_file)
+            if not line:
+                break
+        lines.append(line)
+        nbytes += len(line.encode("utf-8"))
+    return lines
+
+
+def _is_transient_error(error):
+    """Whether a table store failed on the transport or a busy server, so
+    that storing the batch again may succeed"""
+    if isinstance(error, SynapseHTTPError):
+        status = getattr(error.response, "status_code", None)
+        return status is not None and (status == 429 or status >= 500)
+    return isinstance(error, (
+        requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+        SynapseTimeoutError))
+
+
+def _get_appended_rows(header, lines):
+    """Rows of a table update batch that are appended, without a ROW_ID"""
+    batchdf = pd.read_csv(io.StringIO(header + "".join(lines)))
+    if 'ROW_ID' not in batchdf.columns:
+        return batchdf
+    return batchdf[batchdf['ROW_ID'].isnull()]
+
+
+def _count_stored_keys(syn, database_synid, appenddf, primary_key_cols):
+    """
+    Count the appended rows of a failed batch whose primary keys are in the
+    table
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        appenddf: Appended rows of the batch
+        primary_key_cols: Column(s) that make up the unique key
+
+    Returns:
+        int: Number of the appended keys in the table
+    """
+    primary_key_cols = list(primary_key_cols)
+    keydf = appenddf[primary_key_cols].drop_duplicates()
+    database = _query_table_batches(
+        syn, _get_key_queries(database_synid, keydf)
+    ).reindex(columns=primary_key_cols)
+    if database.empty:
+        return 0
+    database_key = _create_primary_key(
+        database.fillna("").astype(str), primary_key_cols)
+    new_key = _create_primary_key(
+        keydf.fillna("").astype(str), primary_key_cols)
+    return int(new_key.isin(database_key).sum())
+
+
+def _batch_was_stored(syn, database_synid, header, lines, primary_key_cols,
+                      error):
+    """
+    Whether a batch that failed with a transient error was stored.  Batches
+    without appended rows can be sent again whether they were stored or
+    not.
+
+    Raises:
+        The error of the batch when it can't be told whether its rows
+        were appended
+    """
+    appenddf = _get_appended_rows(header, lines)
+    if appenddf.empty:
+        return False
+    if primary_key_cols is None:
+        raise error
+    nstored = _count_stored_keys(syn, database_synid, appenddf,
+                                 primary_key_cols)
+    if nstored == 0:
+        return False
+    if nstored == len(appenddf[list(primary_key_cols)].drop_duplicates()):
+        return True
+    raise error
+
+
+def store_table_update(syn, database_synid, update_path,
+                       max_bytes=TABLE_BATCH_MAX_BYTES,
+                       max_retries=TABLE_BATCH_MAX_RETRIES,
+                       batch_size=None, primary_key_cols=None):
+    """
+    Stores a table update csv in size bounded batches.  Each batch is its
+    own table transaction so a failed batch is retried on its own without
+    redoing the batches that were already stored.
+
+    Only transport errors and busy server responses are retried.  The
+    transaction of such a batch may have been committed anyway, so before a
+    batch with appended rows is sent again, its primary keys are looked up
+    in the table and the batch is only sent again if none of them are
+    there.  Without primary keys such a batch isn't sent again.
+
+    Args:
+        syn: Synapse object
+        database_synid: Synapse Id of the database table
+        update_path: Path to the update csv with a header
+        max_bytes: Largest size of one batch in bytes.
+                   Defaults to TABLE_BATCH_MAX_BYTES
+        max_retries: Number of times a failed batch is retried.
+                     Defaults to TABLE_BATCH_MAX_RETRIES
+        batch_size: _AdaptiveBatchSize to start from
+        primary_key_cols: Column(s) that make up the unique key, to check
+                          whether a failed batch was stored
+
+    Returns:
+        int: number of batches stored
+    """
+    if batch_size is None:
+        batch_size = _AdaptiveBatchSize()
+    batch_path = update_path + ".batch"
+    retry_lines = deque()
+    nbatches = 0
+    failures = 0
+    with open(update_path, newline="") as update_file:
+        header = _read_csv_record(update_file)
+        while True:
+            lines = _read_table_batch(update_file, retry_lines,
+                                      batch_size.rows, max_bytes)
+            if not lines:
+                break
+            with open(batch_path, "w", newline="") as batch_file:
+                batch_file.write(header)
+                batch_file.writelines(lines)
+            start = time.time()
+            try:
+                syn.store(synapseclient.Table(database_synid, batch_path))
+            except Exception as error:
+                failures += 1
+                if failures > max_retries or not _is_transient_error(error):
+                    raise
+                # Give a transaction that outlived the request time to end
+                time.sleep(TABLE_BATCH_RETRY_WAIT * failures)
+                if _batch_was_stored(syn, database_synid, header, lines,
+                                     primary_key_cols, error):
+                    logger.warning(
+                        "Stored {} rows of {} despite: {}".format(
+                            len(lines), database_synid, error))
+                else:
+                    logger.warning(
+                        "Failed to store {} rows of {}, retrying: {}".format(
+                            len(lines), database_synid, error))
+                    retry_lines.extendleft(reversed(lines))
+                    batch_size.shrink()
+                    continue
+            finally:
+                os.unlink(batch_path)
+            failures = 0
+            nbatches += 1
+            batch_size.success(time.time() - start)
+    return nbatches
+
+
+##############################################################################
+# OUT-OF-CORE DATABASE UPDATES
+##############################################################################
+
+# Set by out_of_core_updates()
+_OUT_OF_CORE = {'max_memory': None}
+
+
+@contextlib.contextmanager
+def out_of_core_updates(max_memory):
+    """
+    Context in which updateData diffs table partitions out-of-core within
+    a memory budget, unless it is given its own budget
+
+    Args:
+        max_memory: Memory budget in bytes
+    """
+    previous = dict(_OUT_OF_CORE)
+    _OUT_OF_CORE.update(max_memory=max_memory)
+    try:
+        yield
+    finally:
+        _OUT_OF_CORE.update(previous)
+
+
+# Rough ratio between the size of a table as csv and the memory it takes
+# to diff it (pandas objects plus the copies made while diffing)
+DIFF_MEMORY_FACTOR = 10
+
+
+def _get_npartitions(data_bytes, max_memory):
+    '''
+    Get the number of partitions needed to diff within a memory budget
+
+    Args:
+        data_bytes: Size of the database and dataset in bytes
+        max_memory: Memory budget in bytes
+
+    Returns:
+        int: number of partitions
+    '''
+    return max(1, math.ceil(DIFF_MEMORY_FACTOR * data_bytes / max_memory))
+
+
+def _get_csv_chunksize(csv_path, max_memory):
+    '''
+    Estimate the number of rows of a csv that can be read at once within
+    a memory budget
+
+    Args:
+        csv_path: Path to csv
+        max_memory: Memory budget in bytes
+
+    Returns:
+        int: number of rows
+    '''
+    with open(csv_path, 'rb') as csv_file:
+        sample = csv_file.read(1024 * 1024)
+    bytes_per_row = len(sample) / max(sample.count(b'\n'), 1)
+    return max(1, int(max_memory / DIFF_MEMORY_FACTOR / max(bytes_per_row, 1)))
+
+
+def _get_partition_ids(df, primary_key_cols, npartitions):
+    '''
+    Assign each row to a partition by the hash of its primary key
+
+    Args:
+        df: Dataframe
+        primary_key_cols: Column(s) that make up the unique key
+        npartitions: Number of partitions
+
+    Returns:
+        numpy array: partition of each row
+    '''
+    if isinstance(primary_key_cols, str):
+        primary_key_cols = [primary_key_cols]
+    # Blank keys are read from the table as '', not as NaN
+    keydf = df[primary_key_cols].fillna("").astype(str)
+    primary_key = _create_primary_key(keydf, primary_key_cols, hash_key=True)
+    return (primary_key % npartitions).values
+
+
+def _spill_table_query(query_result, primary_key_cols, npartitions,
+                       workdir, max_memory):
+    '''
+    Split a downloaded table query csv into csv partitions by the hash of
+    the primary key. The csv is read in chunks as text so values are
+    written out unchanged.
+
+    Args:
+        query_result: Synapse table query result downloaded as csv
+        primary_key_cols: Column(s) that make up the unique key
+        npartitions: Number of partitions
+        workdir: Directory to write partitions to
+        max_memory: Memory budget in bytes
+
+    Returns:
+        list: Paths to the csv partitions
+    '''
+    csv_args = dict(sep=query_result.separator,
+                    quotechar=query_result.quoteCharacter,
+                    escapechar=query_result.escapeCharacter)
+    columns = pd.read_csv(query_result.filepath, nrows=0, **csv_args).columns
+    partition_paths = []
+    for partition in range(npartitions):
+        partition_path = os.path.join(workdir,
+                                      "database_{}.csv".format(partition))
+        pd.DataFrame(columns=columns).to_csv(partition_path, index=False)
+        partition_paths.append(partition_path)
+
+    chunks = pd.read_csv(
+        query_result.filepath, dtype=str, keep_default_na=False,
+        chunksize=_get_csv_chunksize(query_result.filepath, max_memory),
+        **csv_args)
+    for chunk in chunks:
+        partition_ids = _get_partition_ids(chunk, primary_key_cols,
+                                           npartitions)
+        for partition, partitiondf in chunk.groupby(partition_ids):
+            partitiondf.to_csv(partition_paths[partition], mode='a',
+                               header=False, index=False)
+    return partition_paths
+
+
+def _spill_dataset(new_dataset, primary_key_cols, npartitions, workdir):
+    '''
+    Split a dataset into partitions by the hash of the primary key.
+    Partitions are pickled to keep the dataset's dtypes.
+
+    Args:
+        new_dataset: New dataset (pandas dataframe)
+        primary_key_cols: Column(s) that make up the unique key
+        npartitions: Number of partitions
+        workdir: Directory to write partitions to
+
+    Returns:
+        list: Paths to the pickled partitions
+    '''
+    partition_ids = _get_partition_ids(new_dataset, primary_key_cols,
+                                       npartitions)
+    partition_paths = []
+    for partition in range(npartitions):
+        partition_path = os.path.join(workdir,
+                                      "dataset_{}.pkl".format(partition))
+        new_dataset[partition_ids == partition].to_pickle(partition_path)
+        partition_paths.append(partition_path)
+    return partition_paths
+
+
+def _read_table_partition(partition_path, query_result):
+    '''
+    Read a csv partition the same way a table query is read as a
+    dataframe: STRING columns are kept as strings and the index is
+    {ROW_ID}_{ROW_VERSION}
+
+    Args:
+        partition_path: Path to csv partition
+        query_result: Synapse table query result downloaded as csv
+
+    Returns:
+        Dataframe: partition of the table
+    '''
+    dtype = {'ROW_ID': str, 'ROW_VERSION': str}
+    for column in query_result.headers:
+        if column.columnType == "STRING":
+            dtype[column.name] = str
+    partitiondf = pd.read_csv(partition_path, dtype=dtype)
+    partitiondf.index = partitiondf['ROW_ID'] + "_" + \
+        partitiondf['ROW_VERSION']
+    row_cols = ['ROW_ID', 'ROW_VERSION', 'ROW_ETAG']
+    return partitiondf.drop(
+        columns=[col for col in row_cols if col in partitiondf.columns])
+
+
+def update_data_out_of_core(syn, databaseSynId, newData, filterBy,
+                            filterByColumn="CENTER", col=None,
+                            toDelete=False, max_memory=2 * 1024**3,
+                            partial_update=False):
+    '''
+    Updates the rows of a synapse table partition without holding the
+    table in memory.  The table and the new dataset are spilled to disk
+    partitioned by the hash of the primary key, each partition is diffed
+    on its own and the changes are streamed to one update csv.  Tables
+    are never rebuilt out-of-core, they are updated in place.
+
+    Args:
+        syn: Synapse object
+        databaseSynId: Synapse Id of the database table
+        newData: New dataset (pandas dataframe)
+        filterBy: Value of the partition to update
+        filterByColumn: Column to partition the table by. Defaults to CENTER
+        col: Columns to update. Defaults to all columns of the table
+        toDelete: Delete rows, Defaults to False
+        max_memory: Memory budget in bytes. Defaults to 2GB
+        partial_update: Only send the changed cells of updated rows.
+                        Defaults to False
+    '''
+    if _REBUILD['database_mapping_synid'] is not None:
+        logger.info("{} IS UPDATED IN PLACE, TABLES AREN'T REBUILT "
+                    "OUT-OF-CORE".format(databaseSynId))
+    databaseEnt = syn.get(databaseSynId)
+    primary_key_cols = databaseEnt.primaryKey
+    with tempfile.TemporaryDirectory(dir=SCRIPT_DIR) as workdir:
+        query_result = syn.tableQuery(
+            "SELECT * FROM {} where {} ='{}'".format(
+                databaseSynId, filterByColumn, filterBy),
+            resultsAs="csv", downloadLocation=workdir)
+        data_bytes = os.path.getsize(query_result.filepath) + \
+            newData.memory_usage(deep=True).sum()
+        npartitions = _get_npartitions(data_bytes, max_memory)
+        logger.info("DIFFING {} IN {} PARTITIONS".format(databaseSynId,
+                                                         npartitions))
+        database_paths = _spill_table_query(
+            query_result, primary_key_cols, npartitions, workdir, max_memory)
+
+        table_cols = pd.read_csv(database_paths[0], nrows=0).columns
+        _check_row_hash_columns(col, table_cols)
+        if col is None:
+            col = [column for column in table_cols
+                   if column not in ['ROW_ID', 'ROW_VERSION', 'ROW_ETAG']]
+        col = list(col)
+        if ROW_HASH_COL in col:
+            # The row hash is recomputed from the new rows
+            newData = _add_row_hash(newData[
+                [column for column in col if column != ROW_HASH_COL]
+            ].fillna(""))
+        dataset_paths = _spill_dataset(newData[col], primary_key_cols,
+                                       npartitions, workdir)
+
+        update_path = os.path.join(workdir, "update.csv")
+        integer_cols = get_integer_columns(query_result.headers)
+        table_columns = None
+        if partial_update:
+            table_columns = list(syn.getTableColumns(databaseSynId))
+        storedatabase = False
+        partial_bytes = 0
+        with open(update_path, "w") as updatefile:
+            updatefile.write(",".join(['ROW_ID', 'ROW_VERSION'] + col) + "\n")
+            for database_path, dataset_path in zip(database_paths,
+                                                   dataset_paths):
+                database = _read_table_partition(database_path, query_result)
+                changes = _get_database_changes(
+                    database[col], pd.read_pickle(dataset_path),
+                    primary_key_cols, to_delete=toDelete)
+                if partial_update:
+                    changes = _split_partial_updates(changes)
+                    if is_dry_run():
+                        logger.info("DRY RUN {}: {} partial updates".format(
+                            databaseSynId, len(changes['partial'])))
+                        rowset = _get_partial_rowset(
+                            databaseSynId, changes, table_columns)
+                        if rowset is not None:
+                            partial_bytes += len(
+                                json.dumps(rowset).encode("utf-8"))
+                    else:
+                        _store_partial_updates(syn, databaseSynId, changes,
+                                               table_columns)
+                if _write_database_changes(updatefile, changes,
+                                           integer_cols=integer_cols):
+                    storedatabase = True
+        if is_dry_run():
+            if storedatabase or partial_bytes:
+                update_bytes = os.path.getsize(update_path) \
+                    if storedatabase else 0
+                logger.info("DRY RUN {}: ~{} bytes of changes".format(
+                    databaseSynId, update_bytes + partial_bytes))
+        elif storedatabase:
+            store_table_update(syn, databaseSynId, update_path,
+                               primary_key_cols=primary_key_cols)
 
 
 def checkInt(element):
@@ -0,0 +1,198 @@
+"""Ledger of the files that were processed into the database.
+
+A file is recorded after it is processed successfully.  When a valid file,
+its file type, its database table and its format class are the same as the
+ledger's record, processing it again would not change the database, so it
+is skipped.
+"""
+from collections import namedtuple
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from . import process_functions, validation_cache
+
+logger = logging.getLogger(__name__)
+
+PROCESSED_LEDGER_PATH = os.path.expanduser(
+    os.path.join("~", ".synapsegenie", "processed_ledger.sqlite")
+)
+# Name of the optional ledger table in the database to synapse id mapping
+PROCESSED_LEDGER_TABLE = "processedLedger"
+
+LEDGER_COLUMNS = ["id", "md5", "fileType", "databaseSynId",
+                  "processorVersion"]
+
+LedgerEntry = namedtuple("LedgerEntry", LEDGER_COLUMNS)
+
+
+class ProcessedLedger(object):
+    """Processed files stored in a local sqlite database and optionally in
+    a Synapse table shared by every machine that processes files
+
+    Args:
+        path: Path to the sqlite database.  Defaults to PROCESSED_LEDGER_PATH
+        syn: Synapse object.  Only needed with table_synid
+        table_synid: Synapse id of the ledger table.  Defaults to None
+        force: Process every file again, still recording them.
+               Defaults to False
+    """
+    def __init__(self, path=PROCESSED_LEDGER_PATH, syn=None,
+                 table_synid=None, force=False):
+        self.path = path
+        self.force = force
+        self._syn = syn
+        self._table_synid = table_synid
+        self._recorded = []
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed ("
+                "id TEXT PRIMARY KEY, md5 TEXT, fileType TEXT, "
+                "databaseSynId TEXT, processorVersion TEXT, "
+                "processedOn REAL)"
+            )
+        # Files processed on other machines
+        self._table_entries = {}
+        if table_synid is not None:
+            tabledf = syn.tableQuery(
+                f"SELECT {', '.join(LEDGER_COLUMNS)} FROM {table_synid}"
+            ).asDataFrame()
+            self._table_entries = {
+                row.id: LedgerEntry(*row)
+                for row in tabledf[LEDGER_COLUMNS].itertuples(index=False)
+            }
+
+    def _connect(self):
+        """A connection is opened per call, so the ledger can be shared by
+        threads and processes"""
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60))
+
+    @staticmethod
+    def get_entry(synid, md5, file_type, database_synid, format_cls):
+        """Ledger entry of a file
+
+        Args:
+            synid: Synapse id of the file
+            md5: md5 of the file
+            file_type: File type
+            database_synid: Synapse id of the database table
+            format_cls: File format class that processes the file
+
+        Returns:
+            LedgerEntry.  None if the file can't be recorded because the
+            source of the format class can't be found
+        """
+        processor_version = validation_cache.format_class_hash(format_cls)
+        if md5 is None or processor_version is None:
+            return None
+        return LedgerEntry(id=synid, md5=md5, fileType=file_type,
+                           databaseSynId=database_synid,
+                           processorVersion=processor_version)
+
+    def is_processed(self, entry):
+        """Whether a file was processed before and hasn't changed since
+
+        Args:
+            entry: LedgerEntry of the file
+
+        Returns:
+            bool
+        """
+        if self.force:
+            return False
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, md5, fileType, databaseSynId, processorVersion "
+                "FROM processed WHERE id = ?", (entry.id,)
+            ).fetchone()
+        if row is not None and LedgerEntry(*row) == entry:
+            return True
+        return self._table_entries.get(entry.id) == entry
+
+    def record(self, entry):
+        """Record a processed file.  Nothing is recorded in a dry run, the
+        database wasn't updated.
+
+        Args:
+            entry: LedgerEntry of the file
+        """
+        if process_functions.is_dry_run():
+            return
+        with self._connect() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?)",
+                entry + (time.time(),)
+            )
+        self._recorded.append(entry)
+
+    def flush(self):
+        """Store the files recorded since the last flush in the ledger
+        table"""
+        if self._table_synid is None or not self._recorded:
+            return
+        table_synid = process_functions.get_current_table_id(
+            self._table_synid
+        )
+        table = self._syn.tableQuery(f"SELECT * FROM {table_synid}")
+        recordeddf = pd.DataFrame(self._recorded, columns=LEDGER_COLUMNS)
+        recordeddf.drop_duplicates("id", keep="last", inplace=True)
+        # Rows aren't deleted, the files recorded by other runs are kept
+        process_functions.updateDatabase(
+            self._syn, table.asDataFrame()[LEDGER_COLUMNS], recordeddf,
+            table_synid, ["id"]
+        )
+        self._table_entries.update(
+            (entry.id, entry) for entry in self._recorded
+        )
+        self._recorded = []
+
+
+def get_ledger_table_synid(database_synid_mappingdf):
+    """Synapse id of the ledger table, None if the project doesn't have one
+
+    Args:
+        database_synid_mappingdf: Database to synapse id mapping dataframe
+
+    Returns:
+        str: Synapse id of the ledger table
+    """
+    is_ledger = database_synid_mappingdf['Database'] == PROCESSED_LEDGER_TABLE
+    if not is_ledger.any():
+        return None
+    return database_synid_mappingdf['Id'][is_ledger].iloc[0]
+
+
+_PROCESSED_LEDGER = None
+
+
+@contextlib.contextmanager
+def use_processed_ledger(ledger):
+    """
+    Context in which valid files that match the ledger are not processed
+    again and processed files are recorded.  The recorded files are stored
+    in the ledger table when the context exits.
+
+    Args:
+        ledger: ProcessedLedger.  None to process every file
+    """
+    global _PROCESSED_LEDGER
+    previous = _PROCESSED_LEDGER
+    _PROCESSED_LEDGER = ledger
+    try:
+        yield
+    finally:
+        _PROCESSED_LEDGER = previous
+        if ledger is not None:
+            ledger.flush()
+
+
+def get_processed_ledger():
+    """The ProcessedLedger in use, None if every file is processed"""
+    return _PROCESSED_LEDGER
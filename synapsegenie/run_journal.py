@@ -0,0 +1,168 @@
+"""Journal of the completed stages of a process run.
+
+Each center and file records the stages it completed (fetched, validated,
+validation emails sent, status tables committed, processed) so that a run that died can be resumed
+from its last completed stage.  The journal of each center is an append
+only file of JSON lines.  A record is written with a single write that is
+synced to disk, and a partly written last line is ignored when the journal
+is read, so a crash never leaves a corrupt journal.
+"""
+from collections import defaultdict
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RUN_JOURNAL_DIR = os.path.expanduser(
+    os.path.join("~", ".synapsegenie", "runs")
+)
+
+FETCHED = "fetched"
+VALIDATED = "validated"
+# Recorded per user that was sent the validation errors of a center
+EMAILED = "emailed"
+STATUS_COMMITTED = "status_committed"
+PROCESSED = "processed"
+CENTER_DONE = "center_done"
+
+
+def new_run_id():
+    """Run id made of the start time and a random suffix"""
+    start = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"{start}-{uuid.uuid4().hex[:6]}"
+
+
+class RunJournal(object):
+    """Completed stages of a run, read from and appended to the run's
+    journal directory
+
+    Args:
+        run_id: Run id.  Defaults to a new run id
+        directory: Directory of the run journals.  Defaults to RUN_JOURNAL_DIR
+    """
+    def __init__(self, run_id=None, directory=RUN_JOURNAL_DIR):
+        self.run_id = new_run_id() if run_id is None else run_id
+        self.path = os.path.join(directory, self.run_id)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._fds = {}
+        # (center, stage) -> {synid: record}
+        self._records = defaultdict(dict)
+        for filename in sorted(os.listdir(self.path)):
+            if filename.endswith(".jsonl"):
+                self._load(os.path.join(self.path, filename))
+
+    @classmethod
+    def resume(cls, run_id, directory=RUN_JOURNAL_DIR):
+        """Journal of an earlier run
+
+        Args:
+            run_id: Run id of the earlier run
+            directory: Directory of the run journals.
+                       Defaults to RUN_JOURNAL_DIR
+
+        Raises:
+            ValueError: The run has no journal
+        """
+        if not os.path.isdir(os.path.join(directory, run_id)):
+            raise ValueError(f"There is no journal of run {run_id}")
+        return cls(run_id, directory=directory)
+
+    def _load(self, journal_path):
+        with open(journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record of a run that died can be partly
+                    # written
+                    logger.warning(f"IGNORING PARTLY WRITTEN RECORD IN "
+                                   f"{journal_path}")
+                    continue
+                self._records[record['center'], record['stage']][
+                    record.get('id')] = record
+
+    def _get_fd(self, center):
+        """Journal file of a center, which only this process writes to"""
+        if center not in self._fds:
+            journal_path = os.path.join(self.path, f"{center}.jsonl")
+            fd = os.open(journal_path,
+                         os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            # Don't append to a partly written last record
+            if os.fstat(fd).st_size and \
+                    os.pread(fd, 1, os.fstat(fd).st_size - 1) != b"\n":
+                os.write(fd, b"\n")
+            self._fds[center] = fd
+        return self._fds[center]
+
+    def record(self, center, stage, synid=None, **fields):
+        """Record a completed stage
+
+        Args:
+            center: Center name
+            stage: Completed stage
+            synid: Synapse id of a file, None for stages of a whole center
+            **fields: JSON serializable values to keep with the record
+        """
+        record = dict(center=center, stage=stage, id=synid, **fields)
+        with self._lock:
+            if self._records[center, stage].get(synid) == record:
+                return
+            line = json.dumps(record) + "\n"
+            fd = self._get_fd(center)
+            os.write(fd, line.encode("utf-8"))
+            os.fsync(fd)
+            self._records[center, stage][synid] = record
+
+    def get(self, center, stage, synid=None):
+        """Get the record of a completed stage
+
+        Args:
+            center: Center name
+            stage: Stage
+            synid: Synapse id of a file, None for stages of a whole center
+
+        Returns:
+            dict: Record.  None if the stage wasn't completed
+        """
+        return self._records[center, stage].get(synid)
+
+    def close(self):
+        """Close the journal files"""
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+
+_RUN_JOURNAL = None
+
+
+@contextlib.contextmanager
+def use_run_journal(journal):
+    """
+    Context in which completed stages are recorded in a run journal and
+    stages the journal has recorded are skipped
+
+    Args:
+        journal: RunJournal.  None to not journal the run
+    """
+    global _RUN_JOURNAL
+    previous = _RUN_JOURNAL
+    _RUN_JOURNAL = journal
+    try:
+        yield
+    finally:
+        _RUN_JOURNAL = previous
+        if journal is not None:
+            journal.close()
+
+
+def get_run_journal():
+    """The RunJournal in use, None if the run isn't journaled"""
+    return _RUN_JOURNAL
@@ -3,11 +3,13 @@ import importlib
 import inspect
 import logging
 import sys
+import threading
 
 import synapseclient
 from synapseclient.core.exceptions import SynapseHTTPError
 
-from . import config, example_filetype_format, process_functions
+from . import (config, example_filetype_format, process_functions,
+               validation_cache)
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -22,7 +24,7 @@ class ValidationHelper(object):
 
     def __init__(self, syn, project_id, center, entitylist,
                  format_registry=None,
-                 file_type=None):
+                 file_type=None, session=None):
         """A validator helper class for a center's files.
 
         Args:
@@ -33,15 +35,26 @@ class ValidationHelper(object):
             format_registry: A dictionary mapping file format name to the
                              format class.
             file_type: Specify file type to skip filename validation
+            session: ValidationSession shared with the other files of the
+                     run.  Defaults to a session of these files only
         """
+        if session is None:
+            session = ValidationSession(syn, project_id, format_registry,
+                                        helper_cls=type(self))
+        self._session = session
         self._synapse_client = syn
-        self._project = syn.get(project_id)
         self.entitylist = entitylist
         self.center = center
-        self._format_registry = format_registry
+        self._format_registry = (session.format_registry
+                                 if format_registry is None
+                                 else format_registry)
         self.file_type = (self.determine_filetype()
                           if file_type is None else file_type)
 
+    @property
+    def _project(self):
+        return self._session.project
+
     def determine_filetype(self):
         """Gets the file type of the file by validating its filename
 
@@ -54,11 +67,19 @@ class ValidationHelper(object):
 
         """
         filetype = None
+        filenames = [entity.name for entity in self.entitylist]
+        legacy_formats = self._format_registry
+        if isinstance(self._format_registry, config.FormatRegistry):
+            filetype = self._format_registry.match_filetype(filenames,
+                                                            self.center)
+            if filetype is not None:
+                return filetype
+            # Only formats without filename patterns can still match
+            legacy_formats = self._format_registry.legacy_filetypes()
         # Loop through file formats
-        for file_format in self._format_registry:
+        for file_format in legacy_formats:
             validator = self._format_registry[file_format](self._synapse_client, self.center)
             try:
-                filenames = [entity.name for entity in self.entitylist]
                 filetype = validator.validateFilename(filenames)
             except AssertionError:
                 continue
@@ -67,6 +88,50 @@ class ValidationHelper(object):
                 break
         return filetype
 
+    def _get_validate_kwargs(self, kwargs):
+        """Keyword arguments of the format class validation"""
+        mykwargs = {}
+        for required_parameter in self._validate_kwargs:
+            assert required_parameter in kwargs.keys(), \
+                "%s not in parameter list" % required_parameter
+            mykwargs[required_parameter] = kwargs[required_parameter]
+            mykwargs['project_id'] = self._project.id
+        return mykwargs
+
+    def _get_cache_key(self, mykwargs):
+        """Validation cache key of the files.  None if results aren't
+        cached"""
+        cache = validation_cache.get_validation_cache()
+        if cache is None:
+            return None
+        md5s = [validation_cache.get_file_md5(entity)
+                for entity in self.entitylist]
+        return cache.get_key(md5s, self.file_type, self.center,
+                             self._format_registry[self.file_type], mykwargs)
+
+    def get_cached_result(self, **kwargs):
+        """Get the cached validation result of a submitted file unit from
+        the md5 of its entities, without reading the files.
+
+        Returns:
+            tuple: valid, message.  None if the result isn't cached or an
+                   entity has no md5
+        """
+        if validation_cache.get_validation_cache() is None or \
+                self.file_type not in self._format_registry or \
+                any(getattr(entity, "md5", None) is None
+                    for entity in self.entitylist):
+            return None
+        cache_key = self._get_cache_key(self._get_validate_kwargs(kwargs))
+        if cache_key is None:
+            return None
+        cached = validation_cache.get_validation_cache().get(cache_key)
+        if cached is None:
+            return None
+        logger.info("USING CACHED VALIDATION RESULT")
+        valid, errors, warnings = cached
+        return valid, collect_errors_and_warnings(errors, warnings)
+
     def validate_single_file(self, **kwargs):
         """Validate a submitted file unit.
 
@@ -80,18 +145,23 @@ class ValidationHelper(object):
             errors = "Your filename is incorrect! Please change your filename before you run the validator or specify --filetype if you are running the validator locally"
             warnings = ""
         else:
-            mykwargs = {}
-            for required_parameter in self._validate_kwargs:
-                assert required_parameter in kwargs.keys(), \
-                    "%s not in parameter list" % required_parameter
-                mykwargs[required_parameter] = kwargs[required_parameter]
-                mykwargs['project_id'] = self._project.id
+            mykwargs = self._get_validate_kwargs(kwargs)
 
             validator_cls = self._format_registry[self.file_type]
-            validator = validator_cls(self._synapse_client, self.center)
-            filepathlist = [entity.path for entity in self.entitylist]
-            valid, errors, warnings = validator.validate(filePathList=filepathlist,
-                                                         **mykwargs)
+            cache = validation_cache.get_validation_cache()
+            cache_key = self._get_cache_key(mykwargs)
+            cached = cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                logger.info("USING CACHED VALIDATION RESULT")
+                valid, errors, warnings = cached
+            else:
+                validator = self._session.get_validator(validator_cls,
+                                                        self.center)
+                filepathlist = [entity.path for entity in self.entitylist]
+                valid, errors, warnings = validator.validate(filePathList=filepathlist,
+                                                             **mykwargs)
+                if cache_key is not None:
+                    cache.set(cache_key, valid, errors, warnings)
 
         # Complete error message
         message = collect_errors_and_warnings(errors, warnings)
@@ -107,6 +177,90 @@ class GenieValidationHelper(ValidationHelper):
     _validate_kwargs = ['oncotree_link', 'nosymbol_check']
 
 
+class ValidationSession(object):
+    """
+    State shared by the validation of every file of a run: the project
+    entity, the format registry, one validator per file format and center,
+    and reference data that is loaded the first time a validator needs it.
+
+    Args:
+        syn: a synapseclient.Synapse object
+        project_id: Synapse Project ID where files are stored and configured.
+        format_registry: A dictionary mapping file format name to the
+                         format class.
+        helper_cls: ValidationHelper class of the files.
+                    Defaults to GenieValidationHelper
+    """
+    def __init__(self, syn, project_id, format_registry=None,
+                 helper_cls=None):
+        self.syn = syn
+        self.project_id = project_id
+        self.format_registry = format_registry
+        self.helper_cls = (GenieValidationHelper if helper_cls is None
+                           else helper_cls)
+        # Loading reference data can need other reference data
+        self._lock = threading.RLock()
+        self._project = None
+        self._validators = {}
+        self._reference_data = {}
+
+    @property
+    def project(self):
+        """Project entity, fetched once per session"""
+        with self._lock:
+            if self._project is None:
+                self._project = self.syn.get(self.project_id)
+            return self._project
+
+    def get_validator(self, format_cls, center):
+        """Validator of a file format for a center, created once per session
+
+        Args:
+            format_cls: File format class
+            center: The participating center name.
+
+        Returns:
+            Instance of format_cls
+        """
+        with self._lock:
+            key = (format_cls, center)
+            if key not in self._validators:
+                validator = format_cls(self.syn, center)
+                validator.session = self
+                self._validators[key] = validator
+            return self._validators[key]
+
+    def get_reference_data(self, key, load):
+        """Reference data, loaded once per session
+
+        Args:
+            key: Name of the reference data
+            load: Function that loads the reference data
+
+        Returns:
+            The reference data
+        """
+        with self._lock:
+            if key not in self._reference_data:
+                self._reference_data[key] = load()
+            return self._reference_data[key]
+
+    def helper(self, center, entitylist, file_type=None):
+        """Validator helper of a center's files
+
+        Args:
+            center: The participating center name.
+            entitylist: List of entities of the files
+            file_type: Specify file type to skip filename validation
+
+        Returns:
+            ValidationHelper
+        """
+        return self.helper_cls(self.syn, self.project_id, center, entitylist,
+                               format_registry=self.format_registry,
+                               file_type=file_type, session=self)
+
+
 def collect_errors_and_warnings(errors, warnings):
     '''Aggregates error and warnings into a string.
 
@@ -251,15 +405,17 @@ def _perform_validate(syn, args):
     entity_list = [synapseclient.File(name=filepath, path=filepath,
                                       parentId=None)
                    for filepath in args.filepath]
-    validator = GenieValidationHelper(syn=syn, project_id=args.project_id,
-                                      center=args.center,
-                                      entitylist=entity_list,
-                                      format_registry=format_registry,
-                                      file_type=args.filetype)
+    session = ValidationSession(syn, args.project_id, format_registry)
+    validator = session.helper(args.center, entity_list,
+                               file_type=args.filetype)
     mykwargs = dict(oncotree_link=args.oncotree_link,
                     nosymbol_check=args.nosymbol_check,
                     project_id=args.project_id)
-    valid, message = validator.validate_single_file(**mykwargs)
+    cache = None
+    if args.validation_cache is not None:
+        cache = validation_cache.ValidationCache(args.validation_cache)
+    with validation_cache.use_validation_cache(cache):
+        valid, message = validator.validate_single_file(**mykwargs)
 
     # Upload to synapse if parentid is specified and valid
     _upload_to_synapse(syn, args.filepath, valid, parentid=args.parentid)
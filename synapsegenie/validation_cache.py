@@ -0,0 +1,216 @@
+"""Local cache of file validation results.
+
+Validation results are stored by the content of the validated files, so
+identical files are only validated once whichever Synapse entity or local
+path they come from.  The key also holds a hash of the source of the format
+class and of the modules it is defined in, so results are invalidated when
+a format class or a module of its classes changes.
+
+Reference data that validation reads, such as the oncotree, and helper
+modules that the format modules import aren't part of the key.  The cache
+is only used when a cache path is given, and has to be deleted when they
+change.
+"""
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_CACHE_PATH = os.path.expanduser(
+    os.path.join("~", ".synapsegenie", "validation_cache.sqlite")
+)
+# Least recently used results are evicted above this size
+VALIDATION_CACHE_MAX_BYTES = 200 * 1024 ** 2
+
+
+@functools.lru_cache(maxsize=None)
+def format_class_hash(format_cls):
+    """Hash of the source of a format class, the classes it inherits and
+    the modules they are defined in
+
+    Args:
+        format_cls: File format class
+
+    Returns:
+        str: sha256 hex digest.  None if the source can't be found
+    """
+    source_hash = hashlib.sha256()
+    modules = []
+    for cls in inspect.getmro(format_cls):
+        if cls is object:
+            continue
+        module = inspect.getmodule(cls)
+        if module is not None and module not in modules:
+            modules.append(module)
+        try:
+            source = inspect.getsource(cls)
+        except (OSError, TypeError):
+            return None
+        source_hash.update(source.encode("utf-8"))
+    for module in modules:
+        try:
+            source = inspect.getsource(module)
+        except (OSError, TypeError):
+            return None
+        source_hash.update(source.encode("utf-8"))
+    return source_hash.hexdigest()
+
+
+def get_file_md5(entity):
+    """md5 of the file of an entity, computed if the entity doesn't have one
+
+    Args:
+        entity: Synapse File entity
+
+    Returns:
+        str: md5 hex digest
+    """
+    md5 = getattr(entity, "md5", None)
+    if md5 is None:
+        md5_hash = hashlib.md5()
+        with open(entity.path, "rb") as file_handle:
+            for block in iter(lambda: file_handle.read(2 ** 20), b""):
+                md5_hash.update(block)
+        md5 = md5_hash.hexdigest()
+    return md5
+
+
+class ValidationCache(object):
+    """Validation results stored in a sqlite database
+
+    Args:
+        path: Path to the sqlite database.  Defaults to VALIDATION_CACHE_PATH
+        max_bytes: Size of the stored results above which the least recently
+                   used results are evicted.
+                   Defaults to VALIDATION_CACHE_MAX_BYTES
+    """
+    def __init__(self, path=VALIDATION_CACHE_PATH,
+                 max_bytes=VALIDATION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, valid INTEGER, errors TEXT, "
+                "warnings TEXT, size INTEGER, last_used REAL)"
+            )
+
+    def _connect(self):
+        """A connection is opened per call, so the cache can be shared by
+        threads and processes"""
+        return contextlib.closing(sqlite3.connect(self.path, timeout=60))
+
+    @staticmethod
+    def get_key(md5s, file_type, center, format_cls, validation_kwargs):
+        """Key of a validation result
+
+        Args:
+            md5s: md5 of each validated file
+            file_type: File type
+            center: Center name
+            format_cls: File format class that validates the files
+            validation_kwargs: Keyword arguments of the validation
+
+        Returns:
+            str: Key.  None if the result can't be cached because the source
+                 of the format class can't be found
+        """
+        class_hash = format_class_hash(format_cls)
+        if class_hash is None:
+            return None
+        key = json.dumps([md5s, file_type, center, class_hash,
+                          validation_kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Get a validation result
+
+        Args:
+            key: Key of the result
+
+        Returns:
+            tuple: valid, errors, warnings.  None if not cached
+        """
+        with self._connect() as conn, conn:
+            row = conn.execute(
+                "SELECT valid, errors, warnings FROM results WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?",
+                         (time.time(), key))
+        valid, errors, warnings = row
+        return bool(valid), errors, warnings
+
+    def set(self, key, valid, errors, warnings):
+        """Store a validation result and evict the least recently used
+        results if the cache is too large
+
+        Args:
+            key: Key of the result
+            valid: Boolean value of validation status
+            errors: Validation errors
+            warnings: Validation warnings
+        """
+        size = len(key) + len(errors.encode("utf-8")) + \
+            len(warnings.encode("utf-8"))
+        with self._connect() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, int(valid), errors, warnings, size, time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Delete the least recently used results above max_bytes"""
+        total, = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in conn.execute(
+                "SELECT key, size FROM results ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM results WHERE key = ?", evict)
+        logger.info("EVICTED {} CACHED VALIDATION RESULTS".format(len(evict)))
+
+
+_VALIDATION_CACHE = None
+
+
+@contextlib.contextmanager
+def use_validation_cache(cache):
+    """
+    Context in which file validation results are looked up in and stored
+    to a cache
+
+    Args:
+        cache: ValidationCache.  None to not cache results
+    """
+    global _VALIDATION_CACHE
+    previous = _VALIDATION_CACHE
+    _VALIDATION_CACHE = cache
+    try:
+        yield
+    finally:
+        _VALIDATION_CACHE = previous
+
+
+def get_validation_cache():
+    """The ValidationCache in use, None if results aren't cached"""
+    return _VALIDATION_CACHE
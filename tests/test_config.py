@@ -0,0 +1,122 @@
+"""Tests config.py"""
+import json
+import os
+import pickle
+import sys
+from unittest.mock import Mock, patch
+
+import pytest
+
+from synapsegenie import config
+
+FORMAT_MODULE = '''
+from synapsegenie.example_filetype_format import FileTypeFormat
+
+
+class Maf(FileTypeFormat):
+    _fileType = "maf"
+    _filename_patterns = ["data_mutations_extended_{center}.txt"]
+
+
+class Legacy(FileTypeFormat):
+    _fileType = "legacy"
+
+    def _validateFilename(self, filePath):
+        assert filePath[0] == "legacy.txt"
+'''
+
+
+@pytest.fixture
+def registry_package(tmpdir, monkeypatch):
+    """Registry package that isn't imported yet"""
+    package = tmpdir.mkdir("fake_registry")
+    package.join("__init__.py").write("from . import formats\n")
+    package.join("formats.py").write(FORMAT_MODULE)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield package
+    for module in ["fake_registry", "fake_registry.formats"]:
+        sys.modules.pop(module, None)
+
+
+def test_scan_collect_format_types(registry_package):
+    """Packages without a manifest or entry points are scanned"""
+    with patch.object(config, "_get_format_entry_points", return_value=[]):
+        registry = config.collect_format_types(["fake_registry"])
+    assert "fake_registry.formats" in sys.modules
+    assert sorted(registry) == ["legacy", "maf"]
+    assert registry['maf'].__name__ == "Maf"
+
+
+def test_manifest_collect_format_types(registry_package):
+    """Formats of a manifest are imported on demand"""
+    manifest_path = config.write_format_manifest("fake_registry")
+    with open(manifest_path) as manifest_file:
+        assert json.load(manifest_file) == {
+            'legacy': {'class': 'fake_registry.formats:Legacy',
+                       'filename_patterns': []},
+            'maf': {'class': 'fake_registry.formats:Maf',
+                    'filename_patterns': [
+                        "data_mutations_extended_{center}.txt"
+                    ]}
+        }
+    sys.modules.pop("fake_registry.formats")
+    sys.modules.pop("fake_registry")
+
+    registry = config.collect_format_types(["fake_registry"])
+    assert sorted(registry) == ["legacy", "maf"]
+    assert registry.match_filetype(["data_mutations_extended_SAGE.txt"],
+                                   "SAGE") == "maf"
+    assert registry.legacy_filetypes() == ["legacy"]
+    assert "fake_registry.formats" not in sys.modules
+    # References are sent to other processes without importing them
+    assert pickle.loads(pickle.dumps(registry))._references == \
+        registry._references
+    assert registry['maf'].__name__ == "Maf"
+    assert "fake_registry.formats" in sys.modules
+
+
+def test_unlisted_formats_collect_format_types(registry_package, caplog):
+    """Formats missing from a stale manifest are logged when their module
+    is imported"""
+    manifest_path = config.write_format_manifest("fake_registry")
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    del manifest['legacy']
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    sys.modules.pop("fake_registry.formats")
+    sys.modules.pop("fake_registry")
+
+    registry = config.collect_format_types(["fake_registry"])
+    assert registry['maf'].__name__ == "Maf"
+    assert "fake_registry.formats DEFINES FORMATS THAT AREN'T REGISTERED: " \
+        "legacy." in caplog.text
+
+
+def test_example_registry_manifest(tmpdir):
+    """The committed manifest of the example registry is up to date"""
+    manifest_path = config.write_format_manifest(
+        "example_registry", path=str(tmpdir.join("format_manifest.json"))
+    )
+    committed_path = os.path.join(os.path.dirname(__file__), os.pardir,
+                                  "example_registry", config.FORMAT_MANIFEST)
+    with open(manifest_path) as manifest_file,\
+         open(committed_path) as committed_file:
+        assert manifest_file.read() == committed_file.read()
+
+
+def test_entry_point_collect_format_types(registry_package):
+    """Formats of entry points are imported on demand"""
+    entry_point = Mock(value="fake_registry.formats:Maf")
+    entry_point.name = "maf"
+    other_entry_point = Mock(value="other_registry.formats:Vcf")
+    other_entry_point.name = "vcf"
+    with patch.object(config, "_get_format_entry_points",
+                      return_value=[entry_point, other_entry_point]):
+        registry = config.collect_format_types(["fake_registry"])
+    assert list(registry) == ["maf"]
+    assert "fake_registry.formats" not in sys.modules
+    # Entry points don't carry filename patterns, the classes are
+    # imported to know them
+    assert registry.legacy_filetypes() == ["maf"]
+    assert registry.get("maf").__name__ == "Maf"
@@ -0,0 +1,91 @@
+"""Tests example_filetype_format.py"""
+from unittest import mock
+from unittest.mock import patch
+
+import pytest
+import synapseclient
+
+from synapsegenie import example_filetype_format
+
+syn = mock.create_autospec(synapseclient.Synapse)
+
+FILE_CONTENT = "SAMPLE_ID\tAGE\nGENIE-1\t10\nGENIE-2\t\nGENIE-3\t30\n"
+
+
+class FileFormat(example_filetype_format.FileTypeFormat):
+    """Validates the whole file"""
+    _fileType = "clinical"
+
+    def _validate(self, df):
+        errors = ""
+        if df['AGE'].isnull().any():
+            errors += "clinical: AGE must not be empty\n"
+        return errors, "clinical: {} rows\n".format(len(df))
+
+
+class ChunkedFileFormat(example_filetype_format.FileTypeFormat):
+    """Validates the file in chunks"""
+    _fileType = "clinical"
+    _validation_chunksize = 2
+
+    def _validate_chunk(self, chunk, state):
+        state['chunks'] = state.get('chunks', 0) + 1
+        state['rows'] = state.get('rows', 0) + len(chunk)
+        state['empty_age'] = (state.get('empty_age', False) or
+                              chunk['AGE'].isnull().any())
+
+    def _validate_finalize(self, state):
+        errors = ""
+        if state['empty_age']:
+            errors += "clinical: AGE must not be empty\n"
+        return errors, "clinical: {} rows\n".format(state['rows'])
+
+
+@pytest.fixture
+def filepath(tmpdir):
+    path = tmpdir.join("data_clinical_supp_SAGE.txt")
+    path.write(FILE_CONTENT)
+    return str(path)
+
+
+def test_chunked_validate(filepath):
+    """Chunked validation gives the errors and warnings of validating the
+    whole file, without reading the whole file"""
+    validator = ChunkedFileFormat(syn, "SAGE")
+    with patch.object(ChunkedFileFormat, "_get_dataframe") as patch_read,\
+         patch.object(ChunkedFileFormat, "_validate_chunk",
+                      side_effect=ChunkedFileFormat._validate_chunk,
+                      autospec=True) as patch_chunk:
+        result = validator.validate([filepath])
+    patch_read.assert_not_called()
+    assert patch_chunk.call_count == 2
+    assert result == FileFormat(syn, "SAGE").validate([filepath])
+    assert result == (False, "clinical: AGE must not be empty\n",
+                      "clinical: 3 rows\n")
+
+
+def test_unreadable_chunked_validate(tmpdir):
+    """Files that can't be read are invalid"""
+    path = tmpdir.join("data_clinical_supp_SAGE.txt")
+    path.write("")
+    valid, errors, warnings = ChunkedFileFormat(syn, "SAGE").validate(
+        [str(path)]
+    )
+    assert not valid
+    assert errors.startswith(f"The file(s) (['{path}']) cannot be read.")
+    assert warnings == ""
+
+
+def test_chunk_read_error_validate(filepath):
+    """Chunks that can't be read make the file invalid"""
+    def chunks(filePathList, chunksize):
+        yield from []
+        raise ValueError("bad line")
+
+    validator = ChunkedFileFormat(syn, "SAGE")
+    with patch.object(validator, "_get_dataframe_chunks",
+                      side_effect=chunks):
+        valid, errors, _ = validator.validate([filepath])
+    assert not valid
+    assert errors == (f"The file(s) (['{filepath}']) cannot be read. "
+                      "Original error: bad line")
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 from unittest import mock
@@ -5,11 +6,15 @@ from unittest.mock import Mock, patch
 
 import pandas as pd
 import pytest
+import requests
 import synapseclient
 import synapseutils
 
-from synapsegenie import input_to_database, process_functions
+from synapsegenie import (input_to_database, process_functions,
+                          processed_ledger, run_journal)
 import synapsegenie.config
+import synapsegenie.example_filetype_format
+import synapsegenie.validation_cache
 from synapsegenie.validate import GenieValidationHelper
 
 
@@ -68,6 +73,8 @@ error_trackerdf = pd.DataFrame({
     'errors': ['Invalid file format'],
     'fileType': ['filetype1']})
 emptydf = pd.DataFrame(columns=['id'], dtype=str)
+status_store = input_to_database.FileStatusStore(validation_statusdf,
+                                                 error_trackerdf)
 
 class mock_csv_query_result(object):
     def __init__(self, df):
@@ -119,13 +126,23 @@ def walk_return_empty():
     yield ([], [], [])
 
 
+ENTITIES = {ent.id: ent for ent in [sample_clinical_entity,
+                                    patient_clinical_entity,
+                                    vcf1_entity, vcf2_entity]}
+
+
+def syn_get_entity(synid, downloadFile=True):
+    """syn.get by synid, entities are fetched concurrently"""
+    return ENTITIES[synid]
+
+
 def test_main_get_center_input_files():
     '''
     Test to make sure center input files are gotten
     excluding the vcf files since process main is specified
     '''
-    syn_get_effects = [sample_clinical_entity, patient_clinical_entity]
-    expected_center_file_list = [syn_get_effects]
+    expected_center_file_list = [[sample_clinical_entity,
+                                  patient_clinical_entity]]
 
     calls = [mock.call(sample_clinical_synid, downloadFile=True),
              mock.call(patient_clinical_synid, downloadFile=True)]
@@ -133,7 +150,7 @@ def test_main_get_center_input_files():
     with patch.object(synapseutils, "walk",
                       return_value=walk_return()) as patch_synapseutils_walk,\
          patch.object(syn, "get",
-                      side_effect=syn_get_effects) as patch_syn_get:
+                      side_effect=syn_get_entity) as patch_syn_get:
         center_file_list = input_to_database.get_center_input_files(syn,
                                                                     "syn12345",
                                                                     center)
@@ -142,7 +159,7 @@ def test_main_get_center_input_files():
         assert len(center_file_list[0]) == 2
         assert center_file_list == expected_center_file_list
         patch_synapseutils_walk.assert_called_once_with(syn, 'syn12345')
-        patch_syn_get.assert_has_calls(calls)
+        patch_syn_get.assert_has_calls(calls, any_order=True)
 
 
 def test_mutation_get_center_input_files():
@@ -150,8 +167,6 @@ def test_mutation_get_center_input_files():
     Test to make sure center input files are gotten
     including the vcf files since process vcf is specified
     """
-    syn_get_effects = [sample_clinical_entity, patient_clinical_entity,
-                       vcf1_entity, vcf2_entity]
     expected_center_file_list = [
         [vcf1_entity], [vcf2_entity],
         [sample_clinical_entity, patient_clinical_entity]]
@@ -164,7 +179,7 @@ def test_mutation_get_center_input_files():
     with patch.object(synapseutils, "walk",
                       return_value=walk_return()) as patch_synapseutils_walk,\
          patch.object(syn, "get",
-                      side_effect=syn_get_effects) as patch_syn_get:
+                      side_effect=syn_get_entity) as patch_syn_get:
         center_file_list = input_to_database.get_center_input_files(
             syn, "syn12345", center, process="mutation"
         )
@@ -172,7 +187,99 @@ def test_mutation_get_center_input_files():
         assert len(center_file_list[2]) == 2
         assert center_file_list == expected_center_file_list
         patch_synapseutils_walk.assert_called_once_with(syn, 'syn12345')
-        patch_syn_get.assert_has_calls(calls)
+        patch_syn_get.assert_has_calls(calls, any_order=True)
+
+
+def test_retry_get_center_input_files():
+    """Failed requests are retried and fetch stats are collected"""
+    response = Mock(status_code=503)
+    failures = [requests.exceptions.HTTPError(response=response)]
+
+    def flaky_get(synid, downloadFile=True):
+        if synid == sample_clinical_synid and failures:
+            raise failures.pop()
+        return ENTITIES[synid]
+
+    fetch_stats = []
+    with patch.object(synapseutils, "walk", return_value=walk_return()),\
+         patch.object(syn, "get", side_effect=flaky_get),\
+         patch.object(input_to_database.time, "sleep"):
+        center_file_list = input_to_database.get_center_input_files(
+            syn, "syn12345", center, threads=2, fetch_stats=fetch_stats)
+    assert center_file_list == [[sample_clinical_entity,
+                                 patient_clinical_entity]]
+    assert [(stats['synid'], stats['attempts'])
+            for stats in fetch_stats] == [(sample_clinical_synid, 2),
+                                          (patient_clinical_synid, 1)]
+
+
+def test__download_entities():
+    """Only entities without a downloaded file are downloaded"""
+    metadata_ent = synapseclient.File(id=vcf1synid, parentId='syn45678',
+                                      name='GENIE-SAGE-1-1.vcf',
+                                      versionNumber=2)
+    with patch.object(syn, "get", return_value=vcf1_entity) as patch_get:
+        entities = input_to_database._download_entities(
+            syn, [sample_clinical_entity, metadata_ent])
+        patch_get.assert_called_once_with(vcf1synid, downloadFile=True,
+                                          version=2)
+    assert entities == [sample_clinical_entity, vcf1_entity]
+
+
+def test__download_valid_files():
+    """Valid files without a path are downloaded"""
+    validfiles = pd.DataFrame({
+        'id': [sample_clinical_synid, vcf1synid],
+        'path': ['data_clinical_supp_sample_SAGE.txt', None]})
+    with patch.object(syn, "get", return_value=vcf1_entity) as patch_get:
+        validfiles = input_to_database._download_valid_files(syn, validfiles)
+        patch_get.assert_called_once_with(vcf1synid, downloadFile=True)
+    assert validfiles['path'].tolist() == [
+        'data_clinical_supp_sample_SAGE.txt', 'GENIE-SAGE-1-1.vcf']
+
+
+def test_localinventory_get_center_input_files():
+    """Files can be listed from an in-memory inventory"""
+    inventory = input_to_database.LocalInventory({
+        "syn12345": [vcf1_entity, sample_clinical_entity,
+                     patient_clinical_entity]})
+    center_file_list = input_to_database.get_center_input_files(
+        syn, "syn12345", center, inventory=inventory)
+    assert center_file_list == [[sample_clinical_entity,
+                                 patient_clinical_entity]]
+
+
+def test_fileviewinventory_get_center_input_files():
+    """Files of a folder and its subfolders are listed from a file view"""
+    viewdf = pd.DataFrame({
+        'id': ['syn1', 'syn2', 'syn3', 'syn4', 'syn5'],
+        'name': ['sub', 'data_CNA_SAGE.txt', 'data_CNA_TEST.txt',
+                 'data_clinical_supp_SAGE.txt', 'data_fusions_SAGE.txt'],
+        'type': ['folder', 'file', 'file', 'file', 'file'],
+        'parentId': ['syn12345', 'syn1', 'syn999', 'syn12345', 'syn12345'],
+        'currentVersion': [1, 2, 1, 1, 3],
+        'dataFileMD5Hex': [None, 'md5a', 'md5b', 'md5c', 'md5d'],
+        'modifiedOn': [1553428800000] * 5,
+        'modifiedBy': [333] * 5,
+        'createdBy': [444] * 5})
+    with patch.object(syn, "tableQuery",
+                      return_value=mock_csv_query_result(viewdf)) as patch_query,\
+         patch.object(syn, "get") as patch_get:
+        inventory = input_to_database.FileViewInventory(syn, "syn555")
+        center_file_list = input_to_database.get_center_input_files(
+            syn, "syn12345", center, downloadFile=False, inventory=inventory)
+        input_to_database.get_center_input_files(
+            syn, "syn999", "TEST", downloadFile=False, inventory=inventory)
+        patch_query.assert_called_once()
+        patch_get.assert_not_called()
+    assert [[ent.id for ent in ents] for ents in center_file_list] == [
+        ['syn4'], ['syn5'], ['syn2']]
+    ent = center_file_list[2][0]
+    assert ent.md5 == 'md5a'
+    assert ent.versionNumber == 2
+    assert ent.modifiedBy == '333'
+    assert input_to_database.entity_date_to_timestamp(
+        ent.properties.modifiedOn) == 1553428800000
 
 
 def test_empty_get_center_input_files():
@@ -216,7 +323,7 @@ def test_unvalidatedinput_check_existing_file_status():
     entities = [entity]
 
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(emptydf), mock_csv_query_result(emptydf), entities)
+        input_to_database.FileStatusStore(emptydf, emptydf), entities)
     assert file_status['to_validate']
     assert file_status['status_list'] == []
     assert file_status['error_list'] == []
@@ -229,7 +336,7 @@ def test_valid_check_existing_file_status():
     entity = synapseclient.Entity(name='first.txt', id='syn1234', md5='3333')
     entities = [entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(error_trackerdf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, error_trackerdf), entities)
     assert not file_status['to_validate']
     assert file_status['status_list'] == ['VALID']
     assert file_status['error_list'] == []
@@ -242,7 +349,7 @@ def test_invalid_check_existing_file_status():
     entity = synapseclient.Entity(name='second.txt', id='syn2345', md5='44444')
     entities = [entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(error_trackerdf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, error_trackerdf), entities)
     assert not file_status['to_validate']
     assert file_status['status_list'] == ['INVALID']
     assert file_status['error_list'] == ['Invalid file format']
@@ -255,7 +362,7 @@ def test_nostorederrors_check_existing_file_status():
     entity = synapseclient.Entity(name='second.txt', id='syn2345', md5='44444')
     entities = [entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(emptydf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, emptydf), entities)
     assert file_status['to_validate']
     assert file_status['status_list'] == ['INVALID']
     assert file_status['error_list'] == []
@@ -268,7 +375,7 @@ def test_diffmd5validate_check_existing_file_status():
     entity = synapseclient.Entity(name='first.txt', id='syn1234', md5='44444')
     entities = [entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(emptydf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, emptydf), entities)
     assert file_status['to_validate']
     assert file_status['status_list'] == ['VALID']
     assert file_status['error_list'] == []
@@ -281,7 +388,7 @@ def test_diffnametovalidate_check_existing_file_status():
     entity = synapseclient.Entity(name='second.txt', id='syn1234', md5='3333')
     entities = [entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(emptydf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, emptydf), entities)
     assert file_status['to_validate']
     assert file_status['status_list'] == ['VALID']
     assert file_status['error_list'] == []
@@ -303,7 +410,7 @@ def test_twoinvalid_check_existing_file_status():
     second_entity = synapseclient.Entity(name='second.txt', id='syn2345', md5='44444')
     entities = [first_entity, second_entity]
     file_status = input_to_database.check_existing_file_status(
-        mock_csv_query_result(validation_statusdf), mock_csv_query_result(error_trackerdf), entities)
+        input_to_database.FileStatusStore(validation_statusdf, error_trackerdf), entities)
     assert not file_status['to_validate']
     assert file_status['status_list'] == [
         'INVALID', 'INVALID']
@@ -321,7 +428,60 @@ def test_error_check_existing_file_status():
             match='There should never be more than 2 files being validated.'):
         entities = ['foo', 'doo', 'boo']
         input_to_database.check_existing_file_status(
-            emptydf, emptydf, entities)
+            input_to_database.FileStatusStore(emptydf, emptydf), entities)
+
+
+def test_file_status_store():
+    """Store records are keyed by id and low cardinality columns are
+    categoricals"""
+    store = input_to_database.FileStatusStore(validation_statusdf,
+                                              error_trackerdf)
+    assert len(store) == 2
+    assert "syn1234" in store
+    assert store.get("syn9999") is None
+    assert store.get("syn2345") == input_to_database.FileStatus(
+        status='INVALID', md5='44444', name='second.txt',
+        errors='Invalid file format')
+    assert store.get("syn1234").errors is None
+    assert store.validation_statusdf['status'].dtype.name == 'category'
+    assert store.validation_statusdf['fileType'].dtype.name == 'category'
+    assert store.error_trackerdf['fileType'].dtype.name == 'category'
+
+
+def test_store_update_status_and_error_tables():
+    """The tables are updated from the store, without reading the queries
+    again"""
+    validation_status_table = Mock(tableId="syn333")
+    error_tracker_table = Mock(tableId="syn444")
+    with patch.object(process_functions, "updateDatabase") as mock_update:
+        input_to_database.update_status_and_error_tables(
+            syn, validation_statusdf, error_trackerdf,
+            validation_status_table, error_tracker_table,
+            status_store=status_store
+        )
+    validation_status_table.asDataFrame.assert_not_called()
+    error_tracker_table.asDataFrame.assert_not_called()
+    (_, errorsdf, _, errors_synid, _), _ = mock_update.call_args_list[0]
+    (_, statusdf, _, status_synid, _), _ = mock_update.call_args_list[1]
+    assert (errors_synid, status_synid) == ("syn444", "syn333")
+    assert errorsdf.equals(error_trackerdf)
+    assert statusdf.equals(validation_statusdf)
+
+
+def test_file_status_store_duplicated_ids():
+    """Files with the same name, several cbs/seg files and more than two
+    clinical files are duplicated"""
+    store = input_to_database.FileStatusStore(pd.DataFrame({
+        'id': ['syn1', 'syn2', 'syn3', 'syn4', 'syn5', 'syn6', 'syn7'],
+        'name': ['first.cbs', 'second.seg', 'data_clinical_supp_1',
+                 'data_clinical_supp_2', 'data_clinical_supp_3',
+                 'data.txt', 'data.txt']
+    }))
+    assert store.duplicated_ids() == {'syn1', 'syn2', 'syn3', 'syn4',
+                                      'syn5', 'syn6', 'syn7'}
+    assert input_to_database.FileStatusStore(
+        validation_statusdf
+    ).duplicated_ids() == set()
 
 
 def test_create_and_archive_maf_database():
@@ -399,14 +559,13 @@ def test_valid_validatefile():
                       "_send_validation_error_email") as patch_send_email:
 
         validate_results = input_to_database.validatefile(
-            syn, None, entities, validation_statusdf,
-            error_trackerdf, center, threads, oncotree_link)
+            syn, None, entities, status_store,
+            center, threads, oncotree_link)
 
         assert expected_results == validate_results
         patch_validate.assert_called_once_with(
             oncotree_link=oncotree_link, nosymbol_check=False)
-        patch_check.assert_called_once_with(
-            validation_statusdf, error_trackerdf, entities)
+        patch_check.assert_called_once_with(status_store, entities)
         patch_determine_filetype.assert_called_once()
         patch_get_staterror_list.assert_called_once_with(
             valid, message, entities)
@@ -452,20 +611,57 @@ def test_invalid_validatefile():
                       return_value=status_error_list_results) as patch_get_staterror_list:
 
         validate_results = input_to_database.validatefile(
-            syn, None, entities, validation_statusdf,
-            error_trackerdf, center, threads, oncotree_link
+            syn, None, entities, status_store,
+            center, threads, oncotree_link
         )
 
         assert expected_results == validate_results
         patch_validate.assert_called_once_with(
             oncotree_link=oncotree_link, nosymbol_check=False)
-        patch_check.assert_called_once_with(
-            validation_statusdf, error_trackerdf, entities)
+        patch_check.assert_called_once_with(status_store, entities)
         patch_determine_filetype.assert_called_once()
         patch_get_staterror_list.assert_called_once_with(
             valid, message, entities)
 
 
+def test_cached_validatefile(tmpdir):
+    """Files with a cached validation result are not downloaded"""
+    class FileFormat(synapsegenie.example_filetype_format.FileTypeFormat):
+        _fileType = "clinical"
+        _filename_patterns = ["data_clinical_supp_{center}.txt"]
+
+    entity = synapseclient.File(name="data_clinical_supp_SAGE.txt",
+                                id='syn9999', md5='5555', parentId='syn1')
+    entity.modifiedBy = '333'
+    entity.createdBy = '444'
+    format_registry = synapsegenie.config.FormatRegistry(clinical=FileFormat)
+    cache = synapsegenie.validation_cache.ValidationCache(
+        str(tmpdir.join("validation.sqlite"))
+    )
+    with synapsegenie.validation_cache.use_validation_cache(cache),\
+         patch.object(syn, "get", return_value=Mock(id="syn123")),\
+         patch.object(input_to_database, "_download_entities") as patch_dl,\
+         patch.object(FileFormat, "validate") as patch_validate:
+        validator = input_to_database.validate.ValidationSession(
+            syn, "syn123", format_registry
+        ).helper(center, [entity], file_type="clinical")
+        cache.set(validator._get_cache_key(validator._get_validate_kwargs(
+            dict(oncotree_link=oncotree_link, nosymbol_check=False)
+        )), False, "error", "")
+        results = input_to_database.validatefile(
+            syn, "syn123", [entity], status_store, center, 1,
+            oncotree_link, format_registry=format_registry
+        )
+    patch_dl.assert_not_called()
+    patch_validate.assert_not_called()
+    assert results[0] == [{'entity': entity, 'status': 'INVALID',
+                           'fileType': 'clinical', 'center': center}]
+    assert results[2] == [
+        ([entity.name], "----------------ERRORS----------------\nerror",
+         ['333', '444'])
+    ]
+
+
 def test_already_validated_validatefile():
     '''
     Test already validated files
@@ -509,19 +705,37 @@ def test_already_validated_validatefile():
                       "_send_validation_error_email") as patch_send_email:
 
         validate_results = input_to_database.validatefile(
-            syn, None, entities, validation_statusdf,
-            error_trackerdf, center, threads, oncotree_link,
+            syn, None, entities, status_store,
+            center, threads, oncotree_link,
         )
 
         assert expected_results == validate_results
         patch_validate.assert_not_called()
-        patch_check.assert_called_once_with(
-            validation_statusdf, error_trackerdf, entities)
+        patch_check.assert_called_once_with(status_store, entities)
         patch_determine_filetype.assert_called_once()
         patch_get_staterror_list.assert_not_called()
         patch_send_email.assert_not_called()
 
 
+def test_dry_run_side_effects(tmpdir):
+    """Nothing is emailed or stored in a dry run"""
+    log_path = tmpdir.join("SAGE_main_log.txt")
+    log_path.write("log")
+    message_objs = [dict(filenames=['data_clinical_supp_SAGE.txt'],
+                         messages="invalid error message here")]
+    with patch.object(syn, "getUserProfile") as patch_getuserprofile,\
+         patch.object(syn, "sendMessage") as patch_sendmessage,\
+         patch.object(syn, "store") as patch_store,\
+         process_functions.dry_run():
+        input_to_database._send_validation_error_email(syn, '333',
+                                                       message_objs)
+        input_to_database._store_log_file(syn, str(log_path), "syn555")
+    patch_getuserprofile.assert_not_called()
+    patch_sendmessage.assert_not_called()
+    patch_store.assert_not_called()
+    assert log_path.check()
+
+
 def test_valid__get_status_and_error_list():
     '''
     Tests the correct status and error lists received
@@ -789,7 +1003,7 @@ class TestValidation:
         entity = synapseclient.Entity(id='syn1234', md5='44444',
                                       path='/path/to/foobar.txt',
                                       name='data_clinical_supp_SAGE.txt')
-        entities = [entity]
+        entities = [[entity]]
         filetype = "clinical"
         input_status_list = [[entity.id, entity.path, entity.md5,
                               'VALIDATED', entity.name, modified_on,
@@ -801,10 +1015,16 @@ class TestValidation:
                       'duplicated_filesdf': self.empty_dup}
         validationstatus_mock = emptytable_mock()
         errortracking_mock = emptytable_mock()
+        store = Mock()
         valiate_cls = Mock()
         with patch.object(syn, "tableQuery",
                           side_effect=[validationstatus_mock,
                                        errortracking_mock]) as patch_query,\
+             patch.object(input_to_database.FileStatusStore, "from_tables",
+                          return_value=store) as patch_store,\
+             patch.object(input_to_database, "_prefetch_entities",
+                          side_effect=lambda syn, store, ents, center,
+                          is_cached: ents),\
              patch.object(input_to_database, "validatefile",
                           return_value=(input_status_list,
                                         invalid_errors_list,
@@ -824,13 +1044,14 @@ class TestValidation:
                 format_registry={"test": valiate_cls}
             )
             assert patch_query.call_count == 2
+            patch_store.assert_called_once_with(validationstatus_mock,
+                                                errortracking_mock)
             patch_validatefile.assert_called_once_with(
-                syn, "syn123", entity,
-                validationstatus_mock,
-                errortracking_mock,
+                syn, "syn123", [entity], store,
                 center='SAGE', threads=1,
                 oncotree_link=oncotree_link,
-                format_registry={"test": valiate_cls}
+                format_registry={"test": valiate_cls},
+                session=mock.ANY
             )
 
             assert valid_filedf.equals(
@@ -838,6 +1059,227 @@ class TestValidation:
             )
 
 
+def test_serial_validate_center_files():
+    """One thread validates the files in this process"""
+    first_ent = synapseclient.Entity(name='first.txt', id='syn1234',
+                                     md5='3333')
+    second_ent = synapseclient.Entity(name='second.txt', id='syn2345',
+                                      md5='44444')
+    with patch.object(input_to_database, "validatefile",
+                      side_effect=['first', 'second']) as patch_validate,\
+         patch.object(input_to_database,
+                      "_download_entities") as patch_download:
+        results = input_to_database.validate_center_files(
+            syn, "syn123", center, [[first_ent], [second_ent]],
+            status_store, oncotree_link, format_registry={}
+        )
+        assert list(results) == ['first', 'second']
+    # Unchanged files aren't downloaded ahead of validation
+    patch_download.assert_not_called()
+    patch_validate.assert_any_call(
+        syn, "syn123", [first_ent], status_store, center=center,
+        threads=1, oncotree_link=oncotree_link, format_registry={},
+        session=mock.ANY
+    )
+    # The files share one validation session
+    first_call, second_call = patch_validate.call_args_list
+    assert first_call[1]['session'] is second_call[1]['session']
+
+
+def test_pool_validate_center_files():
+    """Files are validated by workers with their own Synapse session and
+    only their stored statuses, results are in input order"""
+    first_ent = synapseclient.Entity(name='first.txt', id='syn1234',
+                                     md5='3333')
+    second_ent = synapseclient.Entity(name='second.txt', id='syn2345',
+                                      md5='44444')
+    worker_syn = Mock()
+
+    def validate_ents(worker, project_id, ents, statuses, **kwargs):
+        assert worker is worker_syn
+        assert kwargs['session'].syn is worker_syn
+        return ents[0].id, statuses
+
+    def thread_pool(max_workers, mp_context):
+        # Workers are spawned, not forked from a process with threads
+        assert mp_context.get_start_method() == "spawn"
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    with patch.object(input_to_database, "ProcessPoolExecutor",
+                      side_effect=thread_pool),\
+         patch.object(input_to_database, "_WORKER_SESSION", None),\
+         patch.object(input_to_database, "_get_worker_syn",
+                      return_value=worker_syn),\
+         patch.object(input_to_database, "validatefile",
+                      side_effect=validate_ents):
+        results = input_to_database.validate_center_files(
+            syn, "syn123", center, [[first_ent], [second_ent]],
+            status_store, oncotree_link, format_registry={}, threads=2
+        )
+        results = list(results)
+    assert results == [
+        ('syn1234', {'syn1234': status_store.get('syn1234')}),
+        ('syn2345', {'syn2345': status_store.get('syn2345')})
+    ]
+
+
+def test_prefetch_validate_center_files():
+    """New files are downloaded before they are validated"""
+    new_ent = synapseclient.Entity(name='new.txt', id='syn9999', md5='1')
+    downloaded_ent = synapseclient.Entity(name='new.txt', id='syn9999',
+                                          md5='1', path='new.txt')
+    with patch.object(input_to_database, "_download_entities",
+                      return_value=[downloaded_ent]) as patch_download,\
+         patch.object(input_to_database, "validatefile",
+                      return_value='new') as patch_validate:
+        results = list(input_to_database.validate_center_files(
+            syn, "syn123", center, [[new_ent]],
+            status_store, oncotree_link, format_registry={}
+        ))
+    assert results == ['new']
+    patch_download.assert_called_once_with(syn, [new_ent])
+    assert patch_validate.call_args[0][2] == [downloaded_ent]
+
+
+def test_journaled_validate_center_files(tmpdir):
+    """Files validated earlier in a resumed run are not validated again"""
+    ent = synapseclient.Entity(name='new.txt', id='syn9999', md5='1',
+                               path='new.txt')
+    result = ([{'entity': ent, 'status': 'INVALID', 'fileType': 'clinical',
+                'center': center}],
+              [{'entity': ent, 'errors': 'error', 'fileType': 'clinical',
+                'center': center}],
+              [(['new.txt'], 'error', ['333'])])
+    journal = run_journal.RunJournal("run", directory=str(tmpdir))
+    with run_journal.use_run_journal(journal),\
+         patch.object(input_to_database, "validatefile",
+                      return_value=result) as patch_validate:
+        results = list(input_to_database.validate_center_files(
+            syn, "syn123", center, [[ent]],
+            status_store, oncotree_link, format_registry={}
+        ))
+    assert results == [result]
+
+    resumed = run_journal.RunJournal.resume("run", directory=str(tmpdir))
+    with run_journal.use_run_journal(resumed),\
+         patch.object(input_to_database, "validatefile") as patch_validate:
+        results = list(input_to_database.validate_center_files(
+            syn, "syn123", center, [[ent]],
+            status_store, oncotree_link, format_registry={}
+        ))
+    patch_validate.assert_not_called()
+    assert results == [result]
+
+
+def test_resumed_validation_emails(tmpdir):
+    """Users emailed earlier in a resumed run are not emailed again"""
+    ent = synapseclient.Entity(name='new.txt', id='syn9999', md5='1',
+                               path='new.txt')
+    result = ([{'entity': ent, 'status': 'INVALID', 'fileType': 'clinical',
+                'center': center}],
+              [{'entity': ent, 'errors': 'error', 'fileType': 'clinical',
+                'center': center}],
+              [(['new.txt'], 'error', ['333'])])
+    mappingdf = pd.DataFrame({'Database': ['validationStatus',
+                                           'errorTracker'],
+                              'Id': ['syn333', 'syn444']})
+    tables = {'validation_statusdf': pd.DataFrame(columns=['id', 'path',
+                                                           'fileType',
+                                                           'name',
+                                                           'status']),
+              'error_trackingdf': pd.DataFrame(),
+              'duplicated_filesdf': pd.DataFrame()}
+
+    def run_validation():
+        with patch.object(syn, "tableQuery"),\
+             patch.object(input_to_database, "validate_center_files",
+                          return_value=[result]),\
+             patch.object(input_to_database,
+                          "build_validation_status_table"),\
+             patch.object(input_to_database, "build_error_tracking_table"),\
+             patch.object(input_to_database, "_update_tables_content",
+                          return_value=tables),\
+             patch.object(input_to_database, "append_duplication_errors",
+                          side_effect=lambda dupdf, messages: messages),\
+             patch.object(input_to_database,
+                          "_send_validation_error_email") as patch_send,\
+             patch.object(input_to_database,
+                          "update_status_and_error_tables"):
+            input_to_database.validation(
+                syn, "syn123", center, "main", [[ent]], mappingdf,
+                oncotree_link, format_registry={}, session=Mock()
+            )
+        return patch_send
+
+    journal = run_journal.RunJournal("run", directory=str(tmpdir))
+    with run_journal.use_run_journal(journal):
+        patch_send = run_validation()
+    patch_send.assert_called_once_with(
+        syn=syn, user='333',
+        message_objs=[dict(filenames=['new.txt'], messages='error')]
+    )
+
+    resumed = run_journal.RunJournal.resume("run", directory=str(tmpdir))
+    with run_journal.use_run_journal(resumed):
+        patch_send = run_validation()
+    patch_send.assert_not_called()
+
+
+def test_window_bounded_map():
+    """No more than window items are submitted ahead of the consumer"""
+    submitted = []
+
+    def submit(item):
+        submitted.append(item)
+        future = Mock()
+        future.result.return_value = item * 10
+        return future
+
+    results = input_to_database._bounded_map(submit, range(5), window=2)
+    assert next(results) == 0
+    assert submitted == [0, 1]
+    assert list(results) == [10, 20, 30, 40]
+    assert submitted == [0, 1, 2, 3, 4]
+
+
+def test_processing_stage():
+    """Valid files are processed in order with the thread's own Synapse
+    client and errors are raised once all the files are processed"""
+    thread_syn = Mock()
+    processed = []
+
+    def process_file(process_syn, valid_file):
+        assert process_syn is thread_syn
+        if valid_file['id'] == 'syn1':
+            raise ValueError("failed")
+        processed.append(valid_file)
+
+    with patch.object(input_to_database, "_clone_syn",
+                      return_value=thread_syn) as patch_clone:
+        processing = input_to_database._ProcessingStage(syn, process_file,
+                                                        window=1)
+    patch_clone.assert_called_once_with(syn)
+    # Submitting doesn't raise the failures of earlier files
+    processing.submit({'id': 'syn1'})
+    processing.submit({'id': 'syn2'})
+    processing.submit({'id': 'syn3'})
+    with pytest.raises(ValueError, match="failed"):
+        processing.close()
+    assert processed == [{'id': 'syn2'}, {'id': 'syn3'}]
+
+
+def test_clone_syn():
+    """Cloned clients share the credentials but not the session"""
+    main_syn = synapseclient.Synapse(skip_checks=True, silent=True,
+                                     cache_client=False)
+    main_syn.credentials = Mock()
+    clone = input_to_database._clone_syn(main_syn)
+    assert clone is not main_syn
+    assert clone.credentials is main_syn.credentials
+    assert clone.repoEndpoint == main_syn.repoEndpoint
+    assert clone._requests_session is not main_syn._requests_session
+
+
 @pytest.mark.parametrize(
     'process, genieclass, filetype', [
         ('main', Mock(), 'clinical'),
@@ -870,6 +1312,33 @@ def test_main_processfile(process, genieclass, filetype):
     genieclass.assert_called_once()
 
 
+@pytest.mark.parametrize('is_processed', [True, False])
+def test_ledger_processfile(is_processed):
+    """Files that match the processed ledger are not processed again"""
+    genieclass = Mock()
+    validfilesdf = pd.DataFrame({'id': ['syn1'],
+                                 'path': ['/path/to/data_clinical_supp.txt'],
+                                 'md5': ['3333'],
+                                 'fileType': ['clinical'],
+                                 'name': ['data_clinical_supp_SAGE.txt']})
+    center_mapping_df = pd.DataFrame({'stagingSynId': ["syn123"],
+                                      'center': ["SAGE"]})
+    databaseToSynIdMappingDf = pd.DataFrame({'Database': ['clinical'],
+                                             'Id': ['syn222']})
+    ledger = Mock()
+    ledger.is_processed.return_value = is_processed
+    with processed_ledger.use_processed_ledger(ledger):
+        input_to_database.processfiles(
+            syn, validfilesdf, "SAGE", "./",
+            center_mapping_df, "www.google.com", databaseToSynIdMappingDf,
+            format_registry={'clinical': genieclass}
+        )
+    ledger.get_entry.assert_called_once_with('syn1', '3333', 'clinical',
+                                             'syn222', genieclass)
+    assert genieclass.called != is_processed
+    assert ledger.record.called != is_processed
+
+
 # TODO: Fix this
 def test_mainnone_processfile():
     """If file type is None, the processing function is not called"""
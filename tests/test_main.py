@@ -0,0 +1,59 @@
+"""Tests __main__.py"""
+import json
+import subprocess
+import sys
+from unittest.mock import patch
+
+import synapseclient
+
+from synapsegenie import __version__
+from synapsegenie import __main__ as main
+
+# Modules the CLI must not import until a command needs them
+HEAVY_MODULES = ["pandas", "synapseclient", "synapseutils", "requests",
+                 "Crypto"]
+# Seconds importing the CLI may take
+IMPORT_TIME_BUDGET = 0.25
+
+IMPORT_CLI = f"""
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import synapsegenie.__main__
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'elapsed': elapsed,
+    'heavy_modules': [module for module in {HEAVY_MODULES!r}
+                      if module in sys.modules]
+}}))
+"""
+
+
+def test_cli_import():
+    """The CLI is imported without heavy dependencies within the budget"""
+    # The fastest of a few imports, a new process is cold each time
+    results = [
+        json.loads(subprocess.check_output([sys.executable, "-c",
+                                            IMPORT_CLI]))
+        for _ in range(3)
+    ]
+    assert results[0]['heavy_modules'] == []
+    assert min(result['elapsed'] for result in results) < IMPORT_TIME_BUDGET
+
+
+def test_version():
+    """--version doesn't need any command dependency"""
+    output = subprocess.check_output(
+        [sys.executable, "-m", "synapsegenie", "--version"]
+    )
+    assert output.decode().strip() == f"genie {__version__}"
+
+
+def test_token_synapse_login():
+    """Worker processes log in with the auth token of the main process"""
+    with patch.object(synapseclient, "login") as patch_login:
+        syn = main.synapse_login(auth_token="token")
+    patch_login.assert_called_once_with(authToken="token", silent=True)
+    assert syn == patch_login.return_value
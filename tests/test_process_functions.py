@@ -1,9 +1,14 @@
+import io
+import json
 from unittest import mock
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pandas as pd
 import pytest
+import requests
 import synapseclient
+from synapseclient.core.exceptions import (SynapseHTTPError,
+                                           SynapseTimeoutError)
 
 import synapsegenie.process_functions
 
@@ -32,6 +37,33 @@ def test_removeStringFloat(input_str, output):
     assert synapsegenie.process_functions.removeStringFloat(input_str) == output
 
 
+def test_write_df_csv():
+    """Integer columns are written without decimals, in chunks"""
+    df = pd.DataFrame({
+        "foo": [1, float('nan'), 3],
+        "bar": ['1.0', 'b', 'c'],
+        "baz": [1.0, '', 2.5],
+        "float": [1.5, 2.0, float('nan')]})
+    text = io.StringIO()
+    synapsegenie.process_functions.write_df_csv(df, text, chunksize=2)
+    assert text.getvalue() == (
+        "foo,bar,baz,float\n"
+        "1,1.0,1.0,1.5\n"
+        ",b,,2.0\n"
+        "3,c,2.5,\n")
+
+
+def test_integercols_write_df_csv():
+    """Only the passed in integer columns are changed"""
+    df = pd.DataFrame({
+        "foo": [1, float('nan')],
+        "baz": [1.0, 2.5]}).astype(object)
+    text = io.StringIO()
+    synapsegenie.process_functions.write_df_csv(
+        df, text, header=False, integer_cols=['baz'])
+    assert text.getvalue() == "1.0,1\n,2.5\n"
+
+
 def test_valid__check_valid_df():
     synapsegenie.process_functions._check_valid_df(DATABASE_DF, "test")
 
@@ -119,6 +151,33 @@ def test_second_validation_get_left_union_df():
             testing, DATABASE_DF, 'FOO')
 
 
+@pytest.mark.parametrize("primary_key_cols,expected", [
+        (["test"], ['test1', 'test2', 'test3']),
+        ("test", ['test1', 'test2', 'test3']),
+        (["test", "foo"], ['test1 1', 'test2 2', 'test3 3']),
+        (["test", "baz"], ['test1 nan', 'test2 nan', 'test3 nan'])
+    ])
+def test__create_primary_key(primary_key_cols, expected):
+    """Primary key is built by joining the columns with a space"""
+    primary_key = synapsegenie.process_functions._create_primary_key(
+        DATABASE_DF, primary_key_cols)
+    assert primary_key.tolist() == expected
+
+
+def test_hash__create_primary_key():
+    """Hashed primary keys are 64-bit, unique per key and stable"""
+    new_datadf = DATABASE_DF.copy()
+    new_datadf['foo'] = ['1', '2', '4']
+    primary_key = synapsegenie.process_functions._create_primary_key(
+        DATABASE_DF, ["test", "foo"], hash_key=True)
+    new_primary_key = synapsegenie.process_functions._create_primary_key(
+        new_datadf, ["test", "foo"], hash_key=True)
+    assert primary_key.dtype == 'uint64'
+    assert primary_key.is_unique
+    assert primary_key.tolist()[:2] == new_primary_key.tolist()[:2]
+    assert primary_key[2] != new_primary_key[2]
+
+
 def test_append__append_rows():
     new_datadf = pd.DataFrame({
         'UNIQUE_KEY': ['test1', 'test2', 'test3', 'test4'],
@@ -262,6 +321,168 @@ def test_noupdate__update_rows():
     assert update_rows.empty
 
 
+def test_equalvalues__get_row_fingerprint():
+    """Values that compare equal have the same fingerprint regardless
+    of the column dtype"""
+    databasedf = pd.DataFrame({
+        "foo": [1.0, 2.0, ''],
+        "baz": ['a', 'b', 'c']})
+    new_datadf = pd.DataFrame({
+        "foo": [1, 2, ''],
+        "baz": ['a', 'b', 'c']})
+    database_fingerprint = \
+        synapsegenie.process_functions._get_row_fingerprint(databasedf)
+    dataset_fingerprint = \
+        synapsegenie.process_functions._get_row_fingerprint(new_datadf)
+    assert database_fingerprint.dtype == 'uint64'
+    assert database_fingerprint.tolist() == dataset_fingerprint.tolist()
+
+
+def test_diffvalues__get_row_fingerprint():
+    """Strings don't match numbers and changed cells change the
+    fingerprint"""
+    databasedf = pd.DataFrame({
+        "foo": [1.0, 2.0, 3.5],
+        "baz": ['a', 'b', 'c']})
+    new_datadf = pd.DataFrame({
+        "foo": ['1.0', 2, 3.5],
+        "baz": ['a', 'b', 'd']})
+    database_fingerprint = \
+        synapsegenie.process_functions._get_row_fingerprint(databasedf)
+    dataset_fingerprint = \
+        synapsegenie.process_functions._get_row_fingerprint(new_datadf)
+    assert (database_fingerprint == dataset_fingerprint).tolist() == [
+        False, True, False]
+
+
+def test__diff_rows():
+    """Rows are classified as appends, updates and deletes in one pass"""
+    databasedf = DATABASE_DF.copy()
+    new_datadf = pd.DataFrame({
+        'UNIQUE_KEY': ['test1', 'test2', 'test4'],
+        "test": ['test1', 'test5', 'test4'],
+        "foo": [1, 2, 4],
+        "baz": [float('nan'), float('nan'), 3.2]})
+    row_changes = synapsegenie.process_functions._diff_rows(
+        new_datadf, databasedf, 'UNIQUE_KEY')
+    assert row_changes['append'].to_dict('list') == {
+        'test': ['test4'], 'foo': [4], 'baz': [3.2]}
+    assert row_changes['update'].to_dict('list') == {
+        'test': ['test5'], 'foo': [2], 'baz': [''],
+        'ROW_ID': ['2'], 'ROW_VERSION': ['3']}
+    assert row_changes['delete'].to_dict('list') == {0: ['3'], 1: ['5']}
+
+
+def test__split_store_partial_updates():
+    """Rows with few changed cells are stored as partial rows"""
+    databasedf = pd.DataFrame({
+        'UNIQUE_KEY': ['test1', 'test2'],
+        "test": ['test1', 'test2'],
+        "foo": [1, 2],
+        "baz": [1.0, 2.0]})
+    databasedf.index = ['1_1', '2_1']
+    new_datadf = pd.DataFrame({
+        'UNIQUE_KEY': ['test1', 'test2'],
+        "test": ['test1', 'test5'],
+        "foo": [3, 2],
+        "baz": [float('nan'), 2.0]})
+    changes = synapsegenie.process_functions._diff_rows(
+        new_datadf, databasedf, 'UNIQUE_KEY')
+    columns = [Mock(id=str(colid)) for colid in range(3)]
+    for column, name in zip(columns, ['test', 'foo', 'baz']):
+        column.name = name
+    with patch.object(syn, "store") as patch_store:
+        changes = synapsegenie.process_functions._split_partial_updates(
+            changes)
+        synapsegenie.process_functions._store_partial_updates(
+            syn, "syn1234", changes, columns)
+        rowset = patch_store.call_args[0][0]
+        assert isinstance(rowset, synapseclient.table.PartialRowset)
+        assert [row.rowId for row in rowset.rows] == [2]
+        assert [row.values for row in rowset.rows] == [
+            [{'key': '0', 'value': 'test5'}]]
+    assert changes['update'].to_dict('list') == {
+        'test': ['test1'], 'foo': [3], 'baz': [''],
+        'ROW_ID': ['1'], 'ROW_VERSION': ['1']}
+
+
+def test_plan_database_update():
+    """The change set counts the changes without storing them"""
+    databasedf = pd.DataFrame({
+        "test": ['test1', 'test2', 'test3'],
+        "foo": [1, 2, 3]})
+    databasedf.index = ['1_1', '2_1', '3_2']
+    new_datadf = pd.DataFrame({
+        "test": ['test1', 'test2', 'test4'],
+        "foo": [1, 5, 4]})
+    with patch.object(syn, "getTableColumns", return_value=[]),\
+         patch.object(syn, "store") as patch_store:
+        change_set = synapsegenie.process_functions.plan_database_update(
+            syn, databasedf, new_datadf, "syn1234", ['test'],
+            to_delete=True)
+        patch_store.assert_not_called()
+    assert change_set.counts == {'append': 1, 'update': 1, 'delete': 1}
+    assert change_set.estimated_bytes == len(
+        "ROW_ID,ROW_VERSION,test,foo\n,,test4,4\n2,1,test2,5\n3,2\n")
+    assert not change_set.empty
+
+
+def test_partial_plan_database_update():
+    """The estimated size includes the partial row set"""
+    databasedf = pd.DataFrame({
+        "test": ['test1', 'test2'],
+        "foo": [1, 2],
+        "bar": ['a', 'b'],
+        "baz": ['c', 'd']})
+    databasedf.index = ['1_1', '2_1']
+    new_datadf = pd.DataFrame({
+        "test": ['test1', 'test2'],
+        "foo": [1, 5],
+        "bar": ['a', 'b'],
+        "baz": ['c', 'd']})
+    columns = [Mock(id=str(colid), columnType=column_type)
+               for colid, column_type
+               in enumerate(['STRING', 'INTEGER', 'STRING', 'STRING'])]
+    for column, name in zip(columns, ['test', 'foo', 'bar', 'baz']):
+        column.name = name
+    with patch.object(syn, "getTableColumns", return_value=columns):
+        change_set = synapsegenie.process_functions.plan_database_update(
+            syn, databasedf, new_datadf, "syn1234", ['test'],
+            partial_update=True)
+    assert len(change_set.partial) == 1
+    rowset = synapseclient.table.PartialRowset(
+        "syn1234",
+        [synapseclient.table.PartialRow({'1': 5}, '2')])
+    assert change_set.estimated_bytes == len(
+        "ROW_ID,ROW_VERSION,test,foo,bar,baz\n") + len(json.dumps(rowset))
+
+
+def test_dryrun_storeFile():
+    """Files aren't stored in a dry run"""
+    with patch.object(syn, "store") as patch_store,\
+         synapsegenie.process_functions.dry_run():
+        ent = synapsegenie.process_functions.storeFile(
+            syn, "data_mutations_extended_SAGE.txt", "syn1234", "SAGE",
+            "maf", "mutation")
+    patch_store.assert_not_called()
+    assert ent.name == "data_mutations_extended_SAGE.txt"
+
+
+def test_dryrun_updateDatabase():
+    """Table updates aren't stored in a dry run"""
+    with patch.object(syn, "getTableColumns", return_value=[]),\
+         patch.object(synapsegenie.process_functions,
+                      "store_table_update") as patch_store,\
+         synapsegenie.process_functions.dry_run():
+        databasedf = DATABASE_DF.drop(columns='UNIQUE_KEY')
+        new_datadf = databasedf.assign(foo=[1, 2, 4])
+        change_set = synapsegenie.process_functions.updateDatabase(
+            syn, databasedf, new_datadf, "syn1234", ['test'])
+        patch_store.assert_not_called()
+    assert change_set.counts == {'append': 0, 'update': 1, 'delete': 0}
+    assert not synapsegenie.process_functions.is_dry_run()
+
+
 def test_delete__delete_rows():
     new_datadf = pd.DataFrame({
         'UNIQUE_KEY': ['test1'],
@@ -319,3 +540,580 @@ def test_get_syntabledf():
         df = synapsegenie.process_functions.get_syntabledf(syn, querystring)
         patch_syn_tablequery.assert_called_once_with(querystring)
         assert df.equals(arg.asDataFrame())
+
+
+class csv_query_result:
+    """Table query result downloaded as csv"""
+    separator = ","
+    quoteCharacter = '"'
+    escapeCharacter = "\\"
+
+    def __init__(self, filepath, headers):
+        self.filepath = filepath
+        self.headers = headers
+
+
+def test_update_data_out_of_core(tmp_path):
+    """The out-of-core diff writes the same changes as updateDatabase"""
+    database_csv = tmp_path / "query.csv"
+    database_csv.write_text(
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo,baz\n"
+        "1,3,SAGE,test1,1,\n"
+        "2,3,SAGE,test2,2,\n"
+        "3,5,SAGE,test3,3,\n"
+        "4,1,SAGE,test5,5,a\n"
+    )
+    headers = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="INTEGER"), Mock(columnType="STRING")]
+    for header, name in zip(headers, ["CENTER", "ID", "foo", "baz"]):
+        header.name = name
+    new_datadf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 4,
+        'ID': ['test1', 'test2', 'test4', 'test5'],
+        "foo": [1, 4, 4, 5],
+        "baz": [float('nan'), float('nan'), 'b', 'a']})
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    stored = []
+
+    def store_table(table):
+        with open(table.filepath) as update_file:
+            stored.append(update_file.read().splitlines())
+
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "tableQuery",
+                      return_value=csv_query_result(str(database_csv),
+                                                    headers)),\
+         patch.object(syn, "store", side_effect=store_table):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True,
+            max_memory=100)
+    assert len(stored) == 1
+    header, *rows = stored[0]
+    assert header == "ROW_ID,ROW_VERSION,CENTER,ID,foo,baz"
+    assert sorted(rows) == sorted([
+        ",,SAGE,test4,4,b",
+        "2,3,SAGE,test2,4,",
+        "3,5"])
+
+
+def test_blank_key_update_data_out_of_core(tmp_path):
+    """Unchanged rows with a blank key are in the same partition on both
+    sides, they aren't deleted and appended again"""
+    database_csv = tmp_path / "query.csv"
+    database_csv.write_text(
+        "ROW_ID,ROW_VERSION,CENTER,ID,SUB,foo\n" +
+        "".join("{},1,SAGE,test{},,{}\n".format(row, row, row)
+                for row in range(20))
+    )
+    headers = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="STRING"), Mock(columnType="INTEGER")]
+    for header, name in zip(headers, ["CENTER", "ID", "SUB", "foo"]):
+        header.name = name
+    new_datadf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 20,
+        'ID': ['test{}'.format(row) for row in range(20)],
+        'SUB': [float('nan')] * 20,
+        'foo': list(range(20))})
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID', 'SUB'])
+
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "tableQuery",
+                      return_value=csv_query_result(str(database_csv),
+                                                    headers)),\
+         patch.object(syn, "store") as patch_store,\
+         synapsegenie.process_functions.out_of_core_updates(4000):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True)
+    patch_store.assert_not_called()
+
+
+def test_partial_update_data_out_of_core(tmp_path):
+    """Rows with few changed cells are stored as partial rows"""
+    database_csv = tmp_path / "query.csv"
+    database_csv.write_text(
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo,baz\n"
+        "1,3,SAGE,test1,1,a\n"
+        "2,3,SAGE,test2,2,b\n"
+    )
+    headers = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="INTEGER"), Mock(columnType="STRING")]
+    columns = []
+    for header, name in zip(headers, ["CENTER", "ID", "foo", "baz"]):
+        header.name = name
+        columns.append(Mock(id=name.lower()))
+        columns[-1].name = name
+    new_datadf = pd.DataFrame({'CENTER': ['SAGE'] * 2,
+                               'ID': ['test1', 'test2'],
+                               'foo': [1, 4],
+                               'baz': ['a', 'b']})
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery",
+                      return_value=csv_query_result(str(database_csv),
+                                                    headers)),\
+         patch.object(syn, "store") as patch_store:
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True,
+            max_memory=4000, partial_update=True)
+    patch_store.assert_called_once()
+    rowset = patch_store.call_args[0][0]
+    assert isinstance(rowset, synapseclient.table.PartialRowset)
+    assert [row['values'] for row in rowset.rows] == [
+        [{'key': 'foo', 'value': 4}]]
+
+
+def test_rowhash_update_data_out_of_core(tmp_path):
+    """The row hash is recomputed by the out-of-core diff"""
+    row_hash = synapsegenie.process_functions._get_row_hash
+    databasedf = pd.DataFrame({'CENTER': ['SAGE'] * 2,
+                               'ID': ['test1', 'test2'],
+                               'foo': [1, 2]})
+    hashes = row_hash(databasedf)
+    database_csv = tmp_path / "query.csv"
+    database_csv.write_text(
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo,_ROW_HASH\n"
+        "1,3,SAGE,test1,1,{}\n"
+        "2,3,SAGE,test2,2,{}\n".format(*hashes)
+    )
+    headers = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="INTEGER"), Mock(columnType="STRING")]
+    for header, name in zip(headers, ["CENTER", "ID", "foo", "_ROW_HASH"]):
+        header.name = name
+    new_datadf = pd.DataFrame({'CENTER': ['SAGE'] * 2,
+                               'ID': ['test1', 'test2'],
+                               'foo': [1, 4]})
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    stored = []
+
+    def store_table(table):
+        with open(table.filepath) as update_file:
+            stored.append(update_file.read().splitlines())
+
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "tableQuery",
+                      return_value=csv_query_result(str(database_csv),
+                                                    headers)),\
+         patch.object(syn, "store", side_effect=store_table):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True,
+            max_memory=100)
+    assert stored == [[
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo,_ROW_HASH",
+        "2,3,SAGE,test2,4,{}".format(row_hash(new_datadf.iloc[[1]]).iloc[0])
+    ]]
+
+
+def test_col_rowhash_updateData():
+    """Tables with a row hash can't be updated on some of their columns"""
+    columns = [Mock(), Mock(), Mock()]
+    for column, name in zip(columns, ['ID', 'foo', '_ROW_HASH']):
+        column.name = name
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         pytest.raises(ValueError, match="must be updated on all"):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", pd.DataFrame({'ID': ['test1'], 'foo': [1]}),
+            "SAGE", col=['ID', 'foo'])
+
+
+def test_store_table_update(tmp_path):
+    """Batches are bounded and a failed batch is retried on its own"""
+    update_path = tmp_path / "update.csv"
+    update_path.write_text(
+        "ROW_ID,ROW_VERSION,foo\n" +
+        "".join("{},1,{}\n".format(row, row) for row in range(5)))
+    stored = []
+    failed = []
+
+    def store_table(table):
+        with open(table.filepath) as batch_file:
+            lines = batch_file.read().splitlines()
+        if len(stored) == 1 and not failed:
+            failed.append(lines)
+            raise requests.exceptions.ConnectionError("timeout")
+        stored.append(lines)
+
+    batch_size = synapsegenie.process_functions._AdaptiveBatchSize(
+        rows=2, min_rows=1, target_seconds=100)
+    with patch.object(syn, "store", side_effect=store_table),\
+         patch.object(synapsegenie.process_functions.time, "sleep"):
+        nbatches = synapsegenie.process_functions.store_table_update(
+            syn, "syn1234", str(update_path), batch_size=batch_size)
+    # The batch grows after a fast upload and shrinks after a failure
+    assert failed == [["ROW_ID,ROW_VERSION,foo", "2,1,2", "3,1,3", "4,1,4"]]
+    assert nbatches == 3
+    assert stored == [
+        ["ROW_ID,ROW_VERSION,foo", "0,1,0", "1,1,1"],
+        ["ROW_ID,ROW_VERSION,foo", "2,1,2", "3,1,3"],
+        ["ROW_ID,ROW_VERSION,foo", "4,1,4"]]
+
+
+def test_error_store_table_update(tmp_path):
+    """Errors that aren't transient are raised without retrying"""
+    update_path = tmp_path / "update.csv"
+    update_path.write_text("ROW_ID,ROW_VERSION,foo\n1,1,1\n")
+    error = SynapseHTTPError("bad request",
+                             response=Mock(status_code=400))
+    with patch.object(syn, "store", side_effect=error) as patch_store,\
+         pytest.raises(SynapseHTTPError):
+        synapsegenie.process_functions.store_table_update(
+            syn, "syn1234", str(update_path))
+    patch_store.assert_called_once()
+
+
+@pytest.mark.parametrize("committed", [True, False])
+def test_append_store_table_update(tmp_path, committed):
+    """Appended rows of a batch that failed after it was committed aren't
+    sent again, they are when the batch wasn't committed"""
+    update_path = tmp_path / "update.csv"
+    update_path.write_text("ROW_ID,ROW_VERSION,ID,foo\n,,test1,1\n"
+                           ",,test2,2\n")
+    table = pd.DataFrame(columns=['ID', 'foo'])
+    stored = []
+
+    def store_table(batch):
+        nonlocal table
+        if committed or stored:
+            table = pd.read_csv(batch.filepath)[['ID', 'foo']]
+        stored.append(batch.filepath)
+        if len(stored) == 1:
+            raise SynapseTimeoutError("timed out")
+
+    with patch.object(syn, "store", side_effect=store_table),\
+         patch.object(syn, "tableQuery",
+                      side_effect=lambda query: Mock(
+                          asDataFrame=Mock(return_value=table))
+                      ) as patch_query,\
+         patch.object(synapsegenie.process_functions.time, "sleep"):
+        nbatches = synapsegenie.process_functions.store_table_update(
+            syn, "syn1234", str(update_path), primary_key_cols=['ID'])
+    assert nbatches == 1
+    assert len(stored) == (1 if committed else 2)
+    patch_query.assert_called_once_with(
+        "SELECT * FROM syn1234 where \"ID\" IN ('test1','test2')")
+
+
+def test_unkeyed_append_store_table_update(tmp_path):
+    """Appended rows are not sent again when it can't be told whether they
+    were stored"""
+    update_path = tmp_path / "update.csv"
+    update_path.write_text("ROW_ID,ROW_VERSION,ID\n,,test1\n")
+    with patch.object(syn, "store",
+                      side_effect=SynapseTimeoutError("timed out")
+                      ) as patch_store,\
+         patch.object(synapsegenie.process_functions.time, "sleep"),\
+         pytest.raises(SynapseTimeoutError):
+        synapsegenie.process_functions.store_table_update(
+            syn, "syn1234", str(update_path))
+    patch_store.assert_called_once()
+
+
+def test_records_store_table_update(tmp_path):
+    """Batches hold whole csv records and are bounded in bytes"""
+    update_path = tmp_path / "update.csv"
+    update_path.write_text(
+        'ROW_ID,ROW_VERSION,foo\n'
+        '1,1,"multi\nline"\n'
+        '2,1,"say ""hi""\n"\n'
+        '3,1,\u00e9\u00e9\u00e9\n'
+        '4,1,a\n', encoding="utf-8")
+    stored = []
+
+    def store_table(table):
+        with open(table.filepath, encoding="utf-8", newline="") as batch:
+            stored.append(batch.read())
+
+    with patch.object(syn, "store", side_effect=store_table):
+        nbatches = synapsegenie.process_functions.store_table_update(
+            syn, "syn1234", str(update_path), max_bytes=10)
+    # The third record is 11 bytes but 8 characters long, it fills a batch
+    assert nbatches == 4
+    assert stored == [
+        'ROW_ID,ROW_VERSION,foo\n1,1,"multi\nline"\n',
+        'ROW_ID,ROW_VERSION,foo\n2,1,"say ""hi""\n"\n',
+        'ROW_ID,ROW_VERSION,foo\n3,1,\u00e9\u00e9\u00e9\n',
+        'ROW_ID,ROW_VERSION,foo\n4,1,a\n']
+
+
+def test_rowhash_updateData():
+    """Only rows with a changed row hash are downloaded"""
+    row_hash = synapsegenie.process_functions._get_row_hash
+    databasedf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 3,
+        'ID': ['test1', 'test2', 'test3'],
+        'foo': [1, 2, 3]})
+    databasedf['_ROW_HASH'] = row_hash(databasedf)
+    databasedf.index = ['1_1', '2_1', '3_1']
+    new_datadf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 3,
+        'ID': ['test1', 'test2', 'test4'],
+        'foo': [1, 5, 4]})
+    columns = [Mock(), Mock(), Mock(), Mock()]
+    for column, name in zip(columns, ['CENTER', 'ID', 'foo', '_ROW_HASH']):
+        column.name = name
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    queries = {
+        'SELECT "ID","_ROW_HASH" FROM syn1234 where CENTER =\'SAGE\'':
+            databasedf[['ID', '_ROW_HASH']],
+        "SELECT * FROM syn1234 WHERE ROW_ID IN (2)": databasedf.iloc[[1]]
+    }
+    stored = []
+
+    def store_table(syn, database_synid, update_path, primary_key_cols):
+        with open(update_path) as update_file:
+            stored.append(update_file.read().splitlines())
+
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery",
+                      side_effect=lambda query: Mock(
+                          asDataFrame=Mock(return_value=queries[query]))
+                      ) as patch_query,\
+         patch.object(synapsegenie.process_functions, "store_table_update",
+                      side_effect=store_table):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True)
+        assert patch_query.call_count == 2
+    test2_hash = row_hash(new_datadf.iloc[[1]]).iloc[0]
+    test4_hash = row_hash(new_datadf.iloc[[2]]).iloc[0]
+    assert stored == [[
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo,_ROW_HASH",
+        ",,SAGE,test4,4,{}".format(test4_hash),
+        "2,1,SAGE,test2,5,{}".format(test2_hash),
+        "3,1"]]
+
+
+def test_unchanged_rowhash_updateData():
+    """No rows are downloaded or stored when no row hash changed"""
+    row_hash = synapsegenie.process_functions._get_row_hash
+    databasedf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 2,
+        'ID': ['test1', 'test2'],
+        'foo': [1, 2]})
+    new_datadf = databasedf.copy()
+    databasedf['_ROW_HASH'] = row_hash(databasedf)
+    databasedf.index = ['1_1', '2_1']
+    columns = [Mock(), Mock(), Mock(), Mock()]
+    for column, name in zip(columns, ['CENTER', 'ID', 'foo', '_ROW_HASH']):
+        column.name = name
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID'])
+    hash_query = 'SELECT "ID","_ROW_HASH" FROM syn1234 where CENTER =\'SAGE\''
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery",
+                      return_value=Mock(asDataFrame=Mock(
+                          return_value=databasedf[['ID', '_ROW_HASH']]))
+                      ) as patch_query,\
+         patch.object(synapsegenie.process_functions,
+                      "store_table_update") as patch_store:
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE", toDelete=True)
+    patch_query.assert_called_once_with(hash_query)
+    patch_store.assert_not_called()
+
+
+def test_rebuild_updateDatabase(tmp_path):
+    """Tables are rebuilt when most rows change"""
+    database_csv = tmp_path / "query.csv"
+    database_csv.write_text(
+        "ROW_ID,ROW_VERSION,CENTER,ID,foo\n"
+        "1,1,SAGE,test1,1\n"
+        "2,1,SAGE,test2,2\n"
+        "3,1,TEST,test3,3\n"
+        "4,1,SAGE,test6,6\n"
+    )
+    columns = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="INTEGER")]
+    for column, name in zip(columns, ["CENTER", "ID", "foo"]):
+        column.name = name
+    databasedf = pd.DataFrame({
+        'CENTER': ['SAGE', 'SAGE', 'SAGE'],
+        'ID': ['test1', 'test2', 'test6'],
+        'foo': [1, 2, 6]}, index=['1_1', '2_1', '4_1'])
+    new_datadf = pd.DataFrame({
+        'CENTER': ['SAGE', 'SAGE', 'SAGE'],
+        'ID': ['test4', 'test5', 'test6'],
+        'foo': [4, float('nan'), 6]})
+    mappingdf = pd.DataFrame({'Database': ['clinical', 'main'],
+                              'Id': ['syn1234', 'syn2222']},
+                             index=['1_1', '2_1'])
+    table_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                     primaryKey=['ID'], id="syn1234")
+    new_table = synapseclient.Schema(name="foo new", parent="syn123",
+                                     id="syn5678")
+
+    def table_query(query, **kwargs):
+        if query == "SELECT * FROM syn3333":
+            return Mock(asDataFrame=Mock(return_value=mappingdf))
+        if query == "SELECT COUNT(*) FROM syn1234":
+            return Mock(asDataFrame=Mock(return_value=pd.DataFrame([[4]])))
+        assert query == "SELECT * FROM syn1234"
+        return csv_query_result(str(database_csv), columns)
+
+    def store(obj):
+        if isinstance(obj, synapseclient.Schema) and 'id' not in obj:
+            return new_table
+        stored.append(obj)
+        return obj
+
+    loaded = []
+    stored = []
+
+    def store_table(syn, database_synid, update_path, primary_key_cols):
+        with open(update_path) as update_file:
+            loaded.append((database_synid, update_file.read().splitlines()))
+
+    with patch.object(syn, "get", return_value=table_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery", side_effect=table_query),\
+         patch.object(syn, "store", side_effect=store),\
+         patch.object(synapsegenie.process_functions, "store_table_update",
+                      side_effect=store_table),\
+         patch.dict(synapsegenie.process_functions._REBUILT_TABLES),\
+         synapsegenie.process_functions.table_rebuilds("syn3333"):
+        synapsegenie.process_functions.updateDatabase(
+            syn, databasedf, new_datadf, "syn1234", ['ID'], to_delete=True)
+        assert synapsegenie.process_functions.get_current_table_id(
+            "syn1234") == "syn5678"
+    # Only the deleted rows are replaced, unchanged rows are kept
+    assert sorted(loaded) == [
+        ("syn5678", ["CENTER,ID,foo", "SAGE,test4,4", "SAGE,test5,"]),
+        ("syn5678", ["CENTER,ID,foo", "TEST,test3,3", "SAGE,test6,6"])]
+    mapping_table, archived = stored
+    assert mapping_table.asDataFrame()['Id'].tolist() == ['syn5678']
+    assert archived.name.startswith("ARCHIVED ")
+
+
+@pytest.mark.parametrize("databasedf,to_delete,table_rows", [
+    # Few rows of the whole table change
+    (pd.DataFrame({'ID': ['test1'], 'foo': [1]}, index=['1_1']), True, 100),
+    # Rows missing from the new dataset are kept
+    (pd.DataFrame({'ID': ['test1'], 'foo': [1]}, index=['1_1']), False, 1),
+    # The rows of an empty partition are appended
+    (pd.DataFrame(columns=['ID', 'foo']), True, 1),
+    # Only some columns are updated
+    (pd.DataFrame({'ID': ['test1']}, index=['1_1']), True, 1)
+])
+def test_no_rebuild_updateDatabase(databasedf, to_delete, table_rows):
+    """Tables are updated row by row unless a rebuild is safe and most
+    rows of the whole table change"""
+    columns = [Mock(columnType="STRING"), Mock(columnType="INTEGER")]
+    for column, name in zip(columns, ["ID", "foo"]):
+        column.name = name
+    new_datadf = pd.DataFrame({'ID': ['test2', 'test3'], 'foo': [2, 3]})
+    new_datadf = new_datadf[databasedf.columns]
+    with patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery",
+                      return_value=Mock(asDataFrame=Mock(
+                          return_value=pd.DataFrame([[table_rows]])))),\
+         patch.object(synapsegenie.process_functions,
+                      "rebuild_table") as patch_rebuild,\
+         patch.object(synapsegenie.process_functions.TableChangeSet,
+                      "apply") as patch_apply,\
+         synapsegenie.process_functions.table_rebuilds("syn3333"):
+        synapsegenie.process_functions.updateDatabase(
+            syn, databasedf, new_datadf, "syn1234", ['ID'],
+            to_delete=to_delete)
+    patch_rebuild.assert_not_called()
+    patch_apply.assert_called_once_with()
+
+
+def test_uncounted_no_rebuild_updateDatabase():
+    """The table isn't counted when few rows of the partition change"""
+    columns = [Mock(columnType="STRING"), Mock(columnType="INTEGER")]
+    for column, name in zip(columns, ["ID", "foo"]):
+        column.name = name
+    databasedf = pd.DataFrame({'ID': ['test1', 'test2', 'test3'],
+                               'foo': [1, 2, 3]},
+                              index=['1_1', '2_1', '3_1'])
+    new_datadf = pd.DataFrame({'ID': ['test1', 'test2', 'test3'],
+                               'foo': [1, 2, 4]})
+    with patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery") as patch_query,\
+         patch.object(synapsegenie.process_functions,
+                      "rebuild_table") as patch_rebuild,\
+         patch.object(synapsegenie.process_functions.TableChangeSet,
+                      "apply") as patch_apply,\
+         synapsegenie.process_functions.table_rebuilds("syn3333"):
+        synapsegenie.process_functions.updateDatabase(
+            syn, databasedf, new_datadf, "syn1234", ['ID'],
+            to_delete=True)
+    patch_query.assert_not_called()
+    patch_rebuild.assert_not_called()
+    patch_apply.assert_called_once_with()
+
+
+def test_rebuilt_table_updateDatabase():
+    """Updates of a rebuilt table go to the table that replaced it"""
+    columns = [Mock(columnType="STRING"), Mock(columnType="INTEGER")]
+    for column, name in zip(columns, ["ID", "foo"]):
+        column.name = name
+    new_datadf = pd.DataFrame({'ID': ['test1'], 'foo': [1]})
+    with patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(synapsegenie.process_functions.TableChangeSet,
+                      "apply"),\
+         patch.dict(synapsegenie.process_functions._REBUILT_TABLES,
+                    {"syn1234": "syn5678"}):
+        change_set = synapsegenie.process_functions.updateDatabase(
+            syn, pd.DataFrame(columns=['ID', 'foo']), new_datadf,
+            "syn1234", ['ID'])
+        assert change_set.database_synid == "syn5678"
+        # The rows of the rebuilt table aren't in the new table
+        with pytest.raises(ValueError, match="syn1234 was rebuilt"):
+            synapsegenie.process_functions.updateDatabase(
+                syn, pd.DataFrame({'ID': ['test1'], 'foo': [2]},
+                                  index=['1_1']),
+                new_datadf, "syn1234", ['ID'])
+
+
+def test_keyfetch_updateData():
+    """Only the rows with the keys of a small dataset are downloaded"""
+    databasedf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 3,
+        'ID': ['test1', 'test1', "it's"],
+        'SUB': [1, 2, 1],
+        'foo': [1, 2, 3]}, index=['1_1', '2_1', '3_1'])
+    new_datadf = pd.DataFrame({
+        'CENTER': ['SAGE'] * 3,
+        'ID': ['test1', "it's", 'test4'],
+        'SUB': [1, 2, 1],
+        'foo': [5, 3, 4]})
+    columns = [Mock(columnType="STRING"), Mock(columnType="STRING"),
+               Mock(columnType="INTEGER"), Mock(columnType="INTEGER")]
+    for column, name in zip(columns, ['CENTER', 'ID', 'SUB', 'foo']):
+        column.name = name
+    database_ent = synapseclient.Schema(name="foo", parent="syn123",
+                                        primaryKey=['ID', 'SUB'])
+    query = ("SELECT * FROM syn1234 where CENTER ='SAGE' AND "
+             "\"ID\" IN ('test1','it''s','test4') AND \"SUB\" IN (1,2)")
+    stored = []
+
+    def store_table(syn, database_synid, update_path, primary_key_cols):
+        with open(update_path) as update_file:
+            stored.append(update_file.read().splitlines())
+
+    with patch.object(syn, "get", return_value=database_ent),\
+         patch.object(syn, "getTableColumns", return_value=columns),\
+         patch.object(syn, "tableQuery",
+                      return_value=Mock(asDataFrame=Mock(
+                          return_value=databasedf))) as patch_query,\
+         patch.object(synapsegenie.process_functions, "store_table_update",
+                      side_effect=store_table):
+        synapsegenie.process_functions.updateData(
+            syn, "syn1234", new_datadf, "SAGE")
+        patch_query.assert_called_once_with(query)
+    # test1 2 and it's 1 match the queried values but not the keys
+    assert stored == [[
+        "ROW_ID,ROW_VERSION,CENTER,ID,SUB,foo",
+        ",,SAGE,it's,2,3",
+        ",,SAGE,test4,1,4",
+        "1,1,SAGE,test1,1,5"]]
@@ -0,0 +1,100 @@
+"""Tests processed_ledger.py"""
+from unittest import mock
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+import synapseclient
+
+from synapsegenie import (example_filetype_format, process_functions,
+                          processed_ledger)
+
+syn = mock.create_autospec(synapseclient.Synapse)
+
+
+class FileFormat(example_filetype_format.FileTypeFormat):
+    _fileType = "clinical"
+
+
+ENTRY = processed_ledger.ProcessedLedger.get_entry(
+    "syn1", "3333", "clinical", "syn222", FileFormat
+)
+
+
+class ledger_query_result(object):
+    def __init__(self, df):
+        self.df = df
+
+    def asDataFrame(self):
+        return self.df
+
+
+@pytest.fixture
+def ledger(tmpdir):
+    return processed_ledger.ProcessedLedger(
+        str(tmpdir.join("ledger", "processed.sqlite"))
+    )
+
+
+def test_record_is_processed(ledger):
+    """Recorded files are processed until they change"""
+    assert not ledger.is_processed(ENTRY)
+    ledger.record(ENTRY)
+    assert ledger.is_processed(ENTRY)
+    assert not ledger.is_processed(ENTRY._replace(md5="4444"))
+    assert not ledger.is_processed(ENTRY._replace(databaseSynId="syn333"))
+
+
+def test_force_is_processed(tmpdir):
+    """Every file is processed again when forced"""
+    ledger = processed_ledger.ProcessedLedger(
+        str(tmpdir.join("processed.sqlite")), force=True
+    )
+    ledger.record(ENTRY)
+    assert not ledger.is_processed(ENTRY)
+
+
+def test_dry_run_record(ledger):
+    """Files aren't recorded in a dry run"""
+    with process_functions.dry_run():
+        ledger.record(ENTRY)
+    assert not ledger.is_processed(ENTRY)
+
+
+def test_table_is_processed(tmpdir):
+    """Files recorded in the ledger table are processed"""
+    tabledf = pd.DataFrame([ENTRY], columns=processed_ledger.LEDGER_COLUMNS)
+    with patch.object(syn, "tableQuery",
+                      return_value=ledger_query_result(tabledf)):
+        ledger = processed_ledger.ProcessedLedger(
+            str(tmpdir.join("processed.sqlite")), syn=syn,
+            table_synid="syn555"
+        )
+    assert ledger.is_processed(ENTRY)
+
+
+def test_flush(tmpdir):
+    """Recorded files are stored in the ledger table"""
+    emptydf = pd.DataFrame(columns=processed_ledger.LEDGER_COLUMNS)
+    with patch.object(syn, "tableQuery",
+                      return_value=ledger_query_result(emptydf)),\
+         patch.object(process_functions, "updateDatabase") as patch_update:
+        ledger = processed_ledger.ProcessedLedger(
+            str(tmpdir.join("processed.sqlite")), syn=syn,
+            table_synid="syn555"
+        )
+        with processed_ledger.use_processed_ledger(ledger):
+            assert processed_ledger.get_processed_ledger() is ledger
+            ledger.record(ENTRY)
+        patch_update.assert_called_once()
+        recordeddf = patch_update.call_args[0][2]
+        assert recordeddf.to_dict('records') == [ENTRY._asdict()]
+    assert processed_ledger.get_processed_ledger() is None
+
+
+def test_get_ledger_table_synid():
+    mappingdf = pd.DataFrame({'Database': ['validationStatus',
+                                           'processedLedger'],
+                              'Id': ['syn333', 'syn555']})
+    assert processed_ledger.get_ledger_table_synid(mappingdf) == "syn555"
+    assert processed_ledger.get_ledger_table_synid(mappingdf[:1]) is None
@@ -0,0 +1,43 @@
+"""Tests run_journal.py"""
+import os
+
+import pytest
+
+from synapsegenie import run_journal
+
+
+def test_record_get(tmpdir):
+    """Recorded stages are kept across journals of the same run"""
+    journal = run_journal.RunJournal("run", directory=str(tmpdir))
+    assert journal.get("SAGE", run_journal.PROCESSED, "syn1") is None
+    journal.record("SAGE", run_journal.PROCESSED, "syn1", md5="3333")
+    journal.record("SAGE", run_journal.CENTER_DONE)
+    journal.close()
+
+    resumed = run_journal.RunJournal.resume("run", directory=str(tmpdir))
+    assert resumed.get("SAGE", run_journal.PROCESSED, "syn1")['md5'] == "3333"
+    assert resumed.get("SAGE", run_journal.CENTER_DONE) is not None
+    assert resumed.get("FOO", run_journal.CENTER_DONE) is None
+
+
+def test_partly_written_record(tmpdir):
+    """The partly written last record of a run that died is ignored"""
+    journal = run_journal.RunJournal("run", directory=str(tmpdir))
+    journal.record("SAGE", run_journal.PROCESSED, "syn1", md5="3333")
+    journal.close()
+    with open(os.path.join(journal.path, "SAGE.jsonl"), "a") as journal_file:
+        journal_file.write('{"center": "SAGE", "stage": "proc')
+
+    resumed = run_journal.RunJournal.resume("run", directory=str(tmpdir))
+    assert resumed.get("SAGE", run_journal.PROCESSED, "syn1") is not None
+    # Records appended after it are kept
+    resumed.record("SAGE", run_journal.PROCESSED, "syn2", md5="4444")
+    resumed.close()
+    resumed = run_journal.RunJournal.resume("run", directory=str(tmpdir))
+    assert resumed.get("SAGE", run_journal.PROCESSED, "syn2") is not None
+
+
+def test_missing_resume(tmpdir):
+    """Only runs with a journal can be resumed"""
+    with pytest.raises(ValueError, match="There is no journal of run foo"):
+        run_journal.RunJournal.resume("foo", directory=str(tmpdir))
@@ -65,6 +65,64 @@ def test_wrongfilename_noerror_determine_filetype():
         assert validator.file_type is None
 
 
+class ClinicalFormat(example_filetype_format.FileTypeFormat):
+    _fileType = "clinical"
+    _filename_patterns = [
+        "data_clinical_supp_{center}.txt",
+        ["data_clinical_supp_sample_{center}.txt",
+         "data_clinical_supp_patient_{center}.txt"]
+    ]
+
+
+class CnaFormat(example_filetype_format.FileTypeFormat):
+    _fileType = "cna"
+    _filename_patterns = [r"^data_CNA_{center}\.(txt|tsv)$"]
+
+
+@pytest.mark.parametrize("ent_list,filetype", [
+    ([CLIN_ENT], "clinical"),
+    ([PATIENT_ENT, SAMPLE_ENT], "clinical"),
+    ([CNA_ENT], "cna"),
+    ([SAMPLE_ENT], None),
+    ([WRONG_NAME_ENT], None)
+])
+def test_dispatch_index_determine_filetype(ent_list, filetype):
+    """File types are determined from the filename patterns without
+    creating the format classes"""
+    format_registry = config.FormatRegistry(clinical=ClinicalFormat,
+                                            cna=CnaFormat)
+    with patch.object(ClinicalFormat, "__init__") as patch_init:
+        validator = validate.GenieValidationHelper(
+            syn, None, CENTER, ent_list, format_registry=format_registry
+        )
+        assert validator.file_type == filetype
+        patch_init.assert_not_called()
+
+
+def test_legacy_fallback_determine_filetype():
+    """Format classes without filename patterns use _validateFilename"""
+    format_registry = config.FormatRegistry(cna=CnaFormat,
+                                            legacy=FileFormat)
+    with patch.object(FileFormat, "validateFilename",
+                      return_value="legacy") as patch_validate:
+        validator = validate.GenieValidationHelper(
+            syn, None, CENTER, [WRONG_NAME_ENT],
+            format_registry=format_registry
+        )
+        assert validator.file_type == "legacy"
+        patch_validate.assert_called_once_with(["wrong.txt"])
+
+
+def test_filename_patterns_validatefilename():
+    """Declared filename patterns are also checked by validateFilename"""
+    validator = ClinicalFormat(syn, CENTER)
+    assert validator.validateFilename(
+        ["dir/data_clinical_supp_SAGE.txt"]
+    ) == "clinical"
+    with pytest.raises(AssertionError):
+        validator.validateFilename(["data_clinical_supp_FOO.txt"])
+
+
 def test_valid_collect_errors_and_warnings():
     '''
     Tests if no error and warning strings are passed that
@@ -191,6 +249,33 @@ def test_wrongfiletype_validate_single_file():
         mock_determine_filetype.assert_called_once_with()
 
 
+def test_validation_session():
+    """The project, validators and reference data are shared by every file
+    of a session"""
+    project_ent = Mock(id='syn1234')
+    load = Mock(return_value=["code"])
+    with patch.object(syn, "get", return_value=project_ent) as patch_get,\
+         patch.object(FileFormat, "validate",
+                      return_value=(True, "", "")) as patch_validate:
+        session = validate.ValidationSession(
+            syn, "syn1234", format_registry={'clinical': FileFormat}
+        )
+        for entity in [CLIN_ENT, CNA_ENT]:
+            validator = session.helper(CENTER, [entity],
+                                       file_type="clinical")
+            valid, _ = validator.validate_single_file(oncotree_link=None,
+                                                      nosymbol_check=False)
+            assert valid
+        patch_get.assert_called_once_with("syn1234")
+    assert patch_validate.call_count == 2
+    format_validator = session.get_validator(FileFormat, CENTER)
+    assert format_validator is session.get_validator(FileFormat, CENTER)
+    assert format_validator.session is session
+    assert format_validator.get_reference_data("codes", load) == ["code"]
+    assert format_validator.get_reference_data("codes", load) == ["code"]
+    load.assert_called_once_with()
+
+
 def test_nopermission__check_parentid_permission_container():
     """Throws error if no permissions to access"""
     parentid = "syn123"
@@ -252,6 +337,7 @@ class argparser:
     nosymbol_check = False
     format_registry_packages = ["genie"]
     project_id = "syn1234"
+    validation_cache = None
 
     def asDataFrame(self):
         database_dict = {"Database": ["centerMapping", 'oncotreeLink'],
@@ -0,0 +1,91 @@
+"""Tests validation_cache.py"""
+from unittest import mock
+from unittest.mock import patch
+
+import pytest
+import synapseclient
+
+from synapsegenie import example_filetype_format, validate, validation_cache
+
+syn = mock.create_autospec(synapseclient.Synapse)
+
+
+class FileFormat(example_filetype_format.FileTypeFormat):
+    _fileType = "clinical"
+
+
+class ChangedFileFormat(example_filetype_format.FileTypeFormat):
+    _fileType = "clinical"
+    _validation_kwargs = ['nosymbol_check']
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return validation_cache.ValidationCache(
+        str(tmpdir.join("cache", "validation.sqlite"))
+    )
+
+
+def test_get_set(cache):
+    """Stored results are returned"""
+    assert cache.get("key") is None
+    cache.set("key", False, "error", "warning")
+    assert cache.get("key") == (False, "error", "warning")
+
+
+def test_get_key():
+    """Keys change with content, center and format class source"""
+    key = validation_cache.ValidationCache.get_key(
+        ['1'], "clinical", "SAGE", FileFormat, {'project_id': 'syn1'}
+    )
+    assert key == validation_cache.ValidationCache.get_key(
+        ['1'], "clinical", "SAGE", FileFormat, {'project_id': 'syn1'}
+    )
+    assert key != validation_cache.ValidationCache.get_key(
+        ['2'], "clinical", "SAGE", FileFormat, {'project_id': 'syn1'}
+    )
+    assert key != validation_cache.ValidationCache.get_key(
+        ['1'], "clinical", "FOO", FileFormat, {'project_id': 'syn1'}
+    )
+    assert key != validation_cache.ValidationCache.get_key(
+        ['1'], "clinical", "SAGE", ChangedFileFormat, {'project_id': 'syn1'}
+    )
+
+
+def test_lru_eviction(tmpdir):
+    """Least recently used results are evicted above max_bytes"""
+    cache = validation_cache.ValidationCache(
+        str(tmpdir.join("validation.sqlite")), max_bytes=40
+    )
+    with patch.object(validation_cache.time, "time",
+                      side_effect=[1, 2, 3, 4]):
+        cache.set("first", True, "", "0123456789")
+        cache.set("second", True, "", "0123456789")
+        # Using the first result makes the second the least recently used
+        cache.get("first")
+        cache.set("third", True, "", "0123456789")
+    assert cache.get("second") is None
+    assert cache.get("first") == (True, "", "0123456789")
+    assert cache.get("third") == (True, "", "0123456789")
+
+
+def test_cached_validate_single_file(cache, tmpdir):
+    """Files with the same content are only validated once"""
+    path = tmpdir.join("data_clinical_supp_SAGE.txt")
+    path.write("foo")
+    entity = synapseclient.File(name="data_clinical_supp_SAGE.txt",
+                                path=str(path), parentId="syn12345")
+    with validation_cache.use_validation_cache(cache),\
+         patch.object(FileFormat, "validate",
+                      return_value=(True, "", "")) as patch_validate:
+        for _ in range(2):
+            validator = validate.GenieValidationHelper(
+                syn, project_id="syn1234", center="SAGE",
+                entitylist=[entity], format_registry={'clinical': FileFormat},
+                file_type="clinical"
+            )
+            valid, message = validator.validate_single_file(
+                oncotree_link=None, nosymbol_check=False
+            )
+            assert valid
+        patch_validate.assert_called_once()